@@ -0,0 +1,90 @@
+"""
+Model menu page-render cost vs catalog size.
+
+Compares the old path (filter + sort the whole catalog on every page turn)
+with slicing the precomputed FreeModelIndex.
+
+    python -m benchmarks.bench_free_index
+"""
+import random
+import timeit
+
+from src.services.catalog import FreeModelIndex
+from src.services.model_info import ModelInfo
+from src.utils.keyboard import Keyboards
+
+PROVIDERS = ["google", "meta-llama", "mistralai", "deepseek", "qwen", "nousresearch", "cognitivecomputations", "tngtech"]
+
+
+def make_catalog(size: int) -> list[dict]:
+    rng = random.Random(size)
+    models = []
+    for i in range(size):
+        provider = rng.choice(PROVIDERS)
+        free = rng.random() < 0.4
+        price = "0" if free else f"{rng.random() / 1e5:.10f}"
+        models.append({
+            "id": f"{provider}/model-{i}" + (":free" if free else ""),
+            "name": f"{provider.title()} Model {i}",
+            "context_length": rng.choice([4096, 8192, 32768, 131072]),
+            "pricing": {"prompt": price, "completion": price},
+        })
+    return models
+
+
+def legacy_model_menu(models_list: list[dict], page: int):
+    # The pre-ModelInfo keyboard read names and ids out of the raw dicts
+    return Keyboards.model_menu("", [ModelInfoView(m) for m in models_list[page * 5:page * 5 + 5]])
+
+
+class ModelInfoView:
+    __slots__ = ("id", "name")
+
+    def __init__(self, model: dict):
+        self.id = model.get('id')
+        self.name = model.get('name', 'Unknown')
+
+
+def legacy_free_models(all_models: list[dict]) -> list[dict]:
+    # Verbatim copy of the per-request ranking that FreeModelIndex replaced
+    free_models = [
+        m for m in all_models
+        if float(m.get('pricing', {}).get('prompt', -1)) == 0
+        and float(m.get('pricing', {}).get('completion', -1)) == 0
+    ]
+    tier_1 = ["google/", "meta-llama/", "mistralai/", "microsoft/"]
+    tier_2 = ["deepseek/", "qwen/"]
+
+    def sort_key(model):
+        mid = model.get('id', '').lower()
+        context = int(model.get('context_length', 0))
+        score = 0
+        if any(k in mid for k in tier_1):
+            score += 10**12
+        elif any(k in mid for k in tier_2):
+            score += 10**9
+        if "chimera" in mid or "dolphin" in mid or "nous" in mid:
+            score -= 10**6
+        return score + context
+
+    free_models.sort(key=sort_key, reverse=True)
+    return free_models
+
+
+def main():
+    print(f"{'models':>8} {'legacy page (us)':>18} {'indexed page (us)':>18} {'index build (ms)':>17}")
+    for size in (100, 500, 1000, 5000, 10000):
+        catalog = make_catalog(size)
+        models = [ModelInfo.from_api(m) for m in catalog]
+        index = FreeModelIndex(models)
+        assert [m.id for m in index.ranked] == [m["id"] for m in legacy_free_models(catalog)]
+
+        runs = 200
+        legacy = timeit.timeit(lambda: legacy_model_menu(legacy_free_models(catalog), 3), number=runs) / runs
+        indexed = timeit.timeit(lambda: Keyboards.model_menu("", index.ranked, 3), number=runs) / runs
+        build = timeit.timeit(lambda: FreeModelIndex(models), number=5) / 5
+        print(f"{size:>8} {legacy * 1e6:>18.1f} {indexed * 1e6:>18.1f} {build * 1e3:>17.2f}")
+
+
+if __name__ == "__main__":
+    main()
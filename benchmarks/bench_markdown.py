@@ -0,0 +1,72 @@
+"""
+Streaming MarkdownV2 escaping cost vs reply length: the old loop (string
+concatenation per chunk, full re-escape with a freshly compiled pattern per
+edit) vs StreamingMarkdownBuffer, which escapes only appended text.
+
+    python -m benchmarks.bench_markdown
+"""
+import re
+import timeit
+
+from src.utils.markdown import StreamingMarkdownBuffer
+
+CHUNK = 16  # roughly what a model streams per delta
+EDIT_EVERY = 8  # chunks between Telegram edits
+
+
+def legacy_escape(text: str) -> str:
+    if not text:
+        return ""
+    pattern = re.compile(r'(```.*?```|`[^`]*`)', re.DOTALL)
+    escaped_parts = []
+    for part in pattern.split(text):
+        if part.startswith('`') or part.startswith('```'):
+            escaped_parts.append(part)
+        else:
+            escaped_parts.append(re.sub(r'([_*\[\]()~`>#+\-=|{}.!])', r'\\\1', part))
+    return "".join(escaped_parts)
+
+
+def make_reply(size: int) -> str:
+    paragraph = (
+        "Here is how it works (step 1): call `client.run()` and check the result! "
+        "Values like 3.14 or a-b must be escaped.\n\n"
+        "```python\nfor i in range(10):\n    print(i * 2)\n```\n\n"
+    )
+    return (paragraph * (size // len(paragraph) + 1))[:size]
+
+
+def legacy_stream(chunks: list[str]):
+    full_response = ""
+    for i, chunk in enumerate(chunks):
+        full_response += chunk
+        if i % EDIT_EVERY == 0:
+            legacy_escape(full_response + "...")
+    return legacy_escape(full_response)
+
+
+def buffered_stream(chunks: list[str]):
+    buffer = StreamingMarkdownBuffer()
+    for i, chunk in enumerate(chunks):
+        buffer.append(chunk)
+        if i % EDIT_EVERY == 0:
+            buffer.render("...")
+    return buffer.render()
+
+
+def main():
+    print(f"{'chars':>8} {'legacy stream (ms)':>19} {'buffer (ms)':>12} {'escape once (ms)':>17}")
+    for size in (4096, 16384, 65536):
+        reply = make_reply(size)
+        chunks = [reply[i:i + CHUNK] for i in range(0, len(reply), CHUNK)]
+        assert legacy_stream(chunks) == buffered_stream(chunks)
+
+        runs = 5
+        legacy = timeit.timeit(lambda: legacy_stream(chunks), number=runs) / runs
+        buffered = timeit.timeit(lambda: buffered_stream(chunks), number=runs) / runs
+        once = timeit.timeit(lambda: legacy_escape(reply), number=runs) / runs
+        print(f"{size:>8} {legacy * 1e3:>19.1f} {buffered * 1e3:>12.1f} {once * 1e3:>17.2f}")
+
+
+if __name__ == "__main__":
+    main()
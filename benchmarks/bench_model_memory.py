@@ -0,0 +1,73 @@
+"""
+Resident size of the model catalog: raw /models JSON dicts vs ModelInfo.
+
+Entries mimic the real API shape (architecture, endpoint pricing,
+top_provider, supported_parameters, long descriptions).
+
+    python -m benchmarks.bench_model_memory
+"""
+import gc
+import json
+import random
+import tracemalloc
+
+from src.services.model_info import ModelInfo
+
+PROVIDERS = ["google", "meta-llama", "mistralai", "deepseek", "qwen", "nousresearch", "openai", "anthropic"]
+
+
+def make_raw_catalog(size: int) -> str:
+    rng = random.Random(size)
+    models = []
+    for i in range(size):
+        provider = rng.choice(PROVIDERS)
+        free = rng.random() < 0.4
+        price = "0" if free else f"{rng.random() / 1e5:.10f}"
+        models.append({
+            "id": f"{provider}/model-{i}" + (":free" if free else ""),
+            "canonical_slug": f"{provider}/model-{i}-20250101",
+            "hugging_face_id": f"{provider}/Model-{i}-Instruct",
+            "name": f"{provider.title()}: Model {i}",
+            "created": 1735689600 + i,
+            "description": " ".join(rng.choice(["fast", "multilingual", "reasoning", "model", "tuned", "context", "instruct"]) for _ in range(120)),
+            "context_length": rng.choice([4096, 8192, 32768, 131072]),
+            "architecture": {
+                "modality": "text->text",
+                "input_modalities": ["text"],
+                "output_modalities": ["text"],
+                "tokenizer": "Other",
+                "instruct_type": None,
+            },
+            "pricing": {
+                "prompt": price, "completion": price, "request": "0", "image": "0",
+                "web_search": "0", "internal_reasoning": "0",
+            },
+            "top_provider": {"context_length": 131072, "max_completion_tokens": 8192, "is_moderated": False},
+            "per_request_limits": None,
+            "supported_parameters": ["max_tokens", "temperature", "top_p", "stop", "frequency_penalty", "presence_penalty", "seed", "tools"],
+        })
+    return json.dumps({"data": models})
+
+
+def measure(build) -> tuple[int, object]:
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, result
+
+
+def main():
+    print(f"{'models':>8} {'raw dicts (KiB)':>16} {'ModelInfo (KiB)':>16} {'ratio':>7}")
+    for size in (300, 1000, 5000):
+        payload = make_raw_catalog(size)
+        raw_size, raw = measure(lambda: json.loads(payload)["data"])
+        info_size, _ = measure(lambda: [ModelInfo.from_api(m) for m in json.loads(payload)["data"]])
+        print(f"{size:>8} {raw_size / 1024:>16.0f} {info_size / 1024:>16.0f} {raw_size / info_size:>6.1f}x")
+        del raw
+
+
+if __name__ == "__main__":
+    main()
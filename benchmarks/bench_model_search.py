@@ -0,0 +1,44 @@
+"""
+Model search latency vs catalog size: linear substring scan (old
+search_models) vs the inverted ModelSearchIndex, with the query cache off.
+
+    python -m benchmarks.bench_model_search
+"""
+import timeit
+
+from benchmarks.bench_free_index import make_catalog
+from src.services.model_info import ModelInfo
+from src.services.model_search import ModelSearchIndex
+
+QUERIES = ["google", "llama 70b", "model-42", "deepsek", "qwen model"]
+
+
+def legacy_search(all_models: list[dict], query: str) -> list[dict]:
+    query = query.lower().strip()
+    matches = [
+        m for m in all_models
+        if query in m.get('id', '').lower()
+        or query in m.get('name', '').lower()
+    ]
+    matches.sort(key=lambda x: int(x.get('context_length', 0)), reverse=True)
+    return matches[:10]
+
+
+def main():
+    print(f"{'models':>8} {'legacy scan (us)':>17} {'index (us)':>11} {'build (ms)':>11}")
+    for size in (100, 1000, 5000, 10000):
+        catalog = make_catalog(size)
+        for i, model in enumerate(catalog):
+            model["description"] = f"Instruction tuned model number {i} with long context support"
+        models = [ModelInfo.from_api(m) for m in catalog]
+        index = ModelSearchIndex(models, cache_size=0)
+
+        runs = 50
+        legacy = timeit.timeit(lambda: [legacy_search(catalog, q) for q in QUERIES], number=runs) / runs / len(QUERIES)
+        indexed = timeit.timeit(lambda: [index.search(q) for q in QUERIES], number=runs) / runs / len(QUERIES)
+        build = timeit.timeit(lambda: ModelSearchIndex(models), number=3) / 3
+        print(f"{size:>8} {legacy * 1e6:>17.1f} {indexed * 1e6:>11.1f} {build * 1e3:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Commits per Telegram update on a file-backed SQLite database: the old
+pattern (every user_service call commits; history rewritten as a JSON
+blob; one session held for the whole update) vs one unit of work per
+update with queued writes and short-lived read sessions.
+
+Every write commit is at least one fsync (journal_mode=DELETE syncs the
+rollback journal and the database file), so write commits are the fsync
+count to compare; the timings include them with synchronous=FULL. The
+usage ledger's periodic flush (one commit per USAGE_FLUSH_INTERVAL for
+all users) is not included.
+
+The second table runs concurrent chat updates whose model call is
+simulated by a sleep, on a pool of POOL_SIZE connections: holding the
+session across the call serializes them on the pool.
+
+    python -m benchmarks.bench_unit_of_work
+"""
+import asyncio
+import json
+import os
+import tempfile
+import time
+
+from sqlalchemy import event, select, update
+from sqlalchemy.orm import undefer
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+
+from src.database.core import Base, UnitOfWork
+from src.database.models import User
+from src.services.conversation import append_messages, load_recent_messages
+from src.services.user_service import get_or_create_user, get_user, increment_usage, set_user_state, user_cache
+
+USERS = 20
+UPDATES = 200  # per scenario, spread over the users
+POOL_SIZE = 2
+GENERATION = 0.2  # seconds of simulated streaming per concurrent update
+
+
+async def legacy_message(session: AsyncSession, telegram_id: int, text: str = "hello"):
+    # The old handler loaded the whole row, history blob included
+    user = await session.scalar(select(User).options(undefer(User.context_history)).where(User.id == telegram_id))
+    if not user:
+        user = User(id=telegram_id, username="u", full_name="U")
+        session.add(user)
+        await session.commit()
+    history = json.loads(user.context_history or "[]")
+    history += [{"role": "user", "content": text}, {"role": "assistant", "content": "answer " * 50}]
+    await session.execute(update(User).where(User.id == telegram_id).values(context_history=json.dumps(history)))
+    await session.commit()
+    await session.execute(update(User).where(User.id == telegram_id).values(usage_count=User.usage_count + 1))
+    await session.commit()
+
+
+async def legacy_callback(session: AsyncSession, telegram_id: int):
+    await session.get(User, telegram_id)
+    await session.execute(update(User).where(User.id == telegram_id).values(state=None, state_data=None))
+    await session.commit()
+
+
+async def uow_message(uow: UnitOfWork, telegram_id: int, text: str = "hello"):
+    await get_or_create_user(uow, telegram_id, "u", "U")
+    await load_recent_messages(uow, telegram_id, 100)
+    append_messages(uow, telegram_id, [
+        {"role": "user", "content": text}, {"role": "assistant", "content": "answer " * 50}
+    ])
+    increment_usage(telegram_id)
+
+
+async def uow_callback(uow: UnitOfWork, telegram_id: int):
+    user = await get_user(uow, telegram_id)
+    if user.state or user.state_data:
+        await set_user_state(uow, telegram_id, None)
+
+
+async def legacy_generation(session: AsyncSession, telegram_id: int):
+    await session.get(User, telegram_id)
+    await asyncio.sleep(GENERATION)
+    await session.execute(update(User).where(User.id == telegram_id).values(usage_count=User.usage_count + 1))
+    await session.commit()
+
+
+async def uow_generation(uow: UnitOfWork, telegram_id: int):
+    await get_user(uow, telegram_id)
+    await asyncio.sleep(GENERATION)
+    uow.add(update(User).where(User.id == telegram_id).values(usage_count=User.usage_count + 1))
+
+
+def scope(variant: str, sessions):
+    """What one update runs in: a session for the old code, a UnitOfWork now."""
+    return sessions() if variant == "legacy" else UnitOfWork(sessions)
+
+
+async def run(variant: str, handler, path: str, concurrency: int = 1) -> tuple[int, int, float]:
+    engine = create_async_engine(f"sqlite+aiosqlite:///{path}", pool_size=POOL_SIZE, max_overflow=0)
+    stats = {"commits": 0, "writes": 0}
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def synchronous_full(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA synchronous=FULL")
+        cursor.close()
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def track_writes(conn, cursor, statement, *args):
+        if not statement.lstrip().upper().startswith("SELECT"):
+            conn.info["wrote"] = True
+
+    @event.listens_for(engine.sync_engine, "commit")
+    def count_commit(conn):
+        stats["commits"] += 1
+        stats["writes"] += conn.info.pop("wrote", False)
+
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    stats.update(commits=0, writes=0)
+    user_cache.clear()
+    sessions = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False, autoflush=False)
+
+    async def one(i: int):
+        async with scope(variant, sessions) as target:
+            await handler(target, i % USERS)
+
+    started = time.perf_counter()
+    for i in range(0, UPDATES, concurrency):
+        await asyncio.gather(*(one(j) for j in range(i, min(i + concurrency, UPDATES))))
+    elapsed = time.perf_counter() - started
+    await engine.dispose()
+    return stats["commits"], stats["writes"], elapsed
+
+
+async def main():
+    scenarios = [
+        ("message", legacy_message, uow_message),
+        ("button", legacy_callback, uow_callback),
+    ]
+    print(f"{'update':>8} {'variant':>8} {'commits/upd':>12} {'write commits (fsyncs)/upd':>27} {'ms/upd':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, legacy, uow in scenarios:
+            for variant, handler in (("legacy", legacy), ("uow", uow)):
+                path = os.path.join(tmp, f"{name}-{variant}.db")
+                if name == "button":
+                    # Buttons are pressed by existing users
+                    await run(variant, legacy_message if variant == "legacy" else uow_message, path)
+                commits, writes, elapsed = await run(variant, handler, path)
+                print(f"{name:>8} {variant:>8} {commits / UPDATES:>12.2f} {writes / UPDATES:>27.2f} {elapsed / UPDATES * 1e3:>8.2f}")
+
+        print(f"\n{USERS} concurrent updates, {GENERATION}s model call each, pool of {POOL_SIZE}")
+        print(f"{'variant':>8} {'wall (s) per wave':>18}")
+        for variant, seed, handler in (("legacy", legacy_message, legacy_generation), ("uow", uow_message, uow_generation)):
+            path = os.path.join(tmp, f"concurrent-{variant}.db")
+            await run(variant, seed, path)
+            _, _, elapsed = await run(variant, handler, path, concurrency=USERS)
+            print(f"{variant:>8} {elapsed / (UPDATES / USERS):>18.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
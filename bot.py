@@ -7,6 +7,15 @@ from src.handlers.command import start_command
 from src.handlers.message import message_handler
 from src.handlers.callback import callback_handler
 from src.handlers.admin import admin_stats, admin_ban_user, admin_unban_user, admin_logs
+from src.services.openrouter import client_pool
+from src.services.scheduler import outbound_scheduler
+from src.services.catalog import model_catalog
+from src.services.telemetry import model_telemetry
+from src.services.summarizer import summarizer
+from src.services.usage import usage_ledger
+from src.database import get_db
+from src.utils.rate_limiter import TelegramRateLimiter
+from src.utils.update_processor import PerUserUpdateProcessor
 
 from telegram.request import HTTPXRequest
 from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, CallbackQueryHandler, filters, ContextTypes
@@ -15,6 +24,10 @@ from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, Cal
 async def post_init(app):
     await init_db()
     print("Database initialized.")
+
+    # Serve the last known model list right away; the refresh job revalidates it
+    model_catalog.load_snapshot()
+    model_telemetry.load()
     
     # Check Token validity
     try:
@@ -31,6 +44,36 @@ async def post_init(app):
     except Exception as e:
         print(f"Warning: Failed to delete webhook: {e}")
 
+    # Open keep-alive connections to OpenRouter before the first user message
+    await client_pool.warmup()
+    app.job_queue.run_repeating(close_idle_clients, interval=60, first=60)
+    app.job_queue.run_repeating(refresh_catalog, interval=Config.CATALOG_REFRESH_INTERVAL, first=0)
+    app.job_queue.run_repeating(publish_telemetry, interval=Config.TELEMETRY_PUBLISH_INTERVAL, first=Config.TELEMETRY_PUBLISH_INTERVAL)
+    app.job_queue.run_repeating(flush_usage, interval=Config.USAGE_FLUSH_INTERVAL, first=Config.USAGE_FLUSH_INTERVAL)
+
+async def post_shutdown(app):
+    await summarizer.close()
+    await flush_usage(None)
+    await client_pool.close()
+    await model_catalog.close()
+    model_telemetry.publish()
+    model_telemetry.save()
+
+async def refresh_catalog(context: ContextTypes.DEFAULT_TYPE):
+    await model_catalog.refresh()
+
+async def publish_telemetry(context: ContextTypes.DEFAULT_TYPE):
+    model_telemetry.publish()
+    await asyncio.to_thread(model_telemetry.save)
+
+async def flush_usage(context: ContextTypes.DEFAULT_TYPE):
+    async for session in get_db():
+        await usage_ledger.flush(session)
+
+async def close_idle_clients(context: ContextTypes.DEFAULT_TYPE):
+    client_pool.close_idle()
+    outbound_scheduler.prune()
+
 async def error_handler(update, context):
     print(f"Update {update} caused error {context.error}")
 
@@ -43,7 +86,10 @@ def main():
         return
 
     request = HTTPXRequest(connection_pool_size=8, connect_timeout=30.0, read_timeout=30.0)
-    app = ApplicationBuilder().token(Config.TELEGRAM_BOT_TOKEN).request(request).post_init(post_init).build()
+    builder = ApplicationBuilder().token(Config.TELEGRAM_BOT_TOKEN).request(request).post_init(post_init).post_shutdown(post_shutdown)
+    builder = builder.rate_limiter(TelegramRateLimiter())
+    # Handle users in parallel, each user's updates in order; upstream concurrency is bounded per API key by the scheduler
+    app = builder.concurrent_updates(PerUserUpdateProcessor(Config.CONCURRENT_UPDATES)).build()
     
     app.add_error_handler(error_handler)
 
@@ -0,0 +1,118 @@
+"""Move context_history JSON blobs into conversation_messages
+
+Revision ID: 3c5e9a1d7b42
+Revises: 7f098e72bf7b
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+import json
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3c5e9a1d7b42'
+down_revision: Union[str, Sequence[str], None] = '7f098e72bf7b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 500
+# How many of the newest turns are written back into the blob on downgrade
+DOWNGRADE_KEEP = 20
+
+users = sa.table(
+    'users',
+    sa.column('id', sa.BigInteger),
+    sa.column('context_history', sa.Text),
+)
+messages = sa.table(
+    'conversation_messages',
+    sa.column('user_id', sa.BigInteger),
+    sa.column('seq', sa.Integer),
+    sa.column('role', sa.String),
+    sa.column('content', sa.Text),
+)
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    tables = inspector.get_table_names()
+
+    if 'conversation_messages' not in tables:
+        op.create_table(
+            'conversation_messages',
+            sa.Column('id', sa.Integer(), primary_key=True, autoincrement=True),
+            sa.Column('user_id', sa.BigInteger(), sa.ForeignKey('users.id'), nullable=False),
+            sa.Column('seq', sa.Integer(), nullable=False),
+            sa.Column('role', sa.String(), nullable=False),
+            sa.Column('content', sa.Text(), nullable=False),
+            sa.Column('token_count', sa.Integer(), nullable=True),
+            sa.Column('tokenizer', sa.String(), nullable=True),
+            sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+        )
+    indexes = {index['name'] for index in sa.inspect(bind).get_indexes('conversation_messages')}
+    if 'ix_conversation_messages_user_seq' not in indexes:
+        op.create_index('ix_conversation_messages_user_seq', 'conversation_messages', ['user_id', 'seq'], unique=True)
+
+    if 'users' not in tables or 'context_history' not in {c['name'] for c in inspector.get_columns('users')}:
+        return
+
+    # Move blobs over in batches, keyed by user id so each batch is a cheap range scan
+    last_id = None
+    while True:
+        query = sa.select(users.c.id, users.c.context_history).where(
+            users.c.context_history.is_not(None), users.c.context_history != '[]'
+        )
+        if last_id is not None:
+            query = query.where(users.c.id > last_id)
+        batch = bind.execute(query.order_by(users.c.id).limit(BATCH_SIZE)).all()
+        if not batch:
+            break
+
+        rows = []
+        for user_id, blob in batch:
+            try:
+                history = json.loads(blob)
+            except ValueError:
+                continue
+            if not isinstance(history, list):
+                continue
+            # Users that already have rows (e.g. imported on first read by the bot) are left alone
+            if bind.execute(sa.select(messages.c.seq).where(messages.c.user_id == user_id).limit(1)).first():
+                continue
+            valid = [m for m in history if isinstance(m, dict) and 'role' in m and 'content' in m]
+            rows.extend(
+                {'user_id': user_id, 'seq': seq, 'role': m['role'], 'content': m['content']}
+                for seq, m in enumerate(valid)
+            )
+        if rows:
+            bind.execute(messages.insert(), rows)
+        ids = [user_id for user_id, _ in batch]
+        bind.execute(users.update().where(users.c.id.in_(ids)).values(context_history='[]'))
+        last_id = ids[-1]
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    if 'conversation_messages' not in sa.inspect(bind).get_table_names():
+        return
+
+    user_ids = [row[0] for row in bind.execute(sa.select(messages.c.user_id).distinct())]
+    for start in range(0, len(user_ids), BATCH_SIZE):
+        for user_id in user_ids[start:start + BATCH_SIZE]:
+            recent = bind.execute(
+                sa.select(messages.c.role, messages.c.content)
+                .where(messages.c.user_id == user_id)
+                .order_by(messages.c.seq.desc())
+                .limit(DOWNGRADE_KEEP)
+            ).all()
+            history = [{'role': role, 'content': content} for role, content in reversed(recent)]
+            bind.execute(users.update().where(users.c.id == user_id).values(context_history=json.dumps(history)))
+
+    op.drop_index('ix_conversation_messages_user_seq', table_name='conversation_messages')
+    op.drop_table('conversation_messages')
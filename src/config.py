@@ -10,6 +10,80 @@ class Config:
     DATABASE_URL = os.getenv("DATABASE_URL", "sqlite+aiosqlite:///./data/bot.db")
     LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 
+    # OpenRouter connection pooling
+    OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
+    CLIENT_POOL_MAX_KEYS = int(os.getenv("CLIENT_POOL_MAX_KEYS", "64"))
+    CLIENT_POOL_IDLE_TIMEOUT = int(os.getenv("CLIENT_POOL_IDLE_TIMEOUT", "600"))  # seconds
+    CLIENT_POOL_WARM_CONNECTIONS = int(os.getenv("CLIENT_POOL_WARM_CONNECTIONS", "4"))
+
+    # Model catalog
+    CATALOG_REFRESH_INTERVAL = int(os.getenv("CATALOG_REFRESH_INTERVAL", "900"))  # seconds
+    CATALOG_TTL = int(os.getenv("CATALOG_TTL", "3600"))  # seconds before a read triggers a refresh
+    CATALOG_SNAPSHOT_PATH = os.getenv("CATALOG_SNAPSHOT_PATH", "data/models_snapshot.pickle")
+
+    # Failover between free models
+    FAILOVER_MAX_MODELS = int(os.getenv("FAILOVER_MAX_MODELS", "2"))  # fallbacks tried after the chosen model
+    BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", "3"))
+    BREAKER_COOLDOWN = int(os.getenv("BREAKER_COOLDOWN", "60"))  # seconds before a half-open probe
+
+    # Hedged requests: "off", "delay" (start an alternate after HEDGE_DELAY of silence) or "fast" (race immediately)
+    HEDGE_MODE = os.getenv("HEDGE_MODE", "off").lower()
+    HEDGE_DELAY = float(os.getenv("HEDGE_DELAY", "4.0"))  # seconds without a first token
+
+    # Exact-match response cache for first-turn prompts
+    RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+    RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+    RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", "3600"))  # seconds
+
+    # Share one upstream stream between concurrent identical requests
+    COALESCE_ENABLED = os.getenv("COALESCE_ENABLED", "true").lower() in ("1", "true", "yes")
+
+    # Fair-share scheduling of upstream generations per API key
+    CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "64"))  # Telegram updates processed in parallel, one at a time per user
+    SCHEDULER_SHARED_KEY_CONCURRENCY = int(os.getenv("SCHEDULER_SHARED_KEY_CONCURRENCY", "16"))
+    SCHEDULER_CUSTOM_KEY_CONCURRENCY = int(os.getenv("SCHEDULER_CUSTOM_KEY_CONCURRENCY", "4"))
+    SCHEDULER_MAX_WAIT = int(os.getenv("SCHEDULER_MAX_WAIT", "60"))  # seconds in queue before a request is shed
+    SCHEDULER_UNLIMITED_WEIGHT = float(os.getenv("SCHEDULER_UNLIMITED_WEIGHT", "3"))
+
+    # Conversation context assembly
+    CONTEXT_HISTORY_MAX_MESSAGES = int(os.getenv("CONTEXT_HISTORY_MAX_MESSAGES", "100"))  # newest turns read per message; older ones are deleted
+    CONTEXT_DEFAULT_LENGTH = int(os.getenv("CONTEXT_DEFAULT_LENGTH", "8192"))  # when the catalog doesn't know the model
+    CONTEXT_COMPLETION_RESERVE = int(os.getenv("CONTEXT_COMPLETION_RESERVE", "2048"))
+    CONTEXT_MAX_PROMPT_TOKENS = int(os.getenv("CONTEXT_MAX_PROMPT_TOKENS", "65536"))
+
+    # Rolling summarization of long conversations
+    SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "false").lower() in ("1", "true", "yes")
+    SUMMARY_TRIGGER_TOKENS = int(os.getenv("SUMMARY_TRIGGER_TOKENS", "6000"))  # history size that starts a compaction
+    SUMMARY_KEEP_TOKENS = int(os.getenv("SUMMARY_KEEP_TOKENS", "2000"))  # recent turns kept verbatim
+    SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "")  # empty: best-ranked free model
+
+    # Streaming replies
+    STREAM_TYPING_INDICATOR = os.getenv("STREAM_TYPING_INDICATOR", "false").lower() in ("1", "true", "yes")  # instead of "⏳ Thinking..."
+    STREAM_EDIT_MIN_INTERVAL = float(os.getenv("STREAM_EDIT_MIN_INTERVAL", "1.0"))
+    STREAM_EDIT_MAX_INTERVAL = float(os.getenv("STREAM_EDIT_MAX_INTERVAL", "6.0"))
+
+    # Outbound Telegram rate limiting (Bot API flood limits)
+    TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))  # requests per second across all chats
+    TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))  # per private chat
+    TELEGRAM_GROUP_RATE = float(os.getenv("TELEGRAM_GROUP_RATE", "0.33"))  # per group (20 per minute)
+    TELEGRAM_CHAT_BURST = float(os.getenv("TELEGRAM_CHAT_BURST", "3"))
+    TELEGRAM_STREAM_MAX_WAIT = float(os.getenv("TELEGRAM_STREAM_MAX_WAIT", "2"))  # streaming edits are dropped beyond this
+    TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "2"))  # after RetryAfter, for regular requests
+
+    # Token usage ledger and write-behind request counters
+    USAGE_FLUSH_INTERVAL = int(os.getenv("USAGE_FLUSH_INTERVAL", "5"))  # seconds between batched writes; bounds what a crash loses
+    USAGE_STATS_DAYS = int(os.getenv("USAGE_STATS_DAYS", "7"))
+
+    # In-process cache of user profiles (write-through from user_service)
+    USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+    USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "300"))  # seconds; bounds staleness from edits made outside the bot
+
+    # Live model telemetry
+    TELEMETRY_WINDOW = int(os.getenv("TELEMETRY_WINDOW", "1800"))  # seconds of samples kept per model
+    TELEMETRY_PUBLISH_INTERVAL = int(os.getenv("TELEMETRY_PUBLISH_INTERVAL", "60"))
+    TELEMETRY_PATH = os.getenv("TELEMETRY_PATH", "data/model_stats.json")
+
     @classmethod
     def check_config(cls):
         if not cls.TELEGRAM_BOT_TOKEN:
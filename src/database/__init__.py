@@ -1,2 +1,2 @@
-from .core import get_db, init_db, AsyncSessionLocal
-from .models import User, ErrorLog
+from .core import get_db, init_db, AsyncSessionLocal, UnitOfWork
+from .models import User, ErrorLog, UsageRecord, ConversationMessage
@@ -1,6 +1,8 @@
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.orm import DeclarativeBase
 from src.config import Config
+from src.services.metrics import metrics
 
 engine = create_async_engine(Config.DATABASE_URL, echo=False)
 
@@ -18,16 +20,70 @@ async def get_db():
     async with AsyncSessionLocal() as session:
         yield session
 
+class UnitOfWork:
+    """
+    The writes of one update, committed together in a single transaction at
+    the end (or not at all when nothing changed). It holds no connection in
+    between: reads borrow a short-lived session each and writes are only
+    queued, so nothing is pinned while the update awaits OpenRouter or
+    Telegram. Writes are discarded only when the exception escaping
+    `async with` is a database error: a failed Telegram call after a change
+    (as when each call committed right away) still keeps the change.
+    """
+
+    def __init__(self, session_factory=None):
+        self._session_factory = session_factory or AsyncSessionLocal
+        self._statements: list[tuple] = []
+        self._after_commit: list = []
+
+    def read(self) -> AsyncSession:
+        """A session for a few reads: `async with uow.read() as session: ...`"""
+        return self._session_factory()
+
+    def add(self, statement, params=None, after_commit=None):
+        """Queues a write, and optionally a callback to run once it is committed."""
+        self._statements.append((statement, params))
+        if after_commit is not None:
+            self._after_commit.append(after_commit)
+
+    def after_commit(self, callback):
+        self._after_commit.append(callback)
+
+    async def commit(self) -> bool:
+        """Runs the queued writes in one transaction; False if there were none."""
+        statements, self._statements = self._statements, []
+        callbacks, self._after_commit = self._after_commit, []
+        if statements:
+            async with self._session_factory() as session, session.begin():
+                for statement, params in statements:
+                    await session.execute(statement, params)
+            metrics.inc("db.commits")
+        for callback in callbacks:
+            callback()
+        return bool(statements)
+
+    async def __aenter__(self) -> "UnitOfWork":
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None or not issubclass(exc_type, SQLAlchemyError):
+            await self.commit()
+
 from sqlalchemy import text
 
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
         
-        # Simple migration for context_history
-        try:
-            await conn.execute(text("ALTER TABLE users ADD COLUMN context_history TEXT DEFAULT '[]'"))
-            print("Migrated: Added context_history column.")
-        except Exception:
-            # Column likely exists
-            pass
+        # Simple migrations for columns added after the first release
+        for column, ddl in (
+            ("context_history", "TEXT DEFAULT '[]'"),
+            ("use_response_cache", "BOOLEAN DEFAULT 1"),
+            ("context_summary", "TEXT"),
+        ):
+            try:
+                await conn.execute(text(f"ALTER TABLE users ADD COLUMN {column} {ddl}"))
+                print(f"Migrated: Added {column} column.")
+            except Exception:
+                # Column likely exists
+                pass
@@ -1,6 +1,6 @@
 from datetime import datetime
 from typing import Optional
-from sqlalchemy import BigInteger, String, Boolean, DateTime, Text, Integer, ForeignKey
+from sqlalchemy import BigInteger, String, Boolean, DateTime, Text, Integer, Float, ForeignKey, Index
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 from sqlalchemy.sql import func
 from src.database.core import Base
@@ -19,13 +19,16 @@ class User(Base):
     current_role: Mapped[str] = mapped_column(String, default="assistant")
     usage_count: Mapped[int] = mapped_column(Integer, default=0)
     is_unlimited: Mapped[bool] = mapped_column(Boolean, default=False)
+    use_response_cache: Mapped[bool] = mapped_column(Boolean, default=True)  # custom-key users may opt out
     
     # State management
     state: Mapped[Optional[str]] = mapped_column(String, nullable=True)
     state_data: Mapped[Optional[str]] = mapped_column(String, nullable=True) # JSON string
     
     # History
-    context_history: Mapped[Optional[str]] = mapped_column(Text, default="[]") # JSON list of messages
+    # Legacy JSON list of messages, moved into conversation_messages; deferred so user lookups don't load it
+    context_history: Mapped[Optional[str]] = mapped_column(Text, default="[]", deferred=True)
+    context_summary: Mapped[Optional[str]] = mapped_column(Text, nullable=True)  # rolling summary of compacted turns
 
 
     error_logs: Mapped[list["ErrorLog"]] = relationship(back_populates="user")
@@ -40,3 +43,31 @@ class ErrorLog(Base):
     traceback: Mapped[str] = mapped_column(Text)
 
     user: Mapped["User"] = relationship(back_populates="error_logs")
+
+class UsageRecord(Base):
+    """Append-only ledger of upstream requests and the tokens they consumed."""
+    __tablename__ = "usage_records"
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    user_id: Mapped[int] = mapped_column(BigInteger, index=True)
+    model: Mapped[str] = mapped_column(String)
+    key_type: Mapped[str] = mapped_column(String)  # "shared" or "custom"
+    prompt_tokens: Mapped[int] = mapped_column(Integer, default=0)
+    completion_tokens: Mapped[int] = mapped_column(Integer, default=0)
+    cost: Mapped[Optional[float]] = mapped_column(Float, nullable=True)
+    latency_ms: Mapped[int] = mapped_column(Integer, default=0)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), index=True)
+
+class ConversationMessage(Base):
+    """One chat turn; appended per message and read back as a window of the newest turns."""
+    __tablename__ = "conversation_messages"
+    __table_args__ = (Index("ix_conversation_messages_user_seq", "user_id", "seq", unique=True),)
+
+    id: Mapped[int] = mapped_column(Integer, primary_key=True, autoincrement=True)
+    user_id: Mapped[int] = mapped_column(ForeignKey("users.id"))
+    seq: Mapped[int] = mapped_column(Integer)  # position in the user's conversation
+    role: Mapped[str] = mapped_column(String)
+    content: Mapped[str] = mapped_column(Text)
+    token_count: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    tokenizer: Mapped[Optional[str]] = mapped_column(String, nullable=True)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), server_default=func.now())
@@ -1,40 +1,71 @@
 from telegram import Update
 from telegram.ext import ContextTypes
 from src.config import Config
-from src.database import get_db
-from sqlalchemy import select, func, desc, update
+from src.database import AsyncSessionLocal, UnitOfWork
+from sqlalchemy import select, func, desc
 from src.database.models import User, ErrorLog
+from src.services.metrics import metrics
+from src.services.response_cache import response_cache
+from src.services.usage import usage_by_model, usage_by_day, usage_ledger, top_users_by_requests
+from src.services.user_service import set_user_banned, user_cache
 import io
 
 async def admin_check(user_id: int) -> bool:
     return user_id == Config.ADMIN_ID
 
+def runtime_stats_text() -> str:
+    # In-process counters since the last restart (hedging, caches, ...)
+    lines = [f"`{name}`: {value}" for name, value in metrics.snapshot().items()]
+    if Config.RESPONSE_CACHE_ENABLED:
+        lines.append(f"Response cache: {len(response_cache)} entries, {response_cache.size_bytes // 1024} KiB")
+    hit_rate = user_cache.hit_rate()
+    if hit_rate is not None:
+        lines.append(f"User cache: {len(user_cache)} profiles, {hit_rate:.0%} hits")
+    if not lines:
+        return ""
+    return "\n\n⚙️ **Runtime:**\n" + "\n".join(lines)
+
+async def usage_stats_text(session) -> str:
+    # Records still buffered in the ledger are merged in, so the numbers are current
+    pending = usage_ledger.pending_records()
+    by_model = await usage_by_model(session, Config.USAGE_STATS_DAYS, pending)
+    if not by_model:
+        return ""
+    lines = [f"\n\n🧮 **Tokens ({Config.USAGE_STATS_DAYS}d, prompt/completion):**"]
+    for model, requests, prompt, completion, cost in by_model[:10]:
+        line = f"`{model}`: {prompt}/{completion} in {requests} req"
+        if cost:
+            line += f", ${cost:.4f}"
+        lines.append(line)
+    lines.append("")
+    for day, requests, prompt, completion in await usage_by_day(session, Config.USAGE_STATS_DAYS, pending):
+        lines.append(f"{day}: {prompt}/{completion} in {requests} req")
+    return "\n".join(lines)
+
 async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     if not await admin_check(user_id): return
     
-    async for session in get_db():
+    async with AsyncSessionLocal() as session:
         # Count total users
         result_users = await session.execute(select(func.count(User.id)))
         total_users = result_users.scalar()
         
-        # Sum total requests
-        result_req = await session.execute(select(func.sum(User.usage_count)))
-        total_requests = result_req.scalar() or 0
-        
-        # Get top 5 users by usage
-        result_top = await session.execute(select(User).order_by(desc(User.usage_count)).limit(5))
-        top_users = result_top.scalars().all()
-        
-        top_text = "\n".join([f"{u.id} ({u.full_name}): {u.usage_count}" for u in top_users])
+        # Total requests and top 5 users, including counts not flushed yet
+        total_requests, top_users = await top_users_by_requests(session, 5, usage_ledger.pending_counts())
+        usage_text = await usage_stats_text(session)
         
-        await update.message.reply_text(
-            f"📊 **Statistics**\n\n"
-            f"Total Users: {total_users}\n"
-            f"Total Requests: {total_requests}\n\n"
-            f"🏆 **Top Active Users:**\n{top_text}",
-            parse_mode="Markdown"
-        )
+    top_text = "\n".join([f"{uid} ({name}): {count}" for uid, name, count in top_users])
+    
+    await update.message.reply_text(
+        f"📊 **Statistics**\n\n"
+        f"Total Users: {total_users}\n"
+        f"Total Requests: {total_requests}\n\n"
+        f"🏆 **Top Active Users:**\n{top_text}"
+        f"{usage_text}"
+        f"{runtime_stats_text()}",
+        parse_mode="Markdown"
+    )
 
 async def admin_ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Usage: /ban <user_id>
@@ -43,11 +74,9 @@ async def admin_ban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         user_to_ban = int(context.args[0])
-        async for session in get_db():
-            stmt = update(User).where(User.id == user_to_ban).values(is_banned=True)
-            await session.execute(stmt)
-            await session.commit()
-            await update.message.reply_text(f"✅ User {user_to_ban} has been banned.")
+        async with UnitOfWork() as uow:
+            await set_user_banned(uow, user_to_ban, True)
+        await update.message.reply_text(f"✅ User {user_to_ban} has been banned.")
     except (IndexError, ValueError):
         await update.message.reply_text("Usage: /ban <user_id>")
 
@@ -58,11 +87,9 @@ async def admin_unban_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     try:
         user_to_unban = int(context.args[0])
-        async for session in get_db():
-            stmt = update(User).where(User.id == user_to_unban).values(is_banned=False)
-            await session.execute(stmt)
-            await session.commit()
-            await update.message.reply_text(f"✅ User {user_to_unban} has been unbanned.")
+        async with UnitOfWork() as uow:
+            await set_user_banned(uow, user_to_unban, False)
+        await update.message.reply_text(f"✅ User {user_to_unban} has been unbanned.")
     except (IndexError, ValueError):
         await update.message.reply_text("Usage: /unban <user_id>")
 
@@ -70,25 +97,25 @@ async def admin_logs(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_id = update.effective_user.id
     if not await admin_check(user_id): return
     
-    async for session in get_db():
+    async with AsyncSessionLocal() as session:
         result = await session.execute(select(ErrorLog).order_by(desc(ErrorLog.timestamp)).limit(20))
         logs = result.scalars().all()
         
-        if not logs:
-            await update.message.reply_text("✅ No errors logged in the last 20 entries.")
-            return
-            
-        # Format logs
-        log_lines = []
-        for l in logs:
-            log_lines.append(f"[{l.timestamp.strftime('%Y-%m-%d %H:%M')}] User {l.user_id}: {l.error_text[:100]}")
-            
-        log_text = "\n".join(log_lines)
+    if not logs:
+        await update.message.reply_text("✅ No errors logged in the last 20 entries.")
+        return
+        
+    # Format logs
+    log_lines = []
+    for l in logs:
+        log_lines.append(f"[{l.timestamp.strftime('%Y-%m-%d %H:%M')}] User {l.user_id}: {l.error_text[:100]}")
         
-        if len(log_text) > 4000:
-            # Send as file if too big
-            file = io.BytesIO(log_text.encode())
-            file.name = "error_logs.txt"
-            await update.message.reply_document(file, caption="⚠️ Recent Errors")
-        else:
-            await update.message.reply_text(f"⚠️ **Recent Errors:**\n\n```\n{log_text}\n```", parse_mode="Markdown")
+    log_text = "\n".join(log_lines)
+    
+    if len(log_text) > 4000:
+        # Send as file if too big
+        file = io.BytesIO(log_text.encode())
+        file.name = "error_logs.txt"
+        await update.message.reply_document(file, caption="⚠️ Recent Errors")
+    else:
+        await update.message.reply_text(f"⚠️ **Recent Errors:**\n\n```\n{log_text}\n```", parse_mode="Markdown")
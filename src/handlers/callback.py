@@ -1,26 +1,36 @@
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes
 from src.utils.keyboard import Keyboards
-from src.services.user_service import update_user_model, set_custom_key, get_user, update_user_role, set_user_state
-from src.database import get_db
+from src.services.user_service import update_user_model, set_custom_key, get_user, update_user_role, set_user_state, set_response_cache
+from src.database import UnitOfWork
 from src.services.openrouter import OpenRouterService
 from src.config import Config
+from src.handlers.admin import runtime_stats_text, usage_stats_text
+from src.services.generations import active_generations
 
 async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
-    
     data = query.data
+    # A button press can be answered only once; clear_context answers with its alert
+    if data != "clear_context":
+        await query.answer()
+    
     chat_id = update.effective_chat.id
     user_id = update.effective_user.id
+
+    # Stop needs no DB access; the generation finalizes and saves its own partial answer
+    if data.startswith("stop_gen_"):
+        active_generations.stop(user_id, int(data.removeprefix("stop_gen_")))
+        return
     
-    async for session in get_db():
-        user = await get_user(session, user_id)
+    async with UnitOfWork() as uow:
+        user = await get_user(uow, user_id)
         if not user: return
 
         # Global State Reset on any interaction (except explicit state setters below)
         # This fixes the issue where users get stuck in "SEARCH_MODE" after clicking "Back"
-        await set_user_state(session, user_id, None)
+        if user.state or user.state_data:
+            await set_user_state(uow, user_id, None)
 
         if data == "menu_main":
             is_admin = (user_id == Config.ADMIN_ID)
@@ -55,9 +65,28 @@ async def callback_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 parse_mode="Markdown"
             )
         
+        elif data.startswith("search_page_"):
+            search_query = context.user_data.get("model_search")
+            if not search_query:
+                await query.edit_message_text("Search expired. Please search again.", reply_markup=Keyboards.back_to_main())
+                return
+            try:
+                page = max(int(data.split("search_page_")[1]), 0)
+            except ValueError:
+                page = 0
+
+            service = OpenRouterService(api_key=Config.OPENROUTER_API_KEY)
+            page_size = Keyboards.SEARCH_PAGE_SIZE
+            results, total = await service.search_models(search_query, page * page_size, page_size)
+            await query.edit_message_text(
+                f"🔎 Found {total} models for `{search_query}`:",
+                reply_markup=Keyboards.search_results(results, page, total),
+                parse_mode="Markdown"
+            )
+
         elif data.startswith("set_model_"):
             model_id = data.replace("set_model_", "")
-            await update_user_model(session, user_id, model_id)
+            await update_user_model(uow, user_id, model_id)
             await query.edit_message_text(
                 f"✅ Model set to `{model_id}`",
                 reply_markup=Keyboards.back_to_main(),
@@ -81,14 +110,18 @@ Key Type: {"Custom" if user.custom_api_key else "Shared"}
             )
 
         elif data == "model_search":
-            await set_user_state(session, user_id, "SEARCH_MODE")
+            await set_user_state(uow, user_id, "SEARCH_MODE")
             await query.edit_message_text(
                 "To search for a model, just type: `search <query>`\nExample: `search gpt-4`",
                 reply_markup=Keyboards.back_to_main(),
                 parse_mode="Markdown"
             )
 
-        elif data == "menu_key":
+        elif data == "menu_key" or data == "toggle_cache":
+            if data == "toggle_cache" and user.custom_api_key:
+                user.use_response_cache = not user.use_response_cache
+                await set_response_cache(uow, user_id, user.use_response_cache)
+
             key_status = "Custom 🔑" if user.custom_api_key else "Shared 🌐"
             text = f"Current Key: {key_status}\n\nUsing a custom key allows you to use paid models and bypass limits."
             keyboard = [
@@ -96,17 +129,21 @@ Key Type: {"Custom" if user.custom_api_key else "Shared"}
                 [InlineKeyboardButton("🗑 Reset Key", callback_data="reset_key")],
                 [InlineKeyboardButton("⬅️ Back", callback_data="menu_main")]
             ]
+            if user.custom_api_key and Config.RESPONSE_CACHE_ENABLED:
+                # Repeated prompts may be answered from cache; custom-key users can always get a fresh answer
+                cache_status = "On ✅" if user.use_response_cache else "Off ❌"
+                keyboard.insert(2, [InlineKeyboardButton(f"🗄 Response Cache: {cache_status}", callback_data="toggle_cache")])
             await query.edit_message_text(text, reply_markup=InlineKeyboardMarkup(keyboard))
             
         elif data == "set_key_input":
-            await set_user_state(session, user_id, "SET_CUSTOM_KEY")
+            await set_user_state(uow, user_id, "SET_CUSTOM_KEY")
             await query.edit_message_text(
                 "Please send your OpenRouter API Key.\nIt will be stored securely.",
                 reply_markup=Keyboards.back_to_main()
             )
 
         elif data == "reset_key":
-            await set_custom_key(session, user_id, None)
+            await set_custom_key(uow, user_id, None)
             await query.edit_message_text("✅ Custom key removed.", reply_markup=Keyboards.back_to_main())
 
         elif data == "menu_roles":
@@ -128,12 +165,12 @@ Key Type: {"Custom" if user.custom_api_key else "Shared"}
                 # TODO: Implement custom role input similar to custom key
                 await query.edit_message_text("Feature not implemented yet.", reply_markup=Keyboards.back_to_main())
             else:
-                await update_user_role(session, user_id, role_code)
+                await update_user_role(uow, user_id, role_code)
                 await query.edit_message_text(f"✅ Role set to `{role_code}`", reply_markup=Keyboards.main_menu((user_id == Config.ADMIN_ID)))
 
         elif data == "clear_context":
             from src.services.user_service import clear_user_context
-            await clear_user_context(session, user_id)
+            await clear_user_context(uow, user_id)
             await query.answer("Memory cleared! 🧠✨", show_alert=True)
             # await query.edit_message_text("Context cleared.", reply_markup=Keyboards.main_menu((user_id == Config.ADMIN_ID)))
 
@@ -141,28 +178,28 @@ Key Type: {"Custom" if user.custom_api_key else "Shared"}
         elif data == "admin_stats":
             if user_id != Config.ADMIN_ID: return
             
-            from sqlalchemy import select, func, desc
+            from sqlalchemy import select, func
+            from src.services.usage import usage_ledger, top_users_by_requests
             from src.database.models import User
             
-            # Count total users
-            result_users = await session.execute(select(func.count(User.id)))
-            total_users = result_users.scalar()
-            
-            # Sum total requests
-            result_req = await session.execute(select(func.sum(User.usage_count)))
-            total_requests = result_req.scalar() or 0
-            
-            # Get top 5 users by usage
-            result_top = await session.execute(select(User).order_by(desc(User.usage_count)).limit(5))
-            top_users = result_top.scalars().all()
+            async with uow.read() as session:
+                # Count total users
+                result_users = await session.execute(select(func.count(User.id)))
+                total_users = result_users.scalar()
+                
+                # Total requests and top 5 users, including counts not flushed yet
+                total_requests, top_users = await top_users_by_requests(session, 5, usage_ledger.pending_counts())
+                usage_text = await usage_stats_text(session)
             
-            top_text = "\n".join([f"`{u.id}` ({u.full_name}): {u.usage_count}" for u in top_users])
+            top_text = "\n".join([f"`{uid}` ({name}): {count}" for uid, name, count in top_users])
             
             stats_text = (
                 f"📊 **Statistics**\n\n"
                 f"Total Users: {total_users}\n"
                 f"Total Requests: {total_requests}\n\n"
                 f"🏆 **Top Active Users:**\n{top_text}"
+                f"{usage_text}"
+                f"{runtime_stats_text()}"
             )
             
             await query.edit_message_text(stats_text, reply_markup=Keyboards.back_to_main(), parse_mode="Markdown")
@@ -179,8 +216,9 @@ Key Type: {"Custom" if user.custom_api_key else "Shared"}
             from src.database.models import ErrorLog
             import io
             
-            result = await session.execute(select(ErrorLog).order_by(desc(ErrorLog.timestamp)).limit(20))
-            logs = result.scalars().all()
+            async with uow.read() as session:
+                result = await session.execute(select(ErrorLog).order_by(desc(ErrorLog.timestamp)).limit(20))
+                logs = result.scalars().all()
             
             if not logs:
                 await query.edit_message_text("✅ No errors logged in the last 20 entries.", reply_markup=Keyboards.back_to_main())
@@ -1,7 +1,7 @@
 from telegram import Update, ReplyKeyboardRemove
 from telegram.ext import ContextTypes
 from src.services.user_service import get_or_create_user
-from src.database import get_db
+from src.database import UnitOfWork
 from src.utils.keyboard import Keyboards
 from src.config import Config
 
@@ -12,9 +12,9 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # 1. Clear old ReplyKeyboard (Persistent message to ensure client updates)
     await update.message.reply_text("🔄 Interface updated. Old menu removed.", reply_markup=ReplyKeyboardRemove())
 
-    async for session in get_db():
+    async with UnitOfWork() as uow:
         db_user = await get_or_create_user(
-            session, 
+            uow, 
             telegram_id=user.id, 
             username=user.username, 
             full_name=user.full_name
@@ -22,7 +22,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
         # Reset state so user is not stuck
         from src.services.user_service import set_user_state
-        await set_user_state(session, user.id, None)
+        await set_user_state(uow, user.id, None)
 
         # Check ban status
         if db_user.is_banned:
@@ -1,13 +1,22 @@
 from telegram import Update, constants
 from telegram.ext import ContextTypes
-from telegram.error import BadRequest
 from src.services.user_service import get_or_create_user, log_error, increment_usage, set_user_state, update_user_model, set_custom_key
-from src.database import get_db
-from src.services.openrouter import OpenRouterService
+from src.database import UnitOfWork
+from src.services.openrouter import OpenRouterService, ModelsUnavailableError
+from src.services.scheduler import QueueTimeoutError
+from src.services.catalog import model_catalog
+from src.services.context_builder import build_context, message_tokens, tokenizer_name
+from src.services.summarizer import summarizer
+from src.services.generations import active_generations
+from src.services.usage import usage_ledger
+from src.services.conversation import load_recent_messages, append_messages
 from src.config import Config
 from src.utils.markdown import MarkdownCleaner
-import json
+from src.utils.keyboard import Keyboards
+from src.utils.stream_renderer import StreamRenderer
 import asyncio
+import time
+from contextlib import aclosing
 
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton
 
@@ -17,33 +26,34 @@ async def message_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     user_id = update.effective_user.id
     
-    async for session in get_db():
-        user = await get_or_create_user(session, user_id, update.effective_user.username, update.effective_user.full_name)
+    # Writes are queued and committed once when the block ends; no connection is held in between
+    async with UnitOfWork() as uow:
+        user = await get_or_create_user(uow, user_id, update.effective_user.username, update.effective_user.full_name)
         
         if user.is_banned:
             return
 
         # Route to specific handlers based on state
         if user.state == "SEARCH_MODE":
-            await _handle_search_mode(update, context, user, session)
+            await _handle_search_mode(update, context, user, uow)
         elif user.state == "SET_CUSTOM_KEY":
-            await _handle_settings_mode(update, context, user, session)
+            await _handle_settings_mode(update, context, user, uow)
         else:
-            await _handle_chat(update, context, user, session)
+            await _handle_chat(update, context, user, uow)
 
-async def _handle_search_mode(update: Update, context: ContextTypes.DEFAULT_TYPE, user, session):
+async def _handle_search_mode(update: Update, context: ContextTypes.DEFAULT_TYPE, user, uow):
     text = update.message.text.strip()
     chat_id = update.effective_chat.id
     user_id = user.id
 
     # Heuristic: If text is long or looks like a question, treat as chat
     if len(text) > 50 or "?" in text or " " in text and len(text.split()) > 5:
-        await set_user_state(session, user_id, None)
+        await set_user_state(uow, user_id, None)
         await update.message.reply_text("🔄 Search cancelled. Sending as message...")
         # Update local object
         user.state = None
         # Fallback to chat
-        await _handle_chat(update, context, user, session)
+        await _handle_chat(update, context, user, uow)
         return
 
     status = await update.message.reply_text("🔎 Searching...")
@@ -52,52 +62,46 @@ async def _handle_search_mode(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     try:
         if "/" in text and " " not in text:
-            await update_user_model(session, user_id, text)
+            await update_user_model(uow, user_id, text)
             await context.bot.edit_message_text(chat_id=chat_id, message_id=status.message_id, text=f"✅ Model set to `{text}`", parse_mode="Markdown")
-            await set_user_state(session, user_id, None)
+            await set_user_state(uow, user_id, None)
         else:
-            results = await service.search_models(text)
+            results, total = await service.search_models(text, limit=Keyboards.SEARCH_PAGE_SIZE)
             if not results:
                 await context.bot.edit_message_text(chat_id=chat_id, message_id=status.message_id, text="❌ No models found. Try a different query.")
             else:
-                keyboard = []
-                for model in results[:5]:
-                    name = model.get('name', model.get('id'))
-                    if len(name) > 30: name = name[:27] + "..."
-                    keyboard.append([InlineKeyboardButton(name, callback_data=f"set_model_{model.get('id')}")])
-                
-                keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="menu_model")])
-                
+                # Remembered for the result paging buttons
+                context.user_data["model_search"] = text
                 await context.bot.edit_message_text(
                     chat_id=chat_id, 
                     message_id=status.message_id, 
-                    text=f"🔎 Found {len(results)} models for `{text}`:", 
-                    reply_markup=InlineKeyboardMarkup(keyboard),
+                    text=f"🔎 Found {total} models for `{text}`:", 
+                    reply_markup=Keyboards.search_results(results, 0, total),
                     parse_mode="Markdown"
                 )
-                await set_user_state(session, user_id, None)
+                await set_user_state(uow, user_id, None)
             
     except Exception as e:
         await context.bot.edit_message_text(chat_id=chat_id, message_id=status.message_id, text=f"Error: {e}")
 
-async def _handle_settings_mode(update: Update, context: ContextTypes.DEFAULT_TYPE, user, session):
+async def _handle_settings_mode(update: Update, context: ContextTypes.DEFAULT_TYPE, user, uow):
     text = update.message.text.strip()
     user_id = user.id
 
     if text == "-":
-        await set_custom_key(session, user_id, None)
+        await set_custom_key(uow, user_id, None)
         await update.message.reply_text("✅ Custom key removed. Using shared key.")
     else:
         if not text.isascii():
             await update.message.reply_text("❌ Invalid API Key. Latin characters only.")
             return
 
-        await set_custom_key(session, user_id, text)
+        await set_custom_key(uow, user_id, text)
         await update.message.reply_text("✅ Custom key saved!")
     
-    await set_user_state(session, user_id, None)
+    await set_user_state(uow, user_id, None)
 
-async def _handle_chat(update: Update, context: ContextTypes.DEFAULT_TYPE, user, session):
+async def _handle_chat(update: Update, context: ContextTypes.DEFAULT_TYPE, user, uow):
     text = update.message.text.strip()
     chat_id = update.effective_chat.id
     user_id = user.id
@@ -105,93 +109,90 @@ async def _handle_chat(update: Update, context: ContextTypes.DEFAULT_TYPE, user,
     api_key = user.custom_api_key or Config.OPENROUTER_API_KEY
     service = OpenRouterService(api_key=api_key)
     
-    status_msg = await update.message.reply_text("⏳ Thinking...")
-    
-    # Load History
-    try:
-        history = json.loads(user.context_history) if user.context_history else []
-        if not isinstance(history, list): history = []
-    except:
-        history = []
-        
-    history.append({"role": "user", "content": text})
-    messages = [{"role": "system", "content": f"You are a {user.current_role}."}] + history
-    
-    full_response = ""
-    last_edit_time = 0
-    stream_stopped = False
+    # Stop is keyed by the user's message, which exists before any reply does
+    generation_id = update.message.message_id
+    renderer = StreamRenderer(update.message, reply_markup=Keyboards.stop_generation(generation_id))
+    await renderer.start()
+    chunks = []
+
+    async def show_queue_position(position: int):
+        await renderer.show_status(f"⏳ Thinking... (queue position {position})")
+
+    async def show_final(text: str, **kwargs):
+        if renderer.message_id is None:
+            await update.message.reply_text(text, **kwargs)
+        else:
+            await context.bot.edit_message_text(chat_id=chat_id, message_id=renderer.message_id, text=text, **kwargs)
+
+    weight = Config.SCHEDULER_UNLIMITED_WEIGHT if user.is_unlimited else 1.0
     
     try:
-        async for chunk in service.stream_chat(user.current_model, messages):
-            full_response += chunk
-            
-            # Streaming Logic (Limit to 4000 chars to avoid crash)
-            if len(full_response) > 4000:
-                if not stream_stopped:
-                    await context.bot.edit_message_text(
-                        chat_id=chat_id,
-                        message_id=status_msg.message_id,
-                        text=MarkdownCleaner.clean_bot_response(full_response[:4000] + "...\n(Continuing...)"),
-                        parse_mode="MarkdownV2"
-                    )
-                    stream_stopped = True
-                continue
-
-            # Update every 1.5s
-            import time
-            current_time = time.time()
-            if current_time - last_edit_time > 1.5:
-                try:
-                    cleaned_text = MarkdownCleaner.clean_bot_response(full_response + "...")
-                    await context.bot.edit_message_text(
-                        chat_id=chat_id,
-                        message_id=status_msg.message_id,
-                        text=cleaned_text,
-                        parse_mode="MarkdownV2"
-                    )
-                    last_edit_time = current_time
-                except BadRequest:
-                    pass
-
-        # Final Send
-        if len(full_response) <= 4000:
-            cleaned_text = MarkdownCleaner.clean_bot_response(full_response)
-            await context.bot.edit_message_text(
-                chat_id=chat_id,
-                message_id=status_msg.message_id,
-                text=cleaned_text,
-                parse_mode="MarkdownV2"
+        # Load only the window of recent turns the prompt can use
+        history = await load_recent_messages(uow, user_id, Config.CONTEXT_HISTORY_MAX_MESSAGES)
+        history.append({"role": "user", "content": text})
+
+        fallbacks = service.failover_chain(user.current_model)
+        # Pack as much history as the smallest window in the failover chain allows
+        windows = [info.context_length for info in map(model_catalog.get_model, [user.current_model, *fallbacks]) if info and info.context_length]
+        messages = build_context(f"You are a {user.current_role}.", history, user.current_model, min(windows, default=None), user.context_summary)
+        # Only first-turn prompts are cached; later turns depend on the conversation
+        use_cache = Config.RESPONSE_CACHE_ENABLED and len(history) == 1 and (not user.custom_api_key or user.use_response_cache)
+
+        async def generate():
+            stream = service.stream_chat(
+                user.current_model, messages, fallbacks, use_cache=use_cache,
+                user_id=user_id, weight=weight, on_queue=show_queue_position
             )
-        else:
-            # Long message: Split and send
-            # First, update the status message with the first chunk
-            await context.bot.delete_message(chat_id=chat_id, message_id=status_msg.message_id)
-            
-            # Simple chunking by 4096
-            for i in range(0, len(full_response), 4096):
-                chunk_text = full_response[i:i+4096]
-                cleaned_chunk = MarkdownCleaner.clean_bot_response(chunk_text)
-                await update.message.reply_text(cleaned_chunk, parse_mode="MarkdownV2")
+            # Closing the generator on Stop closes the upstream HTTP stream right away
+            async with aclosing(stream):
+                async for chunk in stream:
+                    chunks.append(chunk)
+                    renderer.append(chunk)
+
+        started = time.monotonic()
+        try:
+            completed = await active_generations.run(user_id, generation_id, generate())
+        finally:
+            await renderer.close()
+        full_response = "".join(chunks)
+        if service.last_usage:
+            latency_ms = int((time.monotonic() - started) * 1000)
+            usage_ledger.record(user_id, service.last_model, api_key, service.last_usage, latency_ms)
+
+        # Tell the user when a fallback model answered (not saved to history)
+        footer = ""
+        if not completed:
+            footer = "\n\n⏹ Stopped."
+        elif service.last_model and service.last_model != user.current_model:
+            footer = f"\n\n↪️ Answered by `{service.last_model}` (`{user.current_model}` is busy)"
+
+        # Final Send: earlier pages are already on screen, only the rest is written
+        await renderer.finish(footer)
         
-        # Save History
-        history.append({"role": "assistant", "content": full_response})
-        if len(history) > 20:
-            history = history[-20:]
-            
-        from sqlalchemy import update as sa_update
-        from src.database.models import User
-        stmt = sa_update(User).where(User.id == user_id).values(context_history=json.dumps(history))
-        await session.execute(stmt)
-        await session.commit()
-        await increment_usage(session, user_id)
+        # Save History: append only this turn (a stopped generation keeps what was produced so far)
+        if full_response:
+            history.append({"role": "assistant", "content": full_response})
+            message_tokens(history[-1], tokenizer_name(user.current_model))
+        new_turn = history[-2:] if full_response else history[-1:]
+        append_messages(uow, user_id, new_turn)
+        increment_usage(user_id)
+        # Compaction reads the stored conversation, so it starts once this turn is committed
+        uow.after_commit(lambda: summarizer.maybe_schedule(user_id, history, user.context_summary, user.current_model))
 
     except Exception as e:
-        await log_error(session, user_id, str(e), "")
+        # Stop live edits before the error replaces the placeholder
+        await renderer.close()
+        await log_error(uow, user_id, str(e), "")
         error_str = str(e)
         
-        if "429" in error_str or "rate-limited" in error_str.lower():
+        if isinstance(e, QueueTimeoutError):
+            await show_final("⚠️ The bot is busy right now. Please try again in a minute.")
+        elif isinstance(e, ModelsUnavailableError) or "429" in error_str or "rate-limited" in error_str.lower():
             kb = InlineKeyboardMarkup([[InlineKeyboardButton("🤖 Change Model", callback_data="menu_model")]])
             text = f"⚠️ *Model Overloaded*\n\nModel `{user.current_model}` is busy\\."
-            await context.bot.edit_message_text(chat_id=chat_id, message_id=status_msg.message_id, text=MarkdownCleaner.escape(text), reply_markup=kb, parse_mode="MarkdownV2")
+            await show_final(MarkdownCleaner.escape(text), reply_markup=kb, parse_mode="MarkdownV2")
         else:
-            await context.bot.edit_message_text(chat_id=chat_id, message_id=status_msg.message_id, text=f"⚠️ Error: {error_str}")
+            await show_final(f"⚠️ Error: {error_str}")
+    finally:
+        # Whatever failed, the render task and the typing indicator end with the turn
+        await renderer.close()
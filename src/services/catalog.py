@@ -0,0 +1,259 @@
+from src.config import Config
+from src.logger import logger
+from src.services.model_info import ModelInfo
+from src.services.model_search import ModelSearchIndex
+import aiohttp
+import asyncio
+import os
+import pickle
+import time
+
+# Bump when the snapshot layout or the derived index classes change
+SNAPSHOT_FORMAT = 2
+
+# Tier 1: High Reliability (Mainstream providers)
+TIER_1 = ("google/", "meta-llama/", "mistralai/", "microsoft/")
+# Tier 2: Popular but potentially rate-limited
+TIER_2 = ("deepseek/", "qwen/")
+# Tier 3: Everything else (often community merges, experimental)
+DEPRIORITIZED = ("chimera", "dolphin", "nous")
+
+
+def model_tier(model_id: str) -> int:
+    mid = model_id.lower()
+    if any(k in mid for k in TIER_1):
+        return 1
+    if any(k in mid for k in TIER_2):
+        return 2
+    return 3
+
+
+class FreeModelIndex:
+    """
+    Free models ranked once per catalog version, plus per-tier and
+    per-provider slices, so menu pages are plain tuple slices.
+    """
+
+    def __init__(self, models: list[ModelInfo]):
+        scored = []
+        for model in models:
+            if not model.is_free:
+                continue
+            mid = model.id.lower()
+            tier = model_tier(mid)
+
+            score = 0
+            if tier == 1:
+                score += 10**12  # Top priority
+            elif tier == 2:
+                score += 10**9  # High priority
+            # Deprioritize community merges that slipped past the tier prefixes
+            if any(k in mid for k in DEPRIORITIZED):
+                score -= 10**6
+            # Tertiary sort by context length
+            score += model.context_length
+            scored.append((score, tier, model))
+
+        scored.sort(key=lambda item: item[0], reverse=True)
+        self.ranked: tuple[ModelInfo, ...] = tuple(model for _, _, model in scored)
+        self._scores = {model.id: score for score, _, model in scored}
+        self._live_ranked = self.ranked
+        self._live_epoch = None
+
+        by_tier: dict[int, list[ModelInfo]] = {}
+        by_provider: dict[str, list[ModelInfo]] = {}
+        for _, tier, model in scored:
+            by_tier.setdefault(tier, []).append(model)
+            by_provider.setdefault(model.provider, []).append(model)
+        self.by_tier = {tier: tuple(items) for tier, items in by_tier.items()}
+        self.by_provider = {provider: tuple(items) for provider, items in by_provider.items()}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_live_ranked"] = self.ranked
+        state["_live_epoch"] = None
+        return state
+
+    def live_ranked(self, telemetry) -> tuple[ModelInfo, ...]:
+        """Static ranking blended with live telemetry; re-sorted only when telemetry publishes."""
+        if self._live_epoch != telemetry.epoch:
+            adjustments = telemetry.adjustments
+            if any(model.id in adjustments for model in self.ranked):
+                self._live_ranked = tuple(sorted(
+                    self.ranked,
+                    key=lambda m: self._scores[m.id] + adjustments.get(m.id, 0),
+                    reverse=True,
+                ))
+            else:
+                self._live_ranked = self.ranked
+            self._live_epoch = telemetry.epoch
+        return self._live_ranked
+
+    def page(self, page: int, page_size: int) -> tuple[ModelInfo, ...]:
+        start = page * page_size
+        return self.ranked[start:start + page_size]
+
+
+class ModelCatalog:
+    """
+    Process-wide store for the OpenRouter /models catalog.
+    Readers always get the in-memory copy; a stale copy is served while a
+    single background refresh runs, and unchanged catalogs are revalidated
+    with ETag / If-Modified-Since instead of being downloaded again.
+    """
+
+    def __init__(self, ttl: float = None, snapshot_path: str = None):
+        self.ttl = ttl or Config.CATALOG_TTL
+        self.snapshot_path = snapshot_path or Config.CATALOG_SNAPSHOT_PATH
+        self.version = 0
+        self._models: list[ModelInfo] = []
+        self._checked_at = 0.0
+        self._etag = None
+        self._last_modified = None
+        self._refresh_task: asyncio.Task | None = None
+        self._session: aiohttp.ClientSession | None = None
+        self._free_index: FreeModelIndex | None = None
+        self._free_index_version = -1
+        self._search_index: ModelSearchIndex | None = None
+        self._search_index_version = -1
+        self._by_id: dict[str, ModelInfo] = {}
+        self._by_id_version = -1
+
+    @property
+    def models(self) -> list[ModelInfo]:
+        return self._models
+
+    @property
+    def free_index(self) -> FreeModelIndex:
+        # Derived data is rebuilt lazily, at most once per catalog version
+        if self._free_index_version != self.version:
+            self._free_index = FreeModelIndex(self._models)
+            self._free_index_version = self.version
+        return self._free_index
+
+    def get_model(self, model_id: str) -> ModelInfo | None:
+        if self._by_id_version != self.version:
+            self._by_id = {model.id: model for model in self._models}
+            self._by_id_version = self.version
+        return self._by_id.get(model_id)
+
+    @property
+    def search_index(self) -> ModelSearchIndex:
+        if self._search_index_version != self.version:
+            self._search_index = ModelSearchIndex(self._models)
+            self._search_index_version = self.version
+        return self._search_index
+
+    def is_stale(self) -> bool:
+        return time.monotonic() - self._checked_at > self.ttl
+
+    async def get_models(self) -> list[ModelInfo]:
+        if not self._models:
+            # Cold start: nothing to serve yet, so wait for the (shared) fetch
+            await self.refresh()
+        elif self.is_stale():
+            self.refresh()
+        return self._models
+
+    def refresh(self) -> asyncio.Future:
+        # Single-flight: concurrent callers all await the same request
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.get_running_loop().create_task(self._refresh())
+        return asyncio.shield(self._refresh_task)
+
+    async def _refresh(self):
+        headers = {}
+        if self._etag:
+            headers["If-None-Match"] = self._etag
+        if self._last_modified:
+            headers["If-Modified-Since"] = self._last_modified
+
+        try:
+            status, response_headers, data = await self._request(headers)
+        except Exception as e:
+            logger.error(f"Error fetching models: {e}")
+            return
+
+        if status == 304:
+            self._checked_at = time.monotonic()
+            return
+        if status != 200:
+            logger.error(f"Failed to fetch models: {status}")
+            return
+
+        self._etag = response_headers.get("ETag")
+        self._last_modified = response_headers.get("Last-Modified")
+        self._checked_at = time.monotonic()
+        models = [ModelInfo.from_api(m) for m in data.get("data", [])]
+        if models != self._models:
+            self._models = models
+            self.version += 1
+            # Build derived indexes now so the first reader doesn't pay for them
+            self.free_index
+            self.search_index
+            logger.info(f"Model catalog updated: {len(models)} models (v{self.version})")
+            await asyncio.to_thread(self.save_snapshot)
+
+    def save_snapshot(self):
+        snapshot = {
+            "format": SNAPSHOT_FORMAT,
+            "version": self.version,
+            "etag": self._etag,
+            "last_modified": self._last_modified,
+            "saved_at": time.time(),
+            "models": self._models,
+            "free_index": self.free_index,
+            "search_index": self.search_index,
+        }
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+            # Write-then-rename so a crash never leaves a truncated snapshot behind
+            tmp_path = f"{self.snapshot_path}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.snapshot_path)
+        except Exception as e:
+            logger.error(f"Failed to save model catalog snapshot: {e}")
+
+    def load_snapshot(self) -> bool:
+        try:
+            with open(self.snapshot_path, "rb") as f:
+                snapshot = pickle.load(f)
+        except FileNotFoundError:
+            return False
+        except Exception as e:
+            logger.error(f"Failed to load model catalog snapshot: {e}")
+            return False
+
+        if snapshot.get("format") != SNAPSHOT_FORMAT:
+            return False
+
+        self.version = snapshot["version"]
+        self._etag = snapshot["etag"]
+        self._last_modified = snapshot["last_modified"]
+        self._models = snapshot["models"]
+        self._free_index = snapshot["free_index"]
+        self._free_index_version = self.version
+        self._search_index = snapshot["search_index"]
+        self._search_index_version = self.version
+        # Served immediately, but revalidated on the next refresh
+        self._checked_at = 0.0
+        age = int(time.time() - snapshot["saved_at"])
+        logger.info(f"Loaded model catalog snapshot: {len(self._models)} models, {age}s old")
+        return True
+
+    async def _request(self, headers: dict) -> tuple[int, dict, dict | None]:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30))
+        async with self._session.get(f"{Config.OPENROUTER_BASE_URL}/models", headers=headers) as response:
+            data = await response.json() if response.status == 200 else None
+            return response.status, dict(response.headers), data
+
+    async def close(self):
+        if self._refresh_task and not self._refresh_task.done():
+            self._refresh_task.cancel()
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+
+model_catalog = ModelCatalog()
@@ -0,0 +1,88 @@
+from contextlib import aclosing
+import asyncio
+
+
+class SharedStream:
+    """
+    One upstream generation fanned out to any number of consumers.
+    The upstream generator is driven by its own task, so it keeps going while
+    at least one consumer is attached and is cancelled (closing the HTTP
+    stream) when the last one leaves.
+    """
+
+    def __init__(self, registry: "InflightRequests", key, source, owner):
+        self._registry = registry
+        self.key = key
+        self.chunks: list[str] = []
+        self.model = None
+        self.error: Exception | None = None
+        self.done = False
+        self.consumers = 0
+        self._updated = asyncio.Event()
+        self._owner = owner
+        self._task = asyncio.create_task(self._pump(source))
+
+    def _notify(self):
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    async def _pump(self, source):
+        try:
+            async with aclosing(source) as upstream:
+                async for chunk in upstream:
+                    if self.model is None:
+                        # The owner's service learns which model answered once streaming starts
+                        self.model = self._owner.last_model
+                    self.chunks.append(chunk)
+                    self._notify()
+            self.model = self._owner.last_model
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._registry.discard(self)
+            self._notify()
+
+    async def consume(self):
+        self.consumers += 1
+        index = 0
+        try:
+            while True:
+                while index < len(self.chunks):
+                    yield self.chunks[index]
+                    index += 1
+                if self.done:
+                    if self.error is not None:
+                        raise self.error
+                    return
+                await self._updated.wait()
+        finally:
+            self.consumers -= 1
+            if self.consumers == 0 and not self.done:
+                self._registry.discard(self)
+                self._task.cancel()
+
+
+class InflightRequests:
+    """Registry of in-flight generations keyed by (API key, model, messages)."""
+
+    def __init__(self):
+        self._streams: dict = {}
+
+    def get(self, key) -> SharedStream | None:
+        shared = self._streams.get(key)
+        if shared is None or shared.done:
+            return None
+        return shared
+
+    def start(self, key, source, owner) -> SharedStream:
+        shared = SharedStream(self, key, source, owner)
+        self._streams[key] = shared
+        return shared
+
+    def discard(self, shared: SharedStream):
+        if self._streams.get(shared.key) is shared:
+            del self._streams[shared.key]
+
+
+inflight_requests = InflightRequests()
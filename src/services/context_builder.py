@@ -0,0 +1,77 @@
+from functools import lru_cache
+from src.config import Config
+
+try:
+    import tiktoken
+except ImportError:  # optional: exact counts for OpenAI models when installed
+    tiktoken = None
+
+HEURISTIC = "heuristic"
+# Role markers and separators each message adds on top of its content
+MESSAGE_OVERHEAD = 4
+
+
+def tokenizer_name(model: str) -> str:
+    if tiktoken is None or not model.startswith("openai/"):
+        return HEURISTIC
+    name = model.split("/", 1)[1]
+    if name.startswith(("gpt-4o", "gpt-4.1", "gpt-5", "o1", "o3", "o4", "gpt-oss")):
+        return "o200k_base"
+    if name.startswith(("gpt-4", "gpt-3.5")):
+        return "cl100k_base"
+    return HEURISTIC
+
+
+@lru_cache(maxsize=None)
+def _encoding(name: str):
+    return tiktoken.get_encoding(name)
+
+
+def estimate_tokens(text: str) -> int:
+    """Fast local estimate: ~4 ASCII chars per token, ~2 for other scripts (Cyrillic, CJK...)."""
+    ascii_chars = len(text.encode("ascii", "ignore"))
+    other_chars = len(text) - ascii_chars
+    return (ascii_chars + 3) // 4 + (other_chars + 1) // 2
+
+
+def count_tokens(text: str, tokenizer: str) -> int:
+    if tokenizer == HEURISTIC:
+        return estimate_tokens(text)
+    return len(_encoding(tokenizer).encode(text, disallowed_special=()))
+
+
+def message_tokens(message: dict, tokenizer: str) -> int:
+    """Token count of a stored history message, computed once and cached on the message itself."""
+    if message.get("tk") != tokenizer or "tokens" not in message:
+        message["tokens"] = count_tokens(message.get("content") or "", tokenizer) + MESSAGE_OVERHEAD
+        message["tk"] = tokenizer
+    return message["tokens"]
+
+
+def prompt_budget(context_length: int | None) -> int:
+    context_length = context_length or Config.CONTEXT_DEFAULT_LENGTH
+    # Leave room for the answer; small windows can't spare the full reserve
+    reserve = min(Config.CONTEXT_COMPLETION_RESERVE, context_length // 4)
+    return min(context_length - reserve, Config.CONTEXT_MAX_PROMPT_TOKENS)
+
+
+def build_context(system_prompt: str, history: list[dict], model: str, context_length: int | None, summary: str | None = None) -> list[dict]:
+    """
+    System prompt (with the rolling summary, if any) plus the newest history messages that fit the model's window.
+    The latest message is always included, even if it alone exceeds the budget.
+    """
+    if summary:
+        system_prompt = f"{system_prompt}\n\nSummary of the earlier conversation:\n{summary}"
+    tokenizer = tokenizer_name(model)
+    budget = prompt_budget(context_length) - count_tokens(system_prompt, tokenizer) - MESSAGE_OVERHEAD
+
+    selected = []
+    for message in reversed(history):
+        cost = message_tokens(message, tokenizer)
+        if selected and cost > budget:
+            break
+        budget -= cost
+        selected.append({"role": message["role"], "content": message["content"]})
+
+    selected.reverse()
+    return [{"role": "system", "content": system_prompt}] + selected
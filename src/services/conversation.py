@@ -0,0 +1,106 @@
+from sqlalchemy import Select, delete, exists, func, insert, literal, select, update
+from src.config import Config
+from src.database.core import UnitOfWork
+from src.database.models import ConversationMessage, User
+from src.services.user_service import user_cache
+import json
+
+MESSAGE_COLUMNS = ["user_id", "seq", "role", "content", "token_count", "tokenizer"]
+
+
+def _as_dict(row: ConversationMessage) -> dict:
+    message = {"role": row.role, "content": row.content, "seq": row.seq}
+    if row.token_count is not None:
+        message["tokens"] = row.token_count
+        message["tk"] = row.tokenizer
+    return message
+
+
+async def load_recent_messages(uow: UnitOfWork, telegram_id: int, limit: int) -> list[dict]:
+    """The newest `limit` turns, oldest first."""
+    async with uow.read() as session:
+        result = await session.execute(
+            select(ConversationMessage)
+            .where(ConversationMessage.user_id == telegram_id)
+            .order_by(ConversationMessage.seq.desc())
+            .limit(limit)
+        )
+        rows = result.scalars().all()[::-1]
+        if not rows:
+            blob = await session.scalar(select(User.context_history).where(User.id == telegram_id))
+            return _import_legacy_history(uow, telegram_id, blob)[-limit:]
+    return [_as_dict(row) for row in rows]
+
+
+def _import_legacy_history(uow: UnitOfWork, telegram_id: int, blob: str | None) -> list[dict]:
+    """Moves a history still stored as a JSON blob on the user row (not yet migrated) into the table."""
+    try:
+        history = json.loads(blob) if blob else []
+    except ValueError:
+        history = []
+    if not isinstance(history, list) or not history:
+        return []
+    messages = [
+        {"role": m["role"], "content": m["content"], "seq": seq}
+        for seq, m in enumerate(m for m in history if isinstance(m, dict) and "role" in m and "content" in m)
+    ]
+    for m in messages:
+        # An overlapping update may have imported the same blob first
+        taken = exists().where(ConversationMessage.user_id == telegram_id, ConversationMessage.seq == m["seq"])
+        uow.add(insert(ConversationMessage).from_select(MESSAGE_COLUMNS, _message_row(telegram_id, m, m["seq"]).where(~taken)))
+    uow.add(update(User).where(User.id == telegram_id).values(context_history="[]"))
+    return messages
+
+
+def _message_row(telegram_id: int, message: dict, seq) -> Select:
+    """A one-row SELECT of a turn's columns, for INSERT ... SELECT."""
+    return select(
+        literal(telegram_id, ConversationMessage.user_id.type),
+        literal(seq, ConversationMessage.seq.type) if isinstance(seq, int) else seq,
+        literal(message["role"], ConversationMessage.role.type),
+        literal(message["content"], ConversationMessage.content.type),
+        literal(message.get("tokens"), ConversationMessage.token_count.type),
+        literal(message.get("tk"), ConversationMessage.tokenizer.type),
+    )
+
+
+def append_messages(uow: UnitOfWork, telegram_id: int, messages: list[dict]):
+    """
+    Queues turns at the end of the conversation. Each seq is taken inside
+    the commit's transaction (INSERT ... SELECT max(seq) + 1), so turns of
+    overlapping updates for the same user can't collide on a stale seq.
+    Turns older than the newest CONTEXT_HISTORY_MAX_MESSAGES, which no
+    prompt reads again, are deleted in the same transaction.
+    """
+    newest = select(func.max(ConversationMessage.seq)).where(
+        ConversationMessage.user_id == telegram_id
+    ).scalar_subquery()
+    for m in messages:
+        row = _message_row(telegram_id, m, func.coalesce(newest, -1) + 1)
+        uow.add(insert(ConversationMessage).from_select(MESSAGE_COLUMNS, row))
+    uow.add(delete(ConversationMessage).where(
+        ConversationMessage.user_id == telegram_id,
+        ConversationMessage.seq <= newest - Config.CONTEXT_HISTORY_MAX_MESSAGES
+    ))
+
+
+async def compact_conversation(uow: UnitOfWork, telegram_id: int, prefix: list[dict], summary: str) -> bool:
+    """Replaces the summarized prefix of the conversation with its summary, unless it changed meanwhile."""
+    seqs = [m["seq"] for m in prefix]
+    async with uow.read() as session:
+        result = await session.execute(
+            select(ConversationMessage.seq, ConversationMessage.role, ConversationMessage.content)
+            .where(ConversationMessage.user_id == telegram_id, ConversationMessage.seq.in_(seqs))
+            .order_by(ConversationMessage.seq)
+        )
+        stored = [tuple(row) for row in result.all()]
+    if stored != [(m["seq"], m["role"], m["content"]) for m in prefix]:
+        return False
+    uow.add(
+        delete(ConversationMessage).where(ConversationMessage.user_id == telegram_id, ConversationMessage.seq <= max(seqs))
+    )
+    uow.add(
+        update(User).where(User.id == telegram_id).values(context_summary=summary),
+        after_commit=lambda: user_cache.update(telegram_id, context_summary=summary)
+    )
+    return True
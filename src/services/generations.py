@@ -0,0 +1,40 @@
+import asyncio
+
+
+class Generations:
+    """In-flight chat generations per user, keyed by the message that started them."""
+
+    def __init__(self):
+        self._active: dict[int, dict[int, asyncio.Task]] = {}
+
+    async def run(self, user_id: int, generation_id: int, coro) -> bool:
+        """Runs coro as a stoppable task. Returns False if it was stopped, re-raises its errors."""
+        task = asyncio.create_task(coro)
+        self._active.setdefault(user_id, {})[generation_id] = task
+        try:
+            await asyncio.wait({task})
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        finally:
+            tasks = self._active.get(user_id, {})
+            tasks.pop(generation_id, None)
+            if not tasks:
+                self._active.pop(user_id, None)
+        if task.cancelled():
+            return False
+        task.result()
+        return True
+
+    def stop(self, user_id: int, generation_id: int) -> bool:
+        task = self._active.get(user_id, {}).get(generation_id)
+        if task is None or task.done():
+            return False
+        task.cancel()
+        return True
+
+    def __len__(self):
+        return sum(len(tasks) for tasks in self._active.values())
+
+
+active_generations = Generations()
@@ -0,0 +1,20 @@
+from collections import Counter
+
+
+class Metrics:
+    """In-process counters surfaced in the admin /stats view."""
+
+    def __init__(self):
+        self._counters = Counter()
+
+    def inc(self, name: str, value: int = 1):
+        self._counters[name] += value
+
+    def get(self, name: str) -> int:
+        return self._counters[name]
+
+    def snapshot(self) -> dict[str, int]:
+        return dict(sorted(self._counters.items()))
+
+
+metrics = Metrics()
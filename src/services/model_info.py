@@ -0,0 +1,66 @@
+import sys
+
+# Only the start of the description is kept; it is used for search, never displayed
+DESCRIPTION_CHARS = 300
+
+
+def _parse_price(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return -1.0
+
+
+class ModelInfo:
+    """
+    Compact, parsed view of one /models catalog entry.
+    Holds only the fields the bot uses, so the raw JSON (architecture,
+    endpoint pricing, long descriptions) can be dropped after parsing.
+    """
+
+    __slots__ = ("id", "name", "provider", "context_length", "prompt_price", "completion_price", "description")
+
+    def __init__(self, id: str, name: str, context_length: int = 0, prompt_price: float = -1.0,
+                 completion_price: float = -1.0, description: str = ""):
+        self.id = id
+        self.name = name
+        # Interned: a handful of provider strings are shared by hundreds of models
+        self.provider = sys.intern(id.split("/", 1)[0])
+        self.context_length = context_length
+        self.prompt_price = prompt_price
+        self.completion_price = completion_price
+        self.description = description
+
+    @classmethod
+    def from_api(cls, data: dict) -> "ModelInfo":
+        pricing = data.get('pricing') or {}
+        model_id = data.get('id', '')
+        try:
+            context_length = int(data.get('context_length') or 0)
+        except (TypeError, ValueError):
+            context_length = 0
+        return cls(
+            id=model_id,
+            name=data.get('name') or model_id,
+            context_length=context_length,
+            prompt_price=_parse_price(pricing.get('prompt', -1)),
+            completion_price=_parse_price(pricing.get('completion', -1)),
+            description=(data.get('description') or '')[:DESCRIPTION_CHARS],
+        )
+
+    @property
+    def is_free(self) -> bool:
+        return self.prompt_price == 0 and self.completion_price == 0
+
+    def _key(self) -> tuple:
+        return tuple(getattr(self, slot) for slot in self.__slots__)
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, ModelInfo):
+            return NotImplemented
+        return self._key() == other._key()
+
+    __hash__ = None
+
+    def __repr__(self) -> str:
+        return f"ModelInfo({self.id!r})"
@@ -0,0 +1,204 @@
+from bisect import bisect_left
+from collections import OrderedDict
+from heapq import nlargest
+from src.services.model_info import ModelInfo
+import math
+import re
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+# Field weights: a hit in the id or name matters more than one in the description
+FIELD_WEIGHTS = (("id", 3.0), ("name", 3.0), ("provider", 2.0), ("description", 0.5))
+
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def trigrams(token: str) -> set[str]:
+    padded = f" {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _max_typos(token: str) -> int:
+    if len(token) < 4:
+        return 0
+    return 1 if len(token) == 4 else 2
+
+
+def _edit_distance(a: str, b: str, limit: int) -> int:
+    """Optimal string alignment distance (adjacent swaps count as one edit), cut off above limit."""
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if previous2 is not None and i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+class ModelSearchIndex:
+    """
+    Token + trigram inverted index over the model catalog.
+    Query tokens match vocabulary tokens exactly, by prefix, or fuzzily by
+    trigram overlap (typos); hits are ranked by text score blended with
+    context length and free/paid status.
+    """
+
+    def __init__(self, models: list[ModelInfo], cache_size: int = 256):
+        self.models = models
+        self.cache_size = cache_size
+        self._cache: OrderedDict[str, dict[int, float]] = OrderedDict()
+
+        # token -> {model index: best field weight x static boost}
+        self._postings: dict[str, dict[int, float]] = {}
+        self._ids = [model.id.lower() for model in models]
+        for idx, model in enumerate(models):
+            boost = self._static_boost(model)
+            fields = {
+                "id": model.id,
+                "name": model.name,
+                "provider": model.provider,
+                "description": model.description,
+            }
+            for field, weight in FIELD_WEIGHTS:
+                for token in tokenize(fields[field]):
+                    postings = self._postings.setdefault(token, {})
+                    if postings.get(idx, 0) < weight * boost:
+                        postings[idx] = weight * boost
+
+        self._vocabulary = sorted(self._postings)
+        self._trigrams: dict[str, set[str]] = {}
+        for token in self._vocabulary:
+            for gram in trigrams(token):
+                self._trigrams.setdefault(gram, set()).add(token)
+
+    def __getstate__(self):
+        # Query results are cheap to recompute; don't persist them in snapshots
+        state = self.__dict__.copy()
+        state["_cache"] = OrderedDict()
+        return state
+
+    @staticmethod
+    def _static_boost(model: ModelInfo) -> float:
+        boost = 1.0 + 0.05 * math.log2(max(model.context_length, 4096) / 4096)
+        if model.is_free:
+            boost += 0.1
+        return boost
+
+    def _expand(self, query_token: str) -> dict[str, float]:
+        """Vocabulary tokens matching a query token, with a match quality in (0, 1]."""
+        matches = {}
+        if query_token in self._postings:
+            matches[query_token] = 1.0
+
+        # Prefix matches ("gem" -> "gemini", "gemma")
+        start = bisect_left(self._vocabulary, query_token)
+        for token in self._vocabulary[start:]:
+            if not token.startswith(query_token):
+                break
+            matches.setdefault(token, 0.8)
+
+        # Typo tolerance: trigram overlap finds candidates, edit distance confirms them
+        max_distance = _max_typos(query_token)
+        if max_distance:
+            overlap: dict[str, int] = {}
+            for gram in trigrams(query_token):
+                for token in self._trigrams.get(gram, ()):
+                    overlap[token] = overlap.get(token, 0) + 1
+            for token, shared in overlap.items():
+                if shared < 2 or token in matches or abs(len(token) - len(query_token)) > max_distance:
+                    continue
+                distance = _edit_distance(query_token, token, max_distance)
+                if distance <= max_distance:
+                    matches[token] = 0.6 * (1 - distance / len(query_token))
+        return matches
+
+    def _score_token(self, expansion: dict[str, float], candidates: set[int]) -> dict[int, float]:
+        """Best weighted hit per candidate model for one query token."""
+        postings = [(self._postings[token], quality) for token, quality in expansion.items()]
+        if len(postings) == 1:
+            p, quality = postings[0]
+            if len(candidates) < len(p):
+                return {idx: p[idx] * quality for idx in candidates}
+            if quality == 1.0:
+                return p
+            return {idx: weight * quality for idx, weight in p.items()}
+
+        best: dict[int, float] = {}
+        if len(candidates) * len(postings) < sum(len(p) for p, _ in postings):
+            # Probing a few candidates is cheaper than walking long postings
+            for idx in candidates:
+                best[idx] = max(p.get(idx, 0) * quality for p, quality in postings)
+            return best
+
+        for p, quality in postings:
+            for idx, weight in p.items():
+                score = weight * quality
+                if score > best.get(idx, 0):
+                    best[idx] = score
+        return best
+
+    def _candidates(self, expansions: list[dict[str, float]]) -> set[int]:
+        postings = [[self._postings[token] for token in expansion] for expansion in expansions]
+        # Intersect starting from the rarest query token so later filters stay small
+        postings.sort(key=lambda group: sum(len(p) for p in group))
+        union = set().union(*(p.keys() for p in postings[0]))
+        candidates = union
+        for group in postings[1:]:
+            if len(group) == 1:
+                candidates = candidates & group[0].keys()
+            else:
+                candidates = {idx for idx in candidates if any(idx in p for p in group)}
+            if not candidates:
+                break
+        if candidates:
+            return candidates
+        # Nothing matches every token: fall back to partial matches
+        for group in postings[1:]:
+            union.update(*(p.keys() for p in group))
+        return union
+
+    def _score(self, query: str) -> dict[int, float]:
+        """Score of every model matching the query."""
+        query_tokens = list(dict.fromkeys(tokenize(query)))
+        if not query_tokens:
+            return {}
+
+        expansions = [self._expand(token) for token in query_tokens]
+        expansions = [expansion for expansion in expansions if expansion] or expansions[:1]
+        if not expansions[0]:
+            return {}
+        candidates = self._candidates(expansions)
+
+        scores = dict(self._score_token(expansions[0], candidates))
+        for expansion in expansions[1:]:
+            for idx, score in self._score_token(expansion, candidates).items():
+                scores[idx] = scores.get(idx, 0) + score
+        if len(scores) > len(candidates):
+            scores = {idx: scores[idx] for idx in candidates}
+
+        # Literal substring of the id (e.g. "gpt-4o") beats token-level matches
+        compact_query = query.lower().strip()
+        ids = self._ids
+        return {idx: score + 2.0 if compact_query in ids[idx] else score for idx, score in scores.items()}
+
+    def search(self, query: str, offset: int = 0, limit: int = 10) -> tuple[list[ModelInfo], int]:
+        key = query.lower().strip()
+        scores = self._cache.get(key)
+        if scores is None:
+            scores = self._score(key)
+            self._cache[key] = scores
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        else:
+            self._cache.move_to_end(key)
+        # Only the requested page gets sorted; broad queries match thousands of models
+        ranked = nlargest(offset + limit, scores, key=scores.__getitem__)
+        return [self.models[idx] for idx in ranked[offset:]], len(scores)
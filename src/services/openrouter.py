@@ -1,20 +1,238 @@
-from openai import AsyncOpenAI
+from collections import OrderedDict
+from contextlib import aclosing
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, APIConnectionError, APIStatusError
 from src.config import Config
 from src.logger import logger
-import aiohttp
+from src.services.catalog import model_catalog
+from src.services.model_info import ModelInfo
+from src.services.telemetry import model_telemetry
+from src.services.metrics import metrics
+from src.services.response_cache import ResponseCache, response_cache
+from src.services.coalescing import inflight_requests
+from src.services.scheduler import outbound_scheduler
+import asyncio
+import httpx
 import time
 
-class OpenRouterService:
-    _models_cache = []
-    _cache_time = 0
-    CACHE_DURATION = 3600  # 1 hour
 
+# Characters per chunk when replaying a cached answer
+CACHE_REPLAY_CHUNK = 200
+
+
+class ModelsUnavailableError(Exception):
+    pass
+
+
+def is_retryable_error(error: Exception) -> bool:
+    """Rate limits, upstream 5xx and connection failures are worth retrying on another model."""
+    if isinstance(error, APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, APIConnectionError)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    return isinstance(error, APIStatusError) and error.status_code == 429
+
+
+def parse_usage(usage) -> dict:
+    """Token counts from the final stream chunk; OpenRouter adds the request cost when asked to."""
+    cost = getattr(usage, "cost", None)
+    return {
+        "prompt_tokens": usage.prompt_tokens or 0,
+        "completion_tokens": usage.completion_tokens or 0,
+        "cost": float(cost) if cost is not None else None,
+    }
+
+
+class CircuitBreaker:
+    """
+    Per-model breaker for one API key: opens after `threshold` consecutive
+    failures, lets a single probe through once `cooldown` has passed
+    (half-open), and closes again on the first success.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, threshold: int = None, cooldown: float = None):
+        self.threshold = threshold or Config.BREAKER_FAILURE_THRESHOLD
+        self.cooldown = cooldown or Config.BREAKER_COOLDOWN
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        if self.failures < self.threshold:
+            return self.CLOSED
+        if time.monotonic() - self.opened_at >= self.cooldown:
+            return self.HALF_OPEN
+        return self.OPEN
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == self.CLOSED:
+            return True
+        if state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self._probing = False
+
+    def release(self):
+        self._probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        self._probing = False
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+class CircuitBreakers:
+    """
+    Breakers keyed by (API key, model): errors on a custom key usually mean
+    that key's own quota, so they must not open the model for everyone else.
+    """
+
+    def __init__(self):
+        self._breakers: dict[tuple[str, str], CircuitBreaker] = {}
+
+    def get(self, api_key: str, model: str) -> CircuitBreaker:
+        breaker = self._breakers.get((api_key, model))
+        if breaker is None:
+            breaker = self._breakers[(api_key, model)] = CircuitBreaker()
+        return breaker
+
+
+circuit_breakers = CircuitBreakers()
+
+
+class OpenRouterClientPool:
+    """
+    Process-wide registry of long-lived AsyncOpenAI clients, one per API key.
+    Each client owns an httpx connection pool, so reusing it skips the TCP+TLS
+    handshake on every turn. The shared key is pinned; custom keys are evicted
+    LRU-style and closed after sitting idle for a while.
+    """
+
+    def __init__(self, max_keys: int = None, idle_timeout: float = None):
+        self.max_keys = max_keys or Config.CLIENT_POOL_MAX_KEYS
+        self.idle_timeout = idle_timeout or Config.CLIENT_POOL_IDLE_TIMEOUT
+        self._clients: OrderedDict[str, AsyncOpenAI] = OrderedDict()
+        self._http_clients: dict[str, httpx.AsyncClient] = {}
+        self._last_used: dict[str, float] = {}
+        # Requests running on each client; evicted clients stay open until theirs finish
+        self._in_use: dict[AsyncOpenAI, int] = {}
+        self._retired: set[AsyncOpenAI] = set()
+
+    def _is_pinned(self, api_key: str) -> bool:
+        return api_key == Config.OPENROUTER_API_KEY
+
+    def _create_client(self, api_key: str) -> AsyncOpenAI:
+        http_client = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=90.0),
+        )
+        self._http_clients[api_key] = http_client
+        return AsyncOpenAI(api_key=api_key, base_url=Config.OPENROUTER_BASE_URL, http_client=http_client)
+
+    def get(self, api_key: str) -> AsyncOpenAI:
+        client = self._clients.get(api_key)
+        if client is None:
+            client = self._create_client(api_key)
+            self._clients[api_key] = client
+            self._evict_overflow()
+        self._clients.move_to_end(api_key)
+        self._last_used[api_key] = time.monotonic()
+        return client
+
+    def _evict_overflow(self):
+        # Oldest first; the pinned shared key never counts as a candidate
+        for key in list(self._clients):
+            if len(self._clients) <= self.max_keys:
+                break
+            if not self._is_pinned(key):
+                self._discard(key)
+
+    def _discard(self, api_key: str):
+        client = self._clients.pop(api_key, None)
+        self._http_clients.pop(api_key, None)
+        self._last_used.pop(api_key, None)
+        if client is None:
+            return
+        if self._in_use.get(client):
+            # Closing now would cut off its running streams; release() closes it after the last one
+            self._retired.add(client)
+        else:
+            self._close_later(client)
+
+    def _close_later(self, client: AsyncOpenAI):
+        try:
+            asyncio.get_running_loop().create_task(client.close())
+        except RuntimeError:
+            pass
+
+    def acquire(self, client: AsyncOpenAI):
+        """Marks a request as running on `client`, so eviction doesn't close it underneath."""
+        self._in_use[client] = self._in_use.get(client, 0) + 1
+
+    def release(self, client: AsyncOpenAI):
+        count = self._in_use.pop(client, 0) - 1
+        if count > 0:
+            self._in_use[client] = count
+        elif client in self._retired:
+            self._retired.discard(client)
+            self._close_later(client)
+
+    def close_idle(self) -> int:
+        now = time.monotonic()
+        idle = [
+            key for key, used in self._last_used.items()
+            if not self._is_pinned(key) and now - used > self.idle_timeout
+        ]
+        for key in idle:
+            self._discard(key)
+        return len(idle)
+
+    async def warmup(self, api_key: str = None, connections: int = None):
+        api_key = api_key or Config.OPENROUTER_API_KEY
+        connections = connections or Config.CLIENT_POOL_WARM_CONNECTIONS
+        self.get(api_key)
+        http_client = self._http_clients[api_key]
+        url = f"{Config.OPENROUTER_BASE_URL}/models"
+        # Concurrent HEADs force the pool to open several keep-alive connections
+        results = await asyncio.gather(
+            *(http_client.head(url) for _ in range(connections)),
+            return_exceptions=True,
+        )
+        failed = [r for r in results if isinstance(r, Exception)]
+        if failed:
+            logger.warning(f"Connection warmup: {len(failed)}/{connections} failed ({failed[0]})")
+
+    async def close(self):
+        clients = [*self._clients.values(), *self._retired]
+        self._clients.clear()
+        self._http_clients.clear()
+        self._last_used.clear()
+        self._in_use.clear()
+        self._retired.clear()
+        await asyncio.gather(*(c.close() for c in clients), return_exceptions=True)
+
+
+client_pool = OpenRouterClientPool()
+
+
+class OpenRouterService:
     def __init__(self, api_key: str = None):
         self.api_key = api_key or Config.OPENROUTER_API_KEY
-        self.client = AsyncOpenAI(
-            api_key=self.api_key,
-            base_url="https://openrouter.ai/api/v1",
-        )
+        self.client = client_pool.get(self.api_key)
+        self.last_model = None
+        self.cache_hit = False
+        # Reported by the upstream request this service made; None for cache hits and coalesced followers
+        self.last_usage = None
+        self._schedule = (0, 1.0, None)
 
     async def verify_key(self) -> bool:
         try:
@@ -24,103 +242,259 @@ class OpenRouterService:
             logger.error(f"Key verification failed: {e}")
             return False
 
-    async def _fetch_models(self) -> list[dict]:
-        current_time = time.time()
-        if self._models_cache and (current_time - self._cache_time < self.CACHE_DURATION):
-            return self._models_cache
+    async def _fetch_models(self) -> list[ModelInfo]:
+        return await model_catalog.get_models()
 
-        try:
-            async with aiohttp.ClientSession() as session:
-                async with session.get("https://openrouter.ai/api/v1/models") as response:
-                    if response.status != 200:
-                        logger.error(f"Failed to fetch models: {response.status}")
-                        return []
-                    
-                    data = await response.json()
-                    self._models_cache = data.get("data", [])
-                    self._cache_time = current_time
-                    return self._models_cache
-                    
-        except Exception as e:
-            logger.error(f"Error fetching models: {e}")
-            return []
+    async def get_free_models(self) -> tuple[ModelInfo, ...]:
+        await self._fetch_models()
+        # Ranked once per catalog version, re-sorted when telemetry publishes; see FreeModelIndex
+        return model_catalog.free_index.live_ranked(model_telemetry)
 
-    async def get_free_models(self) -> list[dict]:
-        all_models = await self._fetch_models()
-        
-        # Filter: Pricing must be 0 for prompt and completion
-        free_models = [
-            m for m in all_models 
-            if float(m.get('pricing', {}).get('prompt', -1)) == 0 
-            and float(m.get('pricing', {}).get('completion', -1)) == 0
-        ]
-        
-        # Tier 1: High Reliability (Mainstream providers)
-        tier_1 = ["google/", "meta-llama/", "mistralai/", "microsoft/"]
-        # Tier 2: Popular but potentially rate-limited
-        tier_2 = ["deepseek/", "qwen/"]
-        # Tier 3: Everything else (often community merges, experimental)
-
-        def sort_key(model):
-            mid = model.get('id', '').lower()
-            context = int(model.get('context_length', 0))
-            
-            score = 0
-            
-            # Check Tiers
-            is_t1 = any(k in mid for k in tier_1)
-            is_t2 = any(k in mid for k in tier_2)
-            
-            if is_t1:
-                score += 10**12 # Top priority
-            elif is_t2:
-                score += 10**9  # High priority
-            
-            # Secondary sort: Deprioritize "chimera", "dolphin", "nous" if they are not in T1
-            # (Though T1 filter above handles most, but let's be safe for T3)
-            if "chimera" in mid or "dolphin" in mid or "nous" in mid:
-                score -= 10**6
-                
-            # Tertiary sort by context length
-            score += context
-            return score
-
-        free_models.sort(key=sort_key, reverse=True)
-        
-        # Return ALL models for pagination (controlled by views)
-        return free_models
-
-    async def search_models(self, query: str) -> list[dict]:
-        all_models = await self._fetch_models()
-        query = query.lower().strip()
-        
-        matches = [
-            m for m in all_models 
-            if query in m.get('id', '').lower() 
-            or query in m.get('name', '').lower()
-        ]
-        
-        # Sort by popularity (if available) or context length
-        matches.sort(key=lambda x: int(x.get('context_length', 0)), reverse=True)
-        return matches[:10]  # Return top 10 matches
+    async def search_models(self, query: str, offset: int = 0, limit: int = 10) -> tuple[list[ModelInfo], int]:
+        await self._fetch_models()
+        return model_catalog.search_index.search(query, offset, limit)
+
+    def failover_chain(self, model: str) -> list[str]:
+        """
+        Next healthy models from the free ranking, used only when the chosen
+        model is itself free. Built from the catalog as already loaded: a chat
+        turn never waits on a /models fetch for its fallbacks.
+        """
+        info = model_catalog.get_model(model)
+        if Config.FAILOVER_MAX_MODELS <= 0 or info is None or not info.is_free:
+            return []
+        free_models = model_catalog.free_index.live_ranked(model_telemetry)
+        return [
+            m.id for m in free_models
+            if m.id != model and circuit_breakers.get(self.api_key, m.id).state != CircuitBreaker.OPEN
+        ][:Config.FAILOVER_MAX_MODELS]
 
-    async def stream_chat(self, model: str, messages: list[dict]):
+    async def _stream_content(self, model: str, messages: list[dict]):
+        client_pool.acquire(self.client)
         try:
             stream = await self.client.chat.completions.create(
                 model=model,
                 messages=messages,
                 stream=True,
+                stream_options={"include_usage": True},
+                extra_body={"usage": {"include": True}},
                 extra_headers={
                     "HTTP-Referer": "https://github.com/combx/openrouter-telegram-bot",
                     "X-Title": "OpenRouter Telegram Bot",
                 }
             )
-            
-            async for chunk in stream:
-                content = chunk.choices[0].delta.content
-                if content:
+            try:
+                async for chunk in stream:
+                    if chunk.usage:
+                        self.last_usage = parse_usage(chunk.usage)
+                    if not chunk.choices:
+                        continue
+                    content = chunk.choices[0].delta.content
+                    if content:
+                        yield content
+            finally:
+                # Release the upstream connection even when the consumer stops early
+                await stream.close()
+        finally:
+            client_pool.release(self.client)
+
+    async def _attempt(self, model: str, messages: list[dict]):
+        """Opens a stream on one model and waits for its first chunk."""
+        breaker = circuit_breakers.get(self.api_key, model)
+        started = time.monotonic()
+        chunks = self._stream_content(model, messages)
+        try:
+            first = await chunks.__anext__()
+        except StopAsyncIteration:
+            first = ""
+        except asyncio.CancelledError:
+            # Lost a hedge race: close the upstream request and free a half-open probe slot
+            await chunks.aclose()
+            breaker.release()
+            raise
+        except Exception as e:
+            await chunks.aclose()
+            if not is_retryable_error(e):
+                # Says nothing about the model's health: free a half-open probe slot, keep the count
+                breaker.release()
+                raise
+            breaker.record_failure()
+            model_telemetry.record_error(model, rate_limited=is_rate_limit_error(e))
+            logger.warning(f"Model {model} failed ({e}), trying next")
+            raise
+
+        breaker.record_success()
+        return chunks, model, first, time.monotonic() - started
+
+    async def _open_with_failover(self, models: list[str], messages: list[dict]):
+        """
+        Returns (content iterator, model, first chunk, ttft) from the first model
+        that produces output. Candidates are tried in order on retryable errors;
+        with hedging on, the next candidate is also started when the current one
+        stays silent for HEDGE_DELAY, and the slower request is cancelled.
+        """
+        candidates = iter(dict.fromkeys(models))
+        attempts: dict[asyncio.Task, str] = {}
+
+        def launch_next() -> bool:
+            for model in candidates:
+                if circuit_breakers.get(self.api_key, model).allow():
+                    attempts[asyncio.create_task(self._attempt(model, messages))] = model
+                    return True
+                logger.info(f"Skipping {model}: circuit open")
+            return False
+
+        hedge_delay = {"delay": Config.HEDGE_DELAY, "fast": 0}.get(Config.HEDGE_MODE)
+        hedged = hedge_delay is None
+        raced = False
+        last_error = None
+        launch_next()
+        try:
+            while attempts:
+                timeout = hedge_delay if not hedged and len(attempts) == 1 else None
+                done, _ = await asyncio.wait(attempts, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    # Primary is slow: race it against the next candidate
+                    hedged = True
+                    if launch_next():
+                        raced = True
+                        metrics.inc("hedge.started")
+                    continue
+
+                winner = None
+                for task in done:
+                    attempts.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        if not is_retryable_error(e):
+                            raise
+                        last_error = e
+                        continue
+                    if winner is None:
+                        winner = result
+                    else:
+                        # Both finished in the same tick; keep one, release the other
+                        await result[0].aclose()
+
+                if winner is not None:
+                    if raced:
+                        metrics.inc("hedge.won_primary" if winner[1] == models[0] else "hedge.won_alternate")
+                    return winner
+                if not attempts:
+                    launch_next()
+        finally:
+            for task in attempts:
+                task.cancel()
+            if attempts:
+                await asyncio.gather(*attempts, return_exceptions=True)
+
+        if last_error is not None:
+            raise last_error
+        raise ModelsUnavailableError(f"All candidate models are temporarily unavailable: {', '.join(models)}")
+
+    async def stream_chat(self, model: str, messages: list[dict], fallbacks: list[str] = None, use_cache: bool = False,
+                          user_id: int = 0, weight: float = 1.0, on_queue=None):
+        # The model that actually answered; differs from `model` after a failover
+        self.last_model = None
+        self.cache_hit = False
+        self.last_usage = None
+        # Fair-share scheduling of the upstream call; on_queue(position) reports queue progress
+        self._schedule = (user_id, weight, on_queue)
+        cache_key = response_cache.key(model, messages) if use_cache else None
+
+        if cache_key:
+            cached = response_cache.get(cache_key)
+            if cached:
+                text, self.last_model = cached
+                self.cache_hit = True
+                # Replay as a stream so the caller's edit loop stays the same
+                for i in range(0, len(text), CACHE_REPLAY_CHUNK):
+                    yield text[i:i + CACHE_REPLAY_CHUNK]
+                    await asyncio.sleep(0)
+                return
+
+        parts = []
+        async with aclosing(self._stream_coalesced(model, messages, fallbacks)) as upstream:
+            async for content in upstream:
+                if cache_key:
+                    parts.append(content)
+                yield content
+        if cache_key and parts:
+            response_cache.put(cache_key, "".join(parts), self.last_model)
+
+    async def _stream_coalesced(self, model: str, messages: list[dict], fallbacks: list[str] = None):
+        """Identical concurrent requests on the same key share one upstream stream."""
+        if not Config.COALESCE_ENABLED:
+            async with aclosing(self._stream_scheduled(model, messages, fallbacks)) as upstream:
+                async for content in upstream:
                     yield content
-                    
+            return
+
+        key = (self.api_key, ResponseCache.key(model, messages))
+        shared = inflight_requests.get(key)
+        if shared is not None:
+            metrics.inc("coalesce.joined")
+            received = False
+            try:
+                async with aclosing(shared.consume()) as chunks:
+                    async for content in chunks:
+                        received = True
+                        yield content
+            except Exception as e:
+                if received:
+                    raise
+                # The leader failed before producing anything: try on our own
+                logger.info(f"Coalesced request failed ({e}), retrying independently")
+            else:
+                self.last_model = shared.model
+                metrics.inc("coalesce.saved")
+                return
+
+        shared = inflight_requests.start(key, self._stream_scheduled(model, messages, fallbacks), owner=self)
+        async with aclosing(shared.consume()) as chunks:
+            async for content in chunks:
+                yield content
+
+    async def _stream_scheduled(self, model: str, messages: list[dict], fallbacks: list[str] = None):
+        """Holds one of the API key's concurrency slots for the lifetime of the upstream stream."""
+        user_id, weight, on_queue = self._schedule
+        scheduler = outbound_scheduler.for_key(self.api_key)
+        await scheduler.acquire(user_id, weight, on_queue)
+        try:
+            async with aclosing(self._stream_upstream(model, messages, fallbacks)) as upstream:
+                async for content in upstream:
+                    yield content
+        finally:
+            scheduler.release()
+
+    async def _stream_upstream(self, model: str, messages: list[dict], fallbacks: list[str] = None):
+        try:
+            chunks, self.last_model, first, ttft = await self._open_with_failover([model] + list(fallbacks or []), messages)
+        except Exception as e:
+            logger.exception(f"Stream error: {e}")
+            raise e
+
+        first_token_at = time.monotonic()
+        chars = 0
+        try:
+            if first:
+                chars += len(first)
+                yield first
+            async for content in chunks:
+                chars += len(content)
+                yield content
         except Exception as e:
+            # Mid-stream failures can't fail over without repeating text the user already saw
+            if is_retryable_error(e):
+                circuit_breakers.get(self.api_key, self.last_model).record_failure()
+            model_telemetry.record_error(self.last_model, rate_limited=is_rate_limit_error(e))
             logger.exception(f"Stream error: {e}")
             raise e
+        finally:
+            await chunks.aclose()
+
+        # ~4 chars per token; short replies are too noisy to say anything about throughput
+        duration = time.monotonic() - first_token_at
+        tokens_per_second = (chars / 4) / duration if duration > 0.5 else None
+        model_telemetry.record_success(self.last_model, ttft, tokens_per_second)
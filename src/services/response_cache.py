@@ -0,0 +1,61 @@
+from collections import OrderedDict
+from src.config import Config
+from src.services.metrics import metrics
+import hashlib
+import json
+import time
+
+
+class ResponseCache:
+    """
+    Exact-match cache of finished answers, keyed by a hash of the model and
+    the full message list (system prompt included). Bounded by entry count,
+    total size in bytes and a TTL; least recently used entries go first.
+    """
+
+    def __init__(self, max_entries: int = None, max_bytes: int = None, ttl: float = None):
+        self.max_entries = max_entries or Config.RESPONSE_CACHE_MAX_ENTRIES
+        self.max_bytes = max_bytes or Config.RESPONSE_CACHE_MAX_BYTES
+        self.ttl = ttl or Config.RESPONSE_CACHE_TTL
+        self.size_bytes = 0
+        # key -> (stored_at, text, answered_model, size)
+        self._entries: OrderedDict[str, tuple[float, str, str, int]] = OrderedDict()
+
+    @staticmethod
+    def key(model: str, messages: list[dict]) -> str:
+        payload = json.dumps([model, messages], ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> tuple[str, str] | None:
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry[0] > self.ttl:
+            self._remove(key)
+            entry = None
+        if entry is None:
+            metrics.inc("response_cache.misses")
+            return None
+        self._entries.move_to_end(key)
+        metrics.inc("response_cache.hits")
+        return entry[1], entry[2]
+
+    def put(self, key: str, text: str, answered_model: str):
+        size = len(text.encode())
+        if size > self.max_bytes:
+            return
+        self._remove(key)
+        self._entries[key] = (time.monotonic(), text, answered_model, size)
+        self.size_bytes += size
+        while len(self._entries) > self.max_entries or self.size_bytes > self.max_bytes:
+            self._remove(next(iter(self._entries)))
+            metrics.inc("response_cache.evictions")
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size_bytes -= entry[3]
+
+
+response_cache = ResponseCache()
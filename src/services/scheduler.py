@@ -0,0 +1,119 @@
+from src.config import Config
+from src.services.metrics import metrics
+import asyncio
+import heapq
+import itertools
+import time
+
+
+class QueueTimeoutError(Exception):
+    pass
+
+
+class KeyScheduler:
+    """
+    Bounded number of concurrent upstream generations for one API key.
+    Waiting requests are served by weighted fair queuing: each user's
+    requests get virtual finish tags spaced 1/weight apart, so a user with
+    many queued messages cannot starve the others, and heavier weights
+    (unlimited users) get proportionally more turns.
+    """
+
+    def __init__(self, limit: int, max_wait: float):
+        self.limit = limit
+        self.max_wait = max_wait
+        self.active = 0
+        self._queue: list[list] = []  # heap of [finish_tag, seq, future, start_tag]
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._user_finish: dict[int, float] = {}
+
+    @property
+    def waiting(self) -> int:
+        return sum(1 for entry in self._queue if not entry[2].done())
+
+    def _tag(self, user_id: int, weight: float) -> tuple[float, float]:
+        start = max(self._virtual_time, self._user_finish.get(user_id, 0.0))
+        finish = start + 1.0 / max(weight, 0.01)
+        self._user_finish[user_id] = finish
+        return start, finish
+
+    def position(self, entry: list) -> int:
+        return 1 + sum(1 for other in self._queue if other[:2] < entry[:2] and not other[2].done())
+
+    async def acquire(self, user_id: int, weight: float = 1.0, on_position=None):
+        start, finish = self._tag(user_id, weight)
+        if self.active < self.limit and not self.waiting:
+            self.active += 1
+            self._virtual_time = max(self._virtual_time, start)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [finish, next(self._seq), future, start]
+        heapq.heappush(self._queue, entry)
+        metrics.inc("scheduler.queued")
+        deadline = time.monotonic() + self.max_wait
+        reported = None
+        try:
+            while not future.done():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    metrics.inc("scheduler.shed")
+                    raise QueueTimeoutError(f"Waited more than {self.max_wait:.0f}s for a free slot")
+                position = self.position(entry)
+                if on_position and position != reported:
+                    reported = position
+                    await on_position(position)
+                # Wake up periodically to refresh the reported position
+                await asyncio.wait([future], timeout=min(remaining, 2.0))
+        except BaseException:
+            if future.done() and not future.cancelled():
+                # Slot was handed over while we were giving up: pass it on
+                self.release()
+            else:
+                future.cancel()
+            raise
+
+    def release(self):
+        while self._queue:
+            _, _, future, start = heapq.heappop(self._queue)
+            if future.done():
+                continue
+            # Hand the slot straight to the next waiter; `active` stays the same
+            self._virtual_time = max(self._virtual_time, start)
+            future.set_result(True)
+            self._prune()
+            return
+        self.active -= 1
+        self._prune()
+
+    def _prune(self):
+        if len(self._user_finish) > 1000:
+            self._user_finish = {
+                user: tag for user, tag in self._user_finish.items() if tag > self._virtual_time
+            }
+
+
+class OutboundScheduler:
+    """One KeyScheduler per API key: the shared key gets the large budget, custom keys a small one each."""
+
+    def __init__(self):
+        self._schedulers: dict[str, KeyScheduler] = {}
+
+    def for_key(self, api_key: str) -> KeyScheduler:
+        scheduler = self._schedulers.get(api_key)
+        if scheduler is None:
+            if api_key == Config.OPENROUTER_API_KEY:
+                limit = Config.SCHEDULER_SHARED_KEY_CONCURRENCY
+            else:
+                limit = Config.SCHEDULER_CUSTOM_KEY_CONCURRENCY
+            scheduler = self._schedulers[api_key] = KeyScheduler(limit, Config.SCHEDULER_MAX_WAIT)
+        return scheduler
+
+    def prune(self):
+        for api_key, scheduler in list(self._schedulers.items()):
+            if scheduler.active == 0 and not scheduler.waiting:
+                del self._schedulers[api_key]
+
+
+outbound_scheduler = OutboundScheduler()
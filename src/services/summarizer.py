@@ -0,0 +1,95 @@
+import asyncio
+import time
+from src.config import Config
+from src.database import UnitOfWork
+from src.logger import logger
+from src.services.context_builder import message_tokens, tokenizer_name
+from src.services.openrouter import OpenRouterService
+from src.services.usage import usage_ledger
+from src.services.conversation import compact_conversation
+
+SUMMARY_PROMPT = (
+    "You compress chat histories. Write a concise summary of the conversation below, "
+    "keeping facts, names, decisions, open questions and the user's preferences. "
+    "If a previous summary is given, merge it in. Reply with the summary only."
+)
+
+
+def split_for_summary(history: list[dict], keep_tokens: int, tokenizer: str) -> int:
+    """Number of oldest messages to summarize so that roughly keep_tokens of recent turns stay verbatim."""
+    kept = 0
+    index = len(history)
+    while index > 0 and kept + message_tokens(history[index - 1], tokenizer) <= keep_tokens:
+        index -= 1
+        kept += message_tokens(history[index], tokenizer)
+    # Keep at least the last exchange and start the retained part on a user turn
+    index = min(index, len(history) - 2)
+    while 0 < index < len(history) and history[index]["role"] != "user":
+        index += 1
+    return max(index, 0)
+
+
+def summary_request(prefix: list[dict], summary: str | None) -> list[dict]:
+    transcript = "\n\n".join(f"{m['role'].capitalize()}: {m['content']}" for m in prefix)
+    if summary:
+        transcript = f"Previous summary:\n{summary}\n\nConversation:\n{transcript}"
+    return [{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": transcript}]
+
+
+class Summarizer:
+    """Compacts long conversations in the background, at most one job per user."""
+
+    def __init__(self):
+        self._tasks: dict[int, asyncio.Task] = {}
+
+    def maybe_schedule(self, user_id: int, history: list[dict], summary: str | None, model: str):
+        if not Config.SUMMARY_ENABLED or user_id in self._tasks:
+            return
+        tokenizer = tokenizer_name(model)
+        if sum(message_tokens(m, tokenizer) for m in history) < Config.SUMMARY_TRIGGER_TOKENS:
+            return
+        count = split_for_summary(history, Config.SUMMARY_KEEP_TOKENS, tokenizer)
+        if count <= 0:
+            return
+        prefix = [{"role": m["role"], "content": m["content"], "seq": m["seq"]} for m in history[:count]]
+        task = asyncio.create_task(self._compact(user_id, prefix, summary))
+        self._tasks[user_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(user_id, None))
+
+    async def _summarize(self, user_id: int, prefix: list[dict], summary: str | None) -> str:
+        service = OpenRouterService(api_key=Config.OPENROUTER_API_KEY)
+        model = Config.SUMMARY_MODEL
+        if not model:
+            free_models = await service.get_free_models()
+            if not free_models:
+                return ""
+            model = free_models[0].id
+        parts = []
+        started = time.monotonic()
+        async for chunk in service.stream_chat(model, summary_request(prefix, summary), service.failover_chain(model)):
+            parts.append(chunk)
+        if service.last_usage:
+            latency_ms = int((time.monotonic() - started) * 1000)
+            usage_ledger.record(user_id, service.last_model, service.api_key, service.last_usage, latency_ms)
+        return "".join(parts).strip()
+
+    async def _compact(self, user_id: int, prefix: list[dict], summary: str | None):
+        try:
+            new_summary = await self._summarize(user_id, prefix, summary)
+            if not new_summary:
+                return
+            async with UnitOfWork() as uow:
+                if await compact_conversation(uow, user_id, prefix, new_summary):
+                    logger.info(f"Compacted {len(prefix)} messages for user {user_id}")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.warning(f"Summarization failed for user {user_id}: {e}")
+
+    async def close(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
+        await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+
+summarizer = Summarizer()
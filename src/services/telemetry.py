@@ -0,0 +1,120 @@
+from collections import deque
+from src.config import Config
+from src.logger import logger
+import json
+import os
+import statistics
+import time
+
+# Weights used to blend live measurements into the static free-model score
+# (tiers there are 10^12 / 10^9 apart). A model failing every request sinks
+# below every healthy one; speed only reorders models within a tier.
+ERROR_PENALTY = 2 * 10**12
+SPEED_BONUS = 5 * 10**8
+REFERENCE_TTFT = 3.0  # seconds; faster earns a bonus, slower a penalty
+REFERENCE_TPS = 40.0  # tokens per second
+MIN_SAMPLES = 3
+
+
+class ModelTelemetry:
+    """
+    Rolling per-model window of time-to-first-token, throughput, error and
+    429 rates. `publish()` (run periodically) turns the window into ranking
+    adjustments, bumps `epoch` so rankings re-sort, and persists the
+    aggregates so they survive restarts.
+    """
+
+    def __init__(self, window: float = None, path: str = None):
+        self.window = window or Config.TELEMETRY_WINDOW
+        self.path = path or Config.TELEMETRY_PATH
+        self.epoch = 0
+        self.aggregates: dict[str, dict] = {}
+        self.adjustments: dict[str, float] = {}
+        # model -> deque of (timestamp, ttft, tokens_per_second, error, rate_limited)
+        self._samples: dict[str, deque] = {}
+
+    def _add(self, model: str, sample: tuple):
+        samples = self._samples.get(model)
+        if samples is None:
+            samples = self._samples[model] = deque(maxlen=500)
+        samples.append(sample)
+
+    def record_success(self, model: str, ttft: float, tokens_per_second: float | None):
+        self._add(model, (time.time(), ttft, tokens_per_second, False, False))
+
+    def record_error(self, model: str, rate_limited: bool):
+        self._add(model, (time.time(), None, None, True, rate_limited))
+
+    def _aggregate(self, samples: deque) -> dict | None:
+        cutoff = time.time() - self.window
+        while samples and samples[0][0] < cutoff:
+            samples.popleft()
+        if not samples:
+            return None
+
+        ttfts = [s[1] for s in samples if s[1] is not None]
+        rates = [s[2] for s in samples if s[2] is not None]
+        return {
+            "updated_at": time.time(),
+            "requests": len(samples),
+            "ttft_p50": statistics.median(ttfts) if ttfts else None,
+            "tokens_per_second": statistics.mean(rates) if rates else None,
+            "error_rate": sum(1 for s in samples if s[3]) / len(samples),
+            "rate_limit_rate": sum(1 for s in samples if s[4]) / len(samples),
+        }
+
+    @staticmethod
+    def adjustment(stats: dict) -> float:
+        if stats["requests"] < MIN_SAMPLES:
+            return 0.0
+        score = -stats["error_rate"] * ERROR_PENALTY
+
+        speed = []
+        if stats["ttft_p50"] is not None:
+            speed.append((REFERENCE_TTFT - stats["ttft_p50"]) / REFERENCE_TTFT)
+        if stats["tokens_per_second"] is not None:
+            speed.append((stats["tokens_per_second"] - REFERENCE_TPS) / REFERENCE_TPS)
+        if speed:
+            score += SPEED_BONUS * max(-1.0, min(1.0, sum(speed) / len(speed)))
+        return score
+
+    def publish(self):
+        # Models nobody used for a whole window drift back to their static rank
+        now = time.time()
+        aggregates = {
+            model: stats for model, stats in self.aggregates.items()
+            if now - stats.get("updated_at", 0) < self.window
+        }
+        for model, samples in self._samples.items():
+            stats = self._aggregate(samples)
+            if stats is not None:
+                aggregates[model] = stats
+        self.aggregates = aggregates
+        self.adjustments = {model: self.adjustment(stats) for model, stats in aggregates.items()}
+        self.epoch += 1
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"models": self.aggregates}, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"Failed to save model telemetry: {e}")
+
+    def load(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.error(f"Failed to load model telemetry: {e}")
+            return
+
+        self.aggregates = data.get("models", {})
+        self.publish()
+
+
+model_telemetry = ModelTelemetry()
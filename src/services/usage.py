@@ -0,0 +1,146 @@
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import bindparam, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from src.config import Config
+from src.database.models import UsageRecord, User
+from src.logger import logger
+
+
+def key_type(api_key: str) -> str:
+    return "shared" if api_key == Config.OPENROUTER_API_KEY else "custom"
+
+
+class UsageLedger:
+    """
+    Buffers usage records and per-user request counts in memory and writes
+    them in one transaction per flush, so recording a request costs no extra
+    commit on the message path. A crash loses at most one flush interval.
+    """
+
+    def __init__(self, max_pending: int = 10000):
+        self.max_pending = max_pending
+        self._pending: list[dict] = []
+        self._requests: Counter[int] = Counter()  # user_id -> answered messages not yet added to usage_count
+
+    def record(self, user_id: int, model: str, api_key: str, usage: dict, latency_ms: int):
+        if len(self._pending) >= self.max_pending:
+            # The database has been unreachable for a while; keep the newest records
+            del self._pending[0]
+        self._pending.append({
+            "user_id": user_id,
+            "model": model,
+            "key_type": key_type(api_key),
+            "prompt_tokens": usage["prompt_tokens"],
+            "completion_tokens": usage["completion_tokens"],
+            "cost": usage["cost"],
+            "latency_ms": latency_ms,
+            "created_at": datetime.now(timezone.utc),
+        })
+
+    def count_request(self, user_id: int):
+        self._requests[user_id] += 1
+
+    def pending_requests(self, user_id: int) -> int:
+        return self._requests.get(user_id, 0)
+
+    def pending_records(self) -> list[dict]:
+        return list(self._pending)
+
+    def pending_counts(self) -> Counter:
+        return Counter(self._requests)
+
+    async def flush(self, session: AsyncSession) -> int:
+        if not self._pending and not self._requests:
+            return 0
+        batch, self._pending = self._pending, []
+        counts, self._requests = self._requests, Counter()
+        try:
+            if batch:
+                await session.execute(insert(UsageRecord), batch)
+            if counts:
+                users = User.__table__
+                await session.execute(
+                    update(users)
+                    .where(users.c.id == bindparam("user_id"))
+                    .values(usage_count=users.c.usage_count + bindparam("requests")),
+                    [{"user_id": user_id, "requests": requests} for user_id, requests in counts.items()]
+                )
+            await session.commit()
+        except Exception as e:
+            await session.rollback()
+            self._pending = batch + self._pending
+            self._requests.update(counts)
+            logger.warning(f"Usage flush failed, {len(self._pending)} records pending: {e}")
+            return 0
+        return len(batch)
+
+    def __len__(self):
+        return len(self._pending)
+
+
+def _merge(rows: list[tuple], pending: list[dict], key, with_cost: bool) -> list[tuple]:
+    """Adds unflushed records to aggregate rows of (key, requests, prompt, completion[, cost])."""
+    merged = {row[0]: list(row[1:]) for row in rows}
+    for record in pending:
+        totals = merged.setdefault(key(record), [0, 0, 0, None] if with_cost else [0, 0, 0])
+        totals[0] += 1
+        totals[1] += record["prompt_tokens"]
+        totals[2] += record["completion_tokens"]
+        if with_cost and record["cost"] is not None:
+            totals[3] = (totals[3] or 0) + record["cost"]
+    return [(name, *totals) for name, totals in merged.items()]
+
+
+async def usage_by_model(session: AsyncSession, days: int = 7, pending: list[dict] = ()) -> list[tuple]:
+    """(model, requests, prompt tokens, completion tokens, cost) over the last `days`, busiest first."""
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    total = func.sum(UsageRecord.prompt_tokens + UsageRecord.completion_tokens)
+    result = await session.execute(
+        select(
+            UsageRecord.model, func.count(), func.sum(UsageRecord.prompt_tokens),
+            func.sum(UsageRecord.completion_tokens), func.sum(UsageRecord.cost)
+        )
+        .where(UsageRecord.created_at >= since)
+        .group_by(UsageRecord.model)
+        .order_by(total.desc())
+    )
+    rows = [tuple(row) for row in result.all()]
+    if not pending:
+        return rows
+    rows = _merge(rows, pending, lambda record: record["model"], with_cost=True)
+    return sorted(rows, key=lambda row: row[2] + row[3], reverse=True)
+
+
+async def top_users_by_requests(session: AsyncSession, limit: int = 5, pending: Counter = None) -> tuple[int, list[tuple]]:
+    """Total requests and the top (id, full name, requests) users, unflushed counts included."""
+    pending = pending or Counter()
+    total = await session.scalar(select(func.sum(User.usage_count))) or 0
+    result = await session.execute(
+        select(User.id, User.full_name, User.usage_count)
+        .where((User.id.in_(list(pending))) | User.id.in_(
+            select(User.id).order_by(User.usage_count.desc()).limit(limit).scalar_subquery()
+        ))
+    )
+    users = [(user_id, name, count + pending.get(user_id, 0)) for user_id, name, count in result.all()]
+    users.sort(key=lambda user: user[2], reverse=True)
+    return total + pending.total(), users[:limit]
+
+
+async def usage_by_day(session: AsyncSession, days: int = 7, pending: list[dict] = ()) -> list[tuple]:
+    """(day, requests, prompt tokens, completion tokens) over the last `days`, oldest first."""
+    since = datetime.now(timezone.utc) - timedelta(days=days)
+    day = func.date(UsageRecord.created_at)
+    result = await session.execute(
+        select(day, func.count(), func.sum(UsageRecord.prompt_tokens), func.sum(UsageRecord.completion_tokens))
+        .where(UsageRecord.created_at >= since)
+        .group_by(day)
+        .order_by(day)
+    )
+    rows = [tuple(row) for row in result.all()]
+    if not pending:
+        return rows
+    return sorted(_merge(rows, pending, lambda record: str(record["created_at"].date()), with_cost=False))
+
+
+usage_ledger = UsageLedger()
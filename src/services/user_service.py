@@ -1,57 +1,193 @@
-from sqlalchemy import select, update
-from sqlalchemy.ext.asyncio import AsyncSession
-from src.database.models import User, ErrorLog
-
-async def get_or_create_user(session: AsyncSession, telegram_id: int, username: str, full_name: str) -> User:
-    stmt = select(User).where(User.id == telegram_id)
-    result = await session.execute(stmt)
-    user = result.scalar_one_or_none()
-    
+from collections import OrderedDict
+from dataclasses import dataclass, fields, replace
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from src.config import Config
+from src.database.core import UnitOfWork
+from src.database.models import User, ErrorLog, ConversationMessage
+from src.services.metrics import metrics
+from src.services.usage import usage_ledger
+import time
+
+
+@dataclass
+class UserProfile:
+    """The columns handlers read on every update, detached from the session."""
+    id: int
+    username: str | None
+    full_name: str
+    custom_api_key: str | None
+    is_banned: bool
+    current_model: str
+    current_role: str
+    usage_count: int
+    is_unlimited: bool
+    use_response_cache: bool
+    state: str | None
+    state_data: str | None
+    context_summary: str | None
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserProfile":
+        profile = cls(**{f.name: getattr(user, f.name) for f in fields(cls)})
+        # Answered messages still waiting for the usage ledger's next flush
+        profile.usage_count += usage_ledger.pending_requests(user.id)
+        return profile
+
+
+class UserCache:
+    """
+    LRU cache of user profiles with a TTL. The functions below write through
+    to it once their change is committed, so a profile stays current as long
+    as users are only changed through this module; the TTL bounds staleness
+    otherwise.
+    """
+
+    def __init__(self, max_entries: int = None, ttl: float = None):
+        self.max_entries = max_entries or Config.USER_CACHE_MAX_ENTRIES
+        self.ttl = ttl or Config.USER_CACHE_TTL
+        # telegram_id -> (stored_at, profile)
+        self._entries: OrderedDict[int, tuple[float, UserProfile]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, telegram_id: int) -> UserProfile | None:
+        """A copy, so callers can change fields locally without touching the cache."""
+        entry = self._entries.get(telegram_id)
+        if entry is not None and time.monotonic() - entry[0] > self.ttl:
+            del self._entries[telegram_id]
+            entry = None
+        if entry is None:
+            metrics.inc("user_cache.misses")
+            return None
+        self._entries.move_to_end(telegram_id)
+        metrics.inc("user_cache.hits")
+        return replace(entry[1])
+
+    def put(self, profile: UserProfile):
+        self._entries.pop(profile.id, None)
+        self._entries[profile.id] = (time.monotonic(), replace(profile))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            metrics.inc("user_cache.evictions")
+
+    def update(self, telegram_id: int, **values):
+        """Applies a committed change to a cached profile; absent profiles are left to the next read."""
+        entry = self._entries.get(telegram_id)
+        if entry is not None:
+            for name, value in values.items():
+                setattr(entry[1], name, value)
+
+    def increment(self, telegram_id: int, name: str, amount: int = 1):
+        entry = self._entries.get(telegram_id)
+        if entry is not None:
+            setattr(entry[1], name, getattr(entry[1], name) + amount)
+
+    def clear(self):
+        self._entries.clear()
+
+    def hit_rate(self) -> float | None:
+        hits, misses = metrics.get("user_cache.hits"), metrics.get("user_cache.misses")
+        return hits / (hits + misses) if hits + misses else None
+
+
+user_cache = UserCache()
+
+
+def _new_user(**values) -> User:
+    """A User with its column defaults filled in, as they'd be after the INSERT."""
+    for column in User.__table__.columns:
+        if column.key not in values and column.default is not None and column.default.is_scalar:
+            values[column.key] = column.default.arg
+    return User(**values)
+
+async def _create_user(uow: UnitOfWork, telegram_id: int, username: str, full_name: str) -> User:
+    """
+    Inserts a new user in a transaction of its own rather than the update's:
+    the row must exist before the reply finishes, for the user's next message
+    or button press. A concurrent update that created it first wins.
+    """
+    try:
+        async with uow.read() as session, session.begin():
+            await session.execute(insert(User).values(id=telegram_id, username=username, full_name=full_name))
+        metrics.inc("db.commits")
+    except IntegrityError:
+        async with uow.read() as session:
+            return await session.get(User, telegram_id)
+    return _new_user(id=telegram_id, username=username, full_name=full_name)
+
+async def get_or_create_user(uow: UnitOfWork, telegram_id: int, username: str, full_name: str) -> UserProfile:
+    profile = user_cache.get(telegram_id)
+    if profile and profile.username == username and profile.full_name == full_name:
+        return profile
+
+    async with uow.read() as session:
+        user = await session.scalar(select(User).where(User.id == telegram_id))
     if not user:
-        user = User(id=telegram_id, username=username, full_name=full_name)
-        session.add(user)
-        await session.commit()
-    elif user.username != username or user.full_name != full_name:
-        user.username = username
-        user.full_name = full_name
-        await session.commit()
-        
-    return user
-
-async def get_user(session: AsyncSession, telegram_id: int) -> User | None:
-    return await session.get(User, telegram_id)
-
-async def update_user_model(session: AsyncSession, telegram_id: int, model: str):
-    stmt = update(User).where(User.id == telegram_id).values(current_model=model)
-    await session.execute(stmt)
-    await session.commit()
-
-async def update_user_role(session: AsyncSession, telegram_id: int, role: str):
-    stmt = update(User).where(User.id == telegram_id).values(current_role=role)
-    await session.execute(stmt)
-    await session.commit()
-
-async def set_custom_key(session: AsyncSession, telegram_id: int, key: str | None):
-    stmt = update(User).where(User.id == telegram_id).values(custom_api_key=key)
-    await session.execute(stmt)
-    await session.commit()
-    
-async def increment_usage(session: AsyncSession, telegram_id: int):
-    stmt = update(User).where(User.id == telegram_id).values(usage_count=User.usage_count + 1)
-    await session.execute(stmt)
-    await session.commit()
-
-async def log_error(session: AsyncSession, telegram_id: int, error_text: str, traceback: str):
-    log = ErrorLog(user_id=telegram_id, error_text=str(error_text), traceback=traceback)
-    session.add(log)
-    await session.commit()
-
-async def set_user_state(session: AsyncSession, telegram_id: int, state: str | None, data: str | None = None):
-    stmt = update(User).where(User.id == telegram_id).values(state=state, state_data=data)
-    await session.execute(stmt)
-    await session.commit()
-
-async def clear_user_context(session: AsyncSession, telegram_id: int):
-    stmt = update(User).where(User.id == telegram_id).values(context_history="[]")
-    await session.execute(stmt)
-    await session.commit()
+        user = await _create_user(uow, telegram_id, username, full_name)
+
+    if user.username == username and user.full_name == full_name:
+        profile = UserProfile.from_user(user)
+        user_cache.put(profile)
+        return replace(profile)
+
+    user.username = username
+    user.full_name = full_name
+    uow.add(update(User).where(User.id == telegram_id).values(username=username, full_name=full_name))
+    # Renamed by the update's commit; cached only once that succeeded
+    profile = UserProfile.from_user(user)
+    uow.after_commit(lambda: user_cache.put(profile))
+    return replace(profile)
+
+async def get_user(uow: UnitOfWork, telegram_id: int) -> UserProfile | None:
+    profile = user_cache.get(telegram_id)
+    if profile:
+        return profile
+    async with uow.read() as session:
+        user = await session.get(User, telegram_id)
+    if not user:
+        return None
+    profile = UserProfile.from_user(user)
+    user_cache.put(profile)
+    return replace(profile)
+
+def _update_user(uow: UnitOfWork, telegram_id: int, **values):
+    """Queues the UPDATE for the update's commit; the cached profile follows once it is committed."""
+    uow.add(
+        update(User).where(User.id == telegram_id).values(**values),
+        after_commit=lambda: user_cache.update(telegram_id, **values)
+    )
+
+async def update_user_model(uow: UnitOfWork, telegram_id: int, model: str):
+    _update_user(uow, telegram_id, current_model=model)
+
+async def update_user_role(uow: UnitOfWork, telegram_id: int, role: str):
+    _update_user(uow, telegram_id, current_role=role)
+
+async def set_custom_key(uow: UnitOfWork, telegram_id: int, key: str | None):
+    _update_user(uow, telegram_id, custom_api_key=key)
+
+async def set_response_cache(uow: UnitOfWork, telegram_id: int, enabled: bool):
+    _update_user(uow, telegram_id, use_response_cache=enabled)
+
+async def set_user_banned(uow: UnitOfWork, telegram_id: int, banned: bool):
+    _update_user(uow, telegram_id, is_banned=banned)
+
+def increment_usage(telegram_id: int):
+    """Write-behind: counted in memory and added to users.usage_count by the usage ledger's flush."""
+    usage_ledger.count_request(telegram_id)
+    user_cache.increment(telegram_id, "usage_count")
+
+async def log_error(uow: UnitOfWork, telegram_id: int, error_text: str, traceback: str):
+    uow.add(insert(ErrorLog).values(user_id=telegram_id, error_text=str(error_text), traceback=traceback))
+
+async def set_user_state(uow: UnitOfWork, telegram_id: int, state: str | None, data: str | None = None):
+    _update_user(uow, telegram_id, state=state, state_data=data)
+
+async def clear_user_context(uow: UnitOfWork, telegram_id: int):
+    uow.add(delete(ConversationMessage).where(ConversationMessage.user_id == telegram_id))
+    uow.add(
+        update(User).where(User.id == telegram_id).values(context_history="[]", context_summary=None),
+        after_commit=lambda: user_cache.update(telegram_id, context_summary=None)
+    )
@@ -1,7 +1,10 @@
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton
 from src.config import Config
+from src.services.model_info import ModelInfo
 
 class Keyboards:
+    SEARCH_PAGE_SIZE = 5
+
     @staticmethod
     def main_menu(is_admin: bool = False) -> InlineKeyboardMarkup:
         keyboard = [
@@ -26,7 +29,7 @@ class Keyboards:
         return InlineKeyboardMarkup(keyboard)
 
     @staticmethod
-    def model_menu(current_model: str, models_list: list[dict] = None, page: int = 0) -> InlineKeyboardMarkup:
+    def model_menu(current_model: str, models_list: tuple[ModelInfo, ...] = None, page: int = 0) -> InlineKeyboardMarkup:
         keyboard = []
         PAGE_SIZE = 5
         
@@ -37,12 +40,12 @@ class Keyboards:
             current_page_models = models_list[start_index:end_index]
             
             for model in current_page_models:
-                name = model.get('name', 'Unknown')
+                name = model.name
                 # Shorten name if too long
                 if len(name) > 30:
                     name = name[:27] + "..."
                 
-                model_id = model.get('id')
+                model_id = model.id
                 # Mark current model
                 if model_id == current_model:
                     name = f"✅ {name}"
@@ -61,6 +64,31 @@ class Keyboards:
         
         return InlineKeyboardMarkup(keyboard)
 
+    @staticmethod
+    def search_results(results: list[ModelInfo], page: int, total: int) -> InlineKeyboardMarkup:
+        keyboard = []
+        for model in results:
+            name = model.name
+            if len(name) > 30:
+                name = name[:27] + "..."
+            keyboard.append([InlineKeyboardButton(name, callback_data=f"set_model_{model.id}")])
+
+        # Pagination Controls
+        nav = []
+        if page > 0:
+            nav.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"search_page_{page - 1}"))
+        if (page + 1) * Keyboards.SEARCH_PAGE_SIZE < total:
+            nav.append(InlineKeyboardButton("➡️ Next", callback_data=f"search_page_{page + 1}"))
+        if nav:
+            keyboard.append(nav)
+
+        keyboard.append([InlineKeyboardButton("⬅️ Back", callback_data="menu_model")])
+        return InlineKeyboardMarkup(keyboard)
+
     @staticmethod
     def back_to_main() -> InlineKeyboardMarkup:
         return InlineKeyboardMarkup([[InlineKeyboardButton("⬅️ Back", callback_data="menu_main")]])
+
+    @staticmethod
+    def stop_generation(generation_id: int) -> InlineKeyboardMarkup:
+        return InlineKeyboardMarkup([[InlineKeyboardButton("⏹ Stop", callback_data=f"stop_gen_{generation_id}")]])
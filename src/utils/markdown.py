@@ -1,5 +1,15 @@
 import re
 
+# Group 1: ```...``` (multiline code), group 2: `...` (inline code)
+CODE_PATTERN = re.compile(r'(```.*?```|`[^`]*`)', re.DOTALL)
+SPECIAL_PATTERN = re.compile(r'([_*\[\]()~`>#+\-=|{}.!])')
+
+
+def escape_text(text: str) -> str:
+    """Escapes every MarkdownV2 special character (text outside code)."""
+    return SPECIAL_PATTERN.sub(r'\\\1', text)
+
+
 class MarkdownCleaner:
     """
     Cleaner for Telegram MarkdownV2.
@@ -22,9 +32,7 @@ class MarkdownCleaner:
         # We split the text by these blocks
         # Group 1: ```...``` (multiline code)
         # Group 2: `...` (inline code)
-        pattern = re.compile(r'(```.*?```|`[^`]*`)', re.DOTALL)
-        
-        parts = pattern.split(text)
+        parts = CODE_PATTERN.split(text)
         
         escaped_parts = []
         for part in parts:
@@ -36,11 +44,192 @@ class MarkdownCleaner:
                 # This is normal text, escape ALL special chars
                 # _ * [ ] ( ) ~ ` > # + - = | { } . !
                 # We use re.sub to escape them
-                escaped = re.sub(r'([_*\[\]()~`>#+\-=|{}.!])', r'\\\1', part)
-                escaped_parts.append(escaped)
+                escaped_parts.append(escape_text(part))
                 
         return "".join(escaped_parts)
 
     @staticmethod
     def clean_bot_response(text: str) -> str:
         return MarkdownCleaner.escape(text)
+
+
+def split_markdown(text: str, limit: int) -> tuple[str, str]:
+    """
+    Splits text so that the escaped head fits in `limit` chars, preferring
+    paragraph, line and word boundaries outside inline code. A code fence
+    open at the cut is closed in the head and reopened in the rest.
+    """
+    low, high = 1, len(text)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if len(MarkdownCleaner.escape(text[:middle])) + 4 <= limit:
+            low = middle
+        else:
+            high = middle - 1
+    hard = low
+
+    # Cut before an inline code span rather than through it
+    floor = hard // 2
+    spans = [m.span() for m in CODE_PATTERN.finditer(text) if m.start() < hard < m.end() and not m.group().startswith("```")]
+    if spans and spans[0][0] > floor:
+        hard = spans[0][0]
+
+    cut, skip = hard, 0
+    for separator in ("\n\n", "\n", " "):
+        position = text.rfind(separator, floor, hard)
+        if position > 0:
+            cut, skip = position, len(separator)
+            break
+
+    head, rest = text[:cut], text[cut + skip:]
+    fence = open_fence(head)
+    if fence is not None:
+        head += "```" if head.endswith("\n") else "\n```"
+        rest = fence + "\n" + rest
+    return head, rest
+
+
+def open_fence(text: str) -> str | None:
+    """Opening line (e.g. "```python") of a code fence left open at the end of text."""
+    position = text.find("`")
+    while position >= 0:
+        if text.startswith("```", position):
+            close = text.find("```", position + 3)
+            if close < 0:
+                line_end = text.find("\n", position)
+                return text[position:line_end] if line_end >= 0 else "```"
+            position = text.find("`", close + 3)
+        else:
+            close = text.find("`", position + 1)
+            if close < 0:
+                return None
+            position = text.find("`", close + 1)
+    return None
+
+
+def paginate_markdown(text: str, limit: int) -> list[str]:
+    """Raw pages of text, each escaping to at most `limit` chars."""
+    pages = []
+    while len(MarkdownCleaner.escape(text)) > limit:
+        head, text = split_markdown(text, limit)
+        pages.append(head)
+    pages.append(text)
+    return pages
+
+
+class StreamingMarkdownBuffer:
+    """
+    Accumulates a streamed reply and keeps its MarkdownV2-escaped form up to
+    date, escaping only newly appended text.
+
+    Output is identical to MarkdownCleaner.escape on the full text. Text
+    before the first unresolved backtick can never change its escaping, so
+    it is escaped once; the pending part (an inline code span or fence that
+    hasn't closed yet) is re-escaped on render.
+    """
+
+    def __init__(self):
+        self._chunks: list[str] = []
+        self._length = 0
+        self._escaped: list[str] = []
+        self._escaped_length = 0
+        # Raw text from the first unresolved backtick on
+        self._pending: list[str] = []
+        self._pending_length = 0
+        self._kind = None  # "fence", "inline" or "double" once the opening backticks are known
+        self._recent = ""  # last two pending chars before the newest piece, for fences split across chunks
+        # Plain text was escaped since the last code span; a lone backtick then counts as part of that text
+        self._after_text = False
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def rendered_length_bound(self) -> int:
+        """Upper bound on len(render()) without rendering: escaping at most doubles pending text."""
+        return self._escaped_length + 2 * self._pending_length
+
+    @property
+    def text(self) -> str:
+        if len(self._chunks) > 1:
+            self._chunks = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+
+    def append(self, chunk: str):
+        if not chunk:
+            return
+        self._chunks.append(chunk)
+        self._length += len(chunk)
+        if self._pending:
+            self._add_pending(chunk)
+        else:
+            self._consume(chunk)
+
+    def render(self, suffix: str = "") -> str:
+        """Escaped text as MarkdownCleaner.escape(self.text + suffix) would produce it (suffix without backticks)."""
+        if len(self._escaped) > 1:
+            self._escaped = ["".join(self._escaped)]
+        escaped = self._escaped[0] if self._escaped else ""
+        if not self._pending:
+            return escaped + escape_text(suffix)
+        tail = "".join(self._pending) + suffix
+        if self._after_text and "`" not in tail[1:]:
+            return escaped + escape_text(tail)
+        return escaped + MarkdownCleaner.escape(tail)
+
+    def _consume(self, text: str):
+        tick = text.find("`")
+        if tick < 0:
+            self._push(escape_text(text))
+            self._after_text = True
+            return
+        if tick:
+            self._push(escape_text(text[:tick]))
+            self._after_text = True
+        self._pending = []
+        self._pending_length = 0
+        self._kind = None
+        self._recent = ""
+        self._add_pending(text[tick:])
+
+    def _push(self, escaped: str):
+        self._escaped.append(escaped)
+        self._escaped_length += len(escaped)
+
+    def _add_pending(self, piece: str):
+        start = self._pending_length
+        self._pending.append(piece)
+        self._pending_length += len(piece)
+        end = self._match_end(piece, start)
+        self._recent = (self._recent + piece)[-2:]
+        if end is None:
+            return
+        # The code span closed: it is final, and so is everything before it
+        raw = "".join(self._pending)
+        self._pending = []
+        self._pending_length = 0
+        self._push(raw[:end])
+        self._after_text = False
+        if end < len(raw):
+            self._consume(raw[end:])
+
+    def _match_end(self, piece: str, start: int) -> int | None:
+        """End offset of the code span opened at the start of the pending text, once it is certain."""
+        if self._kind is None:
+            head = "".join(self._pending)[:3]
+            if len(head) >= 2 and head[1] != "`":
+                self._kind = "inline"
+            elif len(head) == 3:
+                self._kind = "fence" if head == "```" else "double"
+            else:
+                return None
+        if self._kind == "double":
+            # "``" followed by anything but a third backtick is an empty inline span
+            return 2
+        if self._kind == "inline":
+            tick = piece.find("`", max(0, 1 - start))
+            return start + tick + 1 if tick >= 0 else None
+        window = self._recent + piece
+        offset = start - len(self._recent)
+        close = window.find("```", max(0, 3 - offset))
+        return offset + close + 3 if close >= 0 else None
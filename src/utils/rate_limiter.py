@@ -0,0 +1,136 @@
+import asyncio
+import math
+import time
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+from src.config import Config
+from src.logger import logger
+from src.services.metrics import metrics
+
+# rate_limit_args={"lane": STREAM_LANE} marks intermediate streaming edits: they yield to
+# everything else and are dropped (as RetryAfter) rather than queued for long
+STREAM_LANE = "stream"
+STREAM_ARGS = {"lane": STREAM_LANE}
+# Calls that don't post into a chat and don't count towards its message budget
+CHAT_EXEMPT = {"answerCallbackQuery", "sendChatAction", "getMe", "deleteWebhook", "getChat"}
+
+
+class TokenBucket:
+    """Refills `rate` tokens per second up to `capacity`; the balance may go negative for queued requests."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, tokens: float) -> float:
+        """Seconds until the balance reaches `tokens` (after refill)."""
+        return max(0.0, (tokens - self.tokens) / self.rate)
+
+
+def retry_seconds(error: RetryAfter) -> float:
+    retry_after = error.retry_after
+    return retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else float(retry_after)
+
+
+class TelegramRateLimiter(BaseRateLimiter[dict]):
+    """
+    Global and per-chat token buckets in front of every Bot API call.
+    Regular requests reserve a token and wait their turn; stream edits only
+    go out while a bucket keeps some headroom for regular requests, and give
+    up once they'd wait longer than `stream_max_wait`. RetryAfter pauses the
+    chat (or the whole bot) and regular requests are retried after the pause.
+    """
+
+    def __init__(self, global_rate: float = None, chat_rate: float = None, group_rate: float = None,
+                 chat_burst: float = None, stream_max_wait: float = None, max_retries: int = None):
+        self.global_rate = global_rate or Config.TELEGRAM_GLOBAL_RATE
+        self.chat_rate = chat_rate or Config.TELEGRAM_CHAT_RATE
+        self.group_rate = group_rate or Config.TELEGRAM_GROUP_RATE
+        self.chat_burst = chat_burst or Config.TELEGRAM_CHAT_BURST
+        self.stream_max_wait = stream_max_wait if stream_max_wait is not None else Config.TELEGRAM_STREAM_MAX_WAIT
+        self.max_retries = max_retries if max_retries is not None else Config.TELEGRAM_MAX_RETRIES
+        self._global = TokenBucket(self.global_rate, self.global_rate)
+        self._chats: dict = {}
+        self._paused_until: dict = {}  # chat_id (None for the whole bot) -> monotonic time
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        self._chats.clear()
+        self._paused_until.clear()
+
+    def _chat_bucket(self, chat_id) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= 10000:
+                self._prune()
+            # Negative ids are groups and channels, which Telegram limits much harder
+            rate = self.group_rate if isinstance(chat_id, int) and chat_id < 0 else self.chat_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self.chat_burst)
+        return bucket
+
+    def _prune(self):
+        now = time.monotonic()
+        for chat_id, bucket in list(self._chats.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.capacity:
+                del self._chats[chat_id]
+
+    def _pause_wait(self, chat_id, now: float) -> float:
+        return max(self._paused_until.get(None, 0.0), self._paused_until.get(chat_id, 0.0)) - now
+
+    async def _acquire(self, chat_id, stream: bool):
+        buckets = [self._global] + ([self._chat_bucket(chat_id)] if chat_id is not None else [])
+        waited = 0.0
+        while True:
+            now = time.monotonic()
+            for bucket in buckets:
+                bucket.refill(now)
+            pause = self._pause_wait(chat_id, now)
+            if not stream:
+                # Reserve now, so later requests queue behind this one
+                for bucket in buckets:
+                    bucket.tokens -= 1
+                wait = max([pause] + [bucket.wait_for(0) for bucket in buckets])
+                break
+            # Stream edits leave one token per bucket for regular requests and never reserve
+            wait = max([pause] + [bucket.wait_for(2) for bucket in buckets])
+            if wait <= 0:
+                for bucket in buckets:
+                    bucket.tokens -= 1
+                break
+            if waited + wait > self.stream_max_wait:
+                metrics.inc("telegram.stream_dropped")
+                raise RetryAfter(max(1, math.ceil(wait)))
+            waited += wait
+            await asyncio.sleep(wait)
+        if wait > 0:
+            metrics.inc("telegram.delayed")
+            metrics.inc("telegram.delay_ms", int(wait * 1000))
+            await asyncio.sleep(wait)
+        elif waited:
+            metrics.inc("telegram.delayed")
+            metrics.inc("telegram.delay_ms", int(waited * 1000))
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        stream = bool(rate_limit_args) and rate_limit_args.get("lane") == STREAM_LANE
+        chat_id = data.get("chat_id") if endpoint not in CHAT_EXEMPT else None
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id, stream)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                wait = retry_seconds(e)
+                metrics.inc("telegram.retry_after")
+                metrics.inc("telegram.flood_wait_ms", int(wait * 1000))
+                self._paused_until[chat_id] = max(self._paused_until.get(chat_id, 0.0), time.monotonic() + wait)
+                if stream or attempt == self.max_retries:
+                    raise
+                logger.warning(f"Flood control on {endpoint} (chat {chat_id}), retrying in {wait:.0f}s")
@@ -0,0 +1,198 @@
+import asyncio
+import time
+from telegram import Message, constants
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from src.config import Config
+from src.services.metrics import metrics
+from src.utils.markdown import MarkdownCleaner, StreamingMarkdownBuffer, paginate_markdown, split_markdown
+from src.utils.rate_limiter import STREAM_ARGS, retry_seconds
+
+# Telegram shows a chat action for ~5s; refresh it a bit earlier
+TYPING_REFRESH = 4.0
+# Escaped characters per message, below Telegram's 4096 limit
+PAGE_LIMIT = 4000
+STREAMING_SUFFIX = "..."
+FINAL_ATTEMPTS = 3
+
+
+class StreamRenderer:
+    """
+    Renders a streaming reply into Telegram messages from its own task.
+    The consumer only appends chunks; the renderer edits at an adaptive pace
+    (slower while Telegram is slow or rate limiting us), always sends the
+    newest text and skips edits that change nothing. Replies longer than one
+    message roll over into a new message at a Markdown-safe boundary.
+    """
+
+    def __init__(self, message: Message, reply_markup=None, typing: bool = None,
+                 min_interval: float = None, max_interval: float = None, page_limit: int = PAGE_LIMIT):
+        self._message = message
+        self._reply_markup = reply_markup
+        self.typing = Config.STREAM_TYPING_INDICATOR if typing is None else typing
+        self.min_interval = min_interval if min_interval is not None else Config.STREAM_EDIT_MIN_INTERVAL
+        self.max_interval = max_interval if max_interval is not None else Config.STREAM_EDIT_MAX_INTERVAL
+        self.page_limit = page_limit
+        self.interval = self.min_interval
+        self.message_id: int | None = None
+        # The part of the reply shown in the current message
+        self.page = StreamingMarkdownBuffer()
+        # Finished pages (raw text) not yet written to their message
+        self._done_pages: list[str] = []
+        self._sent: str | None = None
+        self._next_edit = 0.0
+        self._changed = asyncio.Event()
+        self._closing = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._typing_task: asyncio.Task | None = None
+
+    @property
+    def bot(self):
+        return self._message.get_bot()
+
+    async def start(self):
+        if self.typing:
+            self._typing_task = asyncio.create_task(self._keep_typing())
+        else:
+            await self._write("⏳ Thinking...", None, self._reply_markup)
+        self._task = asyncio.create_task(self._run())
+
+    def append(self, chunk: str):
+        """Never blocks: the renderer picks up the newest text when it is due."""
+        if not self.page and not self._done_pages:
+            # Show the first tokens right away instead of waiting out the placeholder's interval
+            self._next_edit = 0.0
+        self.page.append(chunk)
+        if self.page.rendered_length_bound > self.page_limit and len(self.page.render(STREAMING_SUFFIX)) > self.page_limit:
+            head, rest = split_markdown(self.page.text, self.page_limit)
+            self._done_pages.append(head)
+            self.page = StreamingMarkdownBuffer()
+            self.page.append(rest)
+            metrics.inc("render.rollovers")
+        self._changed.set()
+
+    async def show_status(self, text: str):
+        """Plain-text status (queue position) shown right away, before any content."""
+        if not self.page and not self._done_pages:
+            await self._write(text, None, self._reply_markup)
+
+    async def close(self):
+        """Stops live rendering; an edit already in flight is allowed to finish."""
+        self._closing.set()
+        self._changed.set()
+        if self._typing_task:
+            self._typing_task.cancel()
+        await asyncio.gather(*filter(None, (self._task, self._typing_task)), return_exceptions=True)
+
+    async def finish(self, suffix: str = ""):
+        """Writes the final text of every remaining page, without the Stop button."""
+        await self.close()
+        pages = self._done_pages + paginate_markdown(self.page.text + suffix, self.page_limit)
+        self._done_pages = []
+        for index, page in enumerate(pages):
+            await self._deliver(page)
+            if index < len(pages) - 1:
+                self._next_message()
+
+    async def _keep_typing(self):
+        while self.message_id is None:
+            try:
+                await self.bot.send_chat_action(self._message.chat_id, constants.ChatAction.TYPING)
+            except NetworkError:
+                pass
+            await asyncio.sleep(TYPING_REFRESH)
+
+    async def _run(self):
+        while not self._closing.is_set():
+            await self._changed.wait()
+            self._changed.clear()
+            delay = self._next_edit - time.monotonic()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._closing.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+            if self._closing.is_set():
+                break
+            # Finish full pages first, so the text keeps its order across messages
+            while self._done_pages:
+                page = self._done_pages[0]
+                if not await self._write(MarkdownCleaner.escape(page), constants.ParseMode.MARKDOWN_V2, None, plain=page):
+                    break
+                self._done_pages.pop(0)
+                self._next_message()
+            else:
+                await self._write(self.page.render(STREAMING_SUFFIX), constants.ParseMode.MARKDOWN_V2, self._reply_markup, live=True)
+
+    def _next_message(self):
+        self.message_id = None
+        self._sent = None
+
+    async def _send(self, text: str, parse_mode, reply_markup, live: bool = False):
+        if text == self._sent:
+            metrics.inc("render.skipped")
+            return
+        if self.message_id is None:
+            sent = await self._message.reply_text(text, parse_mode=parse_mode, reply_markup=reply_markup)
+            self.message_id = sent.message_id
+        else:
+            # Intermediate edits go through the rate limiter's low-priority lane
+            extra = {"rate_limit_args": STREAM_ARGS} if live and getattr(self.bot, "rate_limiter", None) else {}
+            await self.bot.edit_message_text(
+                chat_id=self._message.chat_id,
+                message_id=self.message_id,
+                text=text,
+                parse_mode=parse_mode,
+                reply_markup=reply_markup,
+                **extra
+            )
+        self._sent = text
+        metrics.inc("render.edits")
+
+    async def _write(self, text: str, parse_mode, reply_markup, live: bool = False, plain: str = None) -> bool:
+        """
+        Live edit; failures only delay the next one. Returns whether the text
+        was written. `plain` is the fallback for Markdown Telegram rejects.
+        """
+        started = time.monotonic()
+        wait = self.interval
+        written = False
+        try:
+            await self._send(text, parse_mode, reply_markup, live)
+            written = True
+            # Edit no faster than twice the observed round trip; recover gradually after slow periods
+            latency = time.monotonic() - started
+            self.interval = min(self.max_interval, max(self.min_interval, self.interval * 0.8, latency * 2))
+            wait = self.interval
+        except RetryAfter as e:
+            metrics.inc("render.retry_after")
+            self.interval = self.max_interval
+            wait = retry_seconds(e)
+            # The text wasn't shown; retry it once Telegram allows
+            self._changed.set()
+        except BadRequest:
+            if plain is not None:
+                # A finished page never changes, so retrying its Markdown would fail forever
+                return await self._write(plain, None, reply_markup)
+            # Unparsable intermediate Markdown; the next snapshot usually renders
+            pass
+        except NetworkError:
+            self.interval = wait = min(self.max_interval, self.interval * 2)
+            self._changed.set()
+        self._next_edit = time.monotonic() + wait
+        return written
+
+    async def _deliver(self, page: str):
+        """Final write of a page: waits out rate limits, falls back to plain text if Markdown is rejected."""
+        for attempt in range(FINAL_ATTEMPTS):
+            try:
+                await self._send(MarkdownCleaner.escape(page), constants.ParseMode.MARKDOWN_V2, None)
+                return
+            except RetryAfter as e:
+                if attempt == FINAL_ATTEMPTS - 1:
+                    raise
+                await asyncio.sleep(retry_seconds(e))
+            except BadRequest as e:
+                if "not modified" in str(e).lower():
+                    return
+                await self._send(page, None, None)
+                return
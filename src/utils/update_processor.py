@@ -0,0 +1,58 @@
+import asyncio
+import sys
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Callback data of the Stop button; it must reach the user's running generation
+STOP_PREFIX = "stop_gen_"
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """
+    Processes up to `max_concurrent_updates` updates in parallel, but each
+    user's updates one at a time and in order: a follow-up sent while a reply
+    is still streaming sees that turn, and state like SEARCH_MODE is never
+    read by two updates at once. Stop button presses skip the queue, since
+    they have to run while the user's generation is still going.
+    """
+
+    def __init__(self, max_concurrent_updates: int):
+        # The base class holds its semaphore while an update waits for its
+        # user's turn, so it is left unbounded and the limit applies once the
+        # update runs (it also makes the Application dispatch every update as a task)
+        super().__init__(sys.maxsize)
+        if max_concurrent_updates < 1:
+            raise ValueError("`max_concurrent_updates` must be a positive integer!")
+        self._slots = asyncio.Semaphore(max_concurrent_updates)
+        self._locks: dict[int, asyncio.Lock] = {}
+        self._queued: dict[int, int] = {}
+
+    async def do_process_update(self, update: object, coroutine):
+        if not isinstance(update, Update) or update.effective_user is None:
+            async with self._slots:
+                await coroutine
+            return
+        query = update.callback_query
+        if query is not None and (query.data or "").startswith(STOP_PREFIX):
+            # Nothing to wait for, and no slot a busy bot could withhold
+            await coroutine
+            return
+
+        user_id = update.effective_user.id
+        lock = self._locks.setdefault(user_id, asyncio.Lock())
+        self._queued[user_id] = self._queued.get(user_id, 0) + 1
+        try:
+            # asyncio.Lock wakes waiters in FIFO order, so updates keep their order
+            async with lock, self._slots:
+                await coroutine
+        finally:
+            self._queued[user_id] -= 1
+            if not self._queued[user_id]:
+                del self._queued[user_id]
+                del self._locks[user_id]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
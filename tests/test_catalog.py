@@ -0,0 +1,105 @@
+import asyncio
+import pytest
+from src.services.catalog import ModelCatalog
+from src.services.model_info import ModelInfo
+
+RAW_MODELS = [{"id": "google/gemma:free", "name": "Gemma", "pricing": {"prompt": "0", "completion": "0"}}]
+MODELS = [ModelInfo.from_api(m) for m in RAW_MODELS]
+
+class FakeCatalog(ModelCatalog):
+    def __init__(self, responses, snapshot_path=None):
+        super().__init__(ttl=3600)
+        self.snapshot_path = snapshot_path
+        self.responses = list(responses)
+        self.requests = []
+
+    def save_snapshot(self):
+        if self.snapshot_path:
+            super().save_snapshot()
+
+    async def _request(self, headers):
+        self.requests.append(headers)
+        await asyncio.sleep(0.01)
+        return self.responses.pop(0)
+
+@pytest.mark.asyncio
+async def test_concurrent_cold_reads_share_one_request():
+    catalog = FakeCatalog([(200, {"ETag": "v1"}, {"data": RAW_MODELS})])
+    results = await asyncio.gather(*(catalog.get_models() for _ in range(5)))
+
+    assert len(catalog.requests) == 1
+    assert all(r == MODELS for r in results)
+    assert catalog.version == 1
+
+@pytest.mark.asyncio
+async def test_not_modified_keeps_version():
+    catalog = FakeCatalog([(200, {"ETag": "v1"}, {"data": RAW_MODELS}), (304, {}, None)])
+    await catalog.refresh()
+    await catalog.refresh()
+
+    assert catalog.requests[1] == {"If-None-Match": "v1"}
+    assert catalog.version == 1
+    assert catalog.models == MODELS
+
+@pytest.mark.asyncio
+async def test_stale_read_returns_immediately():
+    catalog = FakeCatalog([(200, {}, {"data": RAW_MODELS}), (500, {}, None)])
+    await catalog.refresh()
+    catalog._checked_at -= 7200
+
+    assert await catalog.get_models() == MODELS
+    await catalog.refresh()
+    assert catalog.models == MODELS
+
+def test_free_index_ranks_tiers_and_rebuilds_per_version():
+    models = [
+        {"id": "nousresearch/hermes:free", "context_length": 131072, "pricing": {"prompt": "0", "completion": "0"}},
+        {"id": "qwen/qwen3:free", "context_length": 32768, "pricing": {"prompt": "0", "completion": "0"}},
+        {"id": "google/gemma:free", "context_length": 8192, "pricing": {"prompt": "0", "completion": "0"}},
+        {"id": "openai/gpt-4o", "context_length": 128000, "pricing": {"prompt": "0.000005", "completion": "0.000015"}},
+    ]
+    catalog = ModelCatalog()
+    catalog._models = [ModelInfo.from_api(m) for m in models]
+    catalog.version = 1
+
+    index = catalog.free_index
+    assert [m.id for m in index.ranked] == ["google/gemma:free", "qwen/qwen3:free", "nousresearch/hermes:free"]
+    assert [m.id for m in index.by_tier[2]] == ["qwen/qwen3:free"]
+    assert set(index.by_provider) == {"google", "qwen", "nousresearch"}
+    assert index.page(1, 2) == index.ranked[2:]
+    assert catalog.free_index is index
+
+    catalog.version = 2
+    assert catalog.free_index is not index
+
+@pytest.mark.asyncio
+async def test_snapshot_roundtrip_serves_without_network(tmp_path):
+    path = str(tmp_path / "models.pickle")
+    catalog = FakeCatalog([(200, {"ETag": "v1"}, {"data": RAW_MODELS})], snapshot_path=path)
+    await catalog.refresh()
+
+    restored = FakeCatalog([(304, {}, None)], snapshot_path=path)
+    assert restored.load_snapshot()
+    assert await restored.get_models() == MODELS
+    assert restored.free_index.ranked == tuple(MODELS)
+    assert restored.search_index.search("gemma")[1] == 1
+
+    await restored.refresh()
+    assert restored.requests == [{"If-None-Match": "v1"}]
+
+def test_missing_snapshot_is_ignored(tmp_path):
+    catalog = ModelCatalog(snapshot_path=str(tmp_path / "missing.pickle"))
+    assert not catalog.load_snapshot()
+    assert catalog.models == []
+
+def test_model_info_parses_api_entry():
+    model = ModelInfo.from_api({
+        "id": "qwen/qwen3:free", "name": "Qwen3", "context_length": "32768",
+        "pricing": {"prompt": "0", "completion": "0", "image": "0"},
+        "architecture": {"modality": "text->text"}, "description": "x" * 5000,
+    })
+    assert model.provider == "qwen"
+    assert model.context_length == 32768
+    assert model.is_free
+    assert len(model.description) == 300
+    assert ModelInfo.from_api({"id": "a/b", "pricing": {"prompt": "n/a"}}).prompt_price == -1.0
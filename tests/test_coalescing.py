@@ -0,0 +1,70 @@
+import asyncio
+import pytest
+from src.services import openrouter
+from src.services.coalescing import InflightRequests
+from src.services.metrics import Metrics
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+class Service(openrouter.OpenRouterService):
+    upstream_calls = 0
+    fail = False
+
+    async def _stream_upstream(self, model, messages, fallbacks=None):
+        Service.upstream_calls += 1
+        self.last_model = model
+        await asyncio.sleep(0.02)
+        if Service.fail:
+            Service.fail = False
+            raise RuntimeError("upstream down")
+        for chunk in ["a", "b", "c"]:
+            yield chunk
+            await asyncio.sleep(0.01)
+
+@pytest.fixture(autouse=True)
+def isolated(monkeypatch):
+    monkeypatch.setattr(openrouter, "inflight_requests", InflightRequests())
+    monkeypatch.setattr(openrouter, "metrics", Metrics())
+    Service.upstream_calls = 0
+    Service.fail = False
+
+async def collect(service):
+    return "".join([c async for c in service.stream_chat("m", MESSAGES)])
+
+@pytest.mark.asyncio
+async def test_identical_requests_share_one_upstream():
+    services = [Service(api_key="sk-shared") for _ in range(3)]
+    results = await asyncio.gather(*(collect(s) for s in services))
+
+    assert results == ["abc"] * 3
+    assert Service.upstream_calls == 1
+    assert all(s.last_model == "m" for s in services)
+    assert openrouter.metrics.get("coalesce.saved") == 2
+
+@pytest.mark.asyncio
+async def test_different_keys_are_not_coalesced():
+    await asyncio.gather(collect(Service(api_key="sk-a")), collect(Service(api_key="sk-b")))
+    assert Service.upstream_calls == 2
+
+@pytest.mark.asyncio
+async def test_followers_retry_when_leader_fails_early():
+    Service.fail = True
+    leader, follower = Service(api_key="sk-shared"), Service(api_key="sk-shared")
+    results = await asyncio.gather(collect(leader), collect(follower), return_exceptions=True)
+
+    assert isinstance(results[0], RuntimeError)
+    assert results[1] == "abc"
+    assert Service.upstream_calls == 2
+
+@pytest.mark.asyncio
+async def test_upstream_cancelled_when_last_consumer_leaves():
+    registry = openrouter.inflight_requests
+    service = Service(api_key="sk-shared")
+    stream = service.stream_chat("m", MESSAGES)
+    assert await stream.__anext__() == "a"
+    shared = next(iter(registry._streams.values()))
+    await stream.aclose()
+    await asyncio.sleep(0)
+
+    assert shared._task.cancelled() or shared._task.done()
+    assert not registry._streams
@@ -0,0 +1,49 @@
+from src.config import Config
+from src.services.context_builder import (
+    HEURISTIC, MESSAGE_OVERHEAD, build_context, estimate_tokens, message_tokens, prompt_budget
+)
+
+def make_history(turns: int, size: int) -> list[dict]:
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"{i:04d}" + "x" * (size - 4)}
+        for i in range(turns)
+    ]
+
+def test_estimate_counts_non_ascii_denser():
+    assert estimate_tokens("a" * 400) == 100
+    assert estimate_tokens("я" * 400) == 200
+    assert estimate_tokens("") == 0
+
+def test_message_tokens_cached_on_message():
+    message = {"role": "user", "content": "a" * 40}
+    assert message_tokens(message, HEURISTIC) == 10 + MESSAGE_OVERHEAD
+    message["content"] = "changed"
+    assert message_tokens(message, HEURISTIC) == 10 + MESSAGE_OVERHEAD
+    assert message["tk"] == HEURISTIC
+
+def test_budget_reserves_completion(monkeypatch):
+    monkeypatch.setattr(Config, "CONTEXT_COMPLETION_RESERVE", 2048)
+    monkeypatch.setattr(Config, "CONTEXT_MAX_PROMPT_TOKENS", 100_000)
+    assert prompt_budget(32768) == 32768 - 2048
+    assert prompt_budget(4096) == 3072
+    assert prompt_budget(1_000_000) == 100_000
+    assert prompt_budget(None) == prompt_budget(Config.CONTEXT_DEFAULT_LENGTH)
+
+def test_larger_window_keeps_more_history(monkeypatch):
+    monkeypatch.setattr(Config, "CONTEXT_COMPLETION_RESERVE", 0)
+    history = make_history(100, 400)
+
+    small = build_context("sys", history, "some/model", 2000)
+    large = build_context("sys", history, "some/model", 20000)
+
+    assert small[0] == {"role": "system", "content": "sys"}
+    assert 1 < len(small) < len(large) <= len(history) + 1
+    # Newest turns are kept, in order, without the cached token fields
+    assert small[-1] == {"role": "assistant", "content": history[-1]["content"]}
+    assert [m["content"] for m in small[1:]] == [m["content"] for m in history[-(len(small) - 1):]]
+    assert sum(message_tokens(m, HEURISTIC) for m in history[-(len(small) - 1):]) <= 2000
+
+def test_latest_message_always_included():
+    history = [{"role": "user", "content": "x" * 100_000}]
+    messages = build_context("sys", history, "some/model", 4096)
+    assert messages[-1]["content"] == history[0]["content"]
@@ -0,0 +1,120 @@
+import json
+import pytest
+import pytest_asyncio
+from sqlalchemy import func, select, update
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from src.config import Config
+from src.database.core import Base, UnitOfWork
+from src.database.models import ConversationMessage, User
+from src.services.conversation import append_messages, compact_conversation, load_recent_messages
+from src.services.user_service import clear_user_context, get_or_create_user, user_cache
+
+@pytest_asyncio.fixture
+async def sessions():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", echo=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    user_cache.clear()
+    yield async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    await engine.dispose()
+
+@pytest_asyncio.fixture
+async def uow(sessions):
+    uow = UnitOfWork(sessions)
+    await get_or_create_user(uow, telegram_id=1, username="u", full_name="U")
+    await uow.commit()
+    return uow
+
+async def scalar(uow, statement):
+    async with uow.read() as session:
+        return await session.scalar(statement)
+
+def turn(i: int) -> list[dict]:
+    return [{"role": "user", "content": f"q{i}", "tokens": 5, "tk": "heuristic"}, {"role": "assistant", "content": f"a{i}"}]
+
+@pytest.mark.asyncio
+async def test_append_and_windowed_reads(uow):
+    for i in range(5):
+        append_messages(uow, 1, turn(i))
+    await uow.commit()
+
+    recent = await load_recent_messages(uow, 1, 3)
+    assert [m["content"] for m in recent] == ["a3", "q4", "a4"]
+    assert [m["seq"] for m in recent] == [7, 8, 9]
+    assert recent[1]["tokens"] == 5 and "tokens" not in recent[0]
+
+@pytest.mark.asyncio
+async def test_legacy_blob_is_imported_once(uow):
+    blob = json.dumps([{"role": "user", "content": "old"}, {"role": "assistant", "content": "reply"}])
+    uow.add(update(User).where(User.id == 1).values(context_history=blob))
+    await uow.commit()
+
+    history = await load_recent_messages(uow, 1, 10)
+    assert [m["content"] for m in history] == ["old", "reply"]
+    # The import and the next turn are written together
+    append_messages(uow, 1, turn(0))
+    await uow.commit()
+    assert await scalar(uow, select(User.context_history).where(User.id == 1)) == "[]"
+    assert [m["seq"] for m in await load_recent_messages(uow, 1, 10)] == [0, 1, 2, 3]
+
+@pytest.mark.asyncio
+async def test_compact_checks_prefix_and_clear(uow):
+    for i in range(3):
+        append_messages(uow, 1, turn(i))
+    await uow.commit()
+    history = await load_recent_messages(uow, 1, 10)
+
+    stale = [dict(history[0], content="changed")]
+    assert not await compact_conversation(uow, 1, stale, "summary")
+    assert await compact_conversation(uow, 1, history[:4], "summary")
+    await uow.commit()
+
+    assert [m["content"] for m in await load_recent_messages(uow, 1, 10)] == ["q2", "a2"]
+    assert await scalar(uow, select(User.context_summary).where(User.id == 1)) == "summary"
+
+    await clear_user_context(uow, 1)
+    await uow.commit()
+    assert await scalar(uow, select(func.count()).select_from(ConversationMessage)) == 0
+    assert await scalar(uow, select(User.context_summary).where(User.id == 1)) is None
+
+@pytest.mark.asyncio
+async def test_overlapping_turns_get_distinct_seqs(sessions, uow):
+    # Two messages from the same user in flight at once: both read the same history
+    second = UnitOfWork(sessions)
+    await load_recent_messages(uow, 1, 10)
+    await load_recent_messages(second, 1, 10)
+    append_messages(uow, 1, turn(0))
+    append_messages(second, 1, turn(1))
+    await uow.commit()
+    await second.commit()
+
+    history = await load_recent_messages(uow, 1, 10)
+    assert [(m["seq"], m["content"]) for m in history] == [(0, "q0"), (1, "a0"), (2, "q1"), (3, "a1")]
+
+@pytest.mark.asyncio
+async def test_old_turns_beyond_the_read_window_are_deleted(uow, monkeypatch):
+    monkeypatch.setattr(Config, "CONTEXT_HISTORY_MAX_MESSAGES", 4)
+    for i in range(4):
+        append_messages(uow, 1, turn(i))
+        await uow.commit()
+
+    assert await scalar(uow, select(func.count()).select_from(ConversationMessage)) == 4
+    assert [m["content"] for m in await load_recent_messages(uow, 1, 10)] == ["q2", "a2", "q3", "a3"]
+
+@pytest.mark.asyncio
+async def test_overlapping_legacy_imports(sessions, uow):
+    blob = json.dumps([{"role": "user", "content": "old"}, {"role": "assistant", "content": "reply"}])
+    uow.add(update(User).where(User.id == 1).values(context_history=blob))
+    await uow.commit()
+
+    # Both updates find the blob not yet imported
+    second = UnitOfWork(sessions)
+    await load_recent_messages(uow, 1, 10)
+    await load_recent_messages(second, 1, 10)
+    append_messages(uow, 1, turn(0))
+    append_messages(second, 1, turn(1))
+    await uow.commit()
+    await second.commit()
+
+    history = await load_recent_messages(uow, 1, 10)
+    assert [m["content"] for m in history] == ["old", "reply", "q0", "a0", "q1", "a1"]
@@ -1,36 +1,162 @@
+import asyncio
+import time
 import pytest
+import pytest_asyncio
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
-from src.database.core import Base
+from src.database.core import Base, UnitOfWork
 from src.database.models import User
-from src.services.user_service import get_or_create_user, update_user_model
+from src.services.conversation import append_messages, load_recent_messages
+from src.services.user_service import get_or_create_user, get_user, update_user_model, set_user_banned, set_user_state, increment_usage, user_cache, UserCache, UserProfile
+from src.services.metrics import metrics
 
 # Use in-memory SQLite for tests
 TEST_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
 
-@pytest.fixture
-async def db_session():
+@pytest_asyncio.fixture
+async def engine():
     engine = create_async_engine(TEST_DATABASE_URL, echo=False)
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
-    
-    SessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
-    async with SessionLocal() as session:
-        yield session
-    
+    yield engine
     await engine.dispose()
 
+@pytest.fixture
+def sessions(engine):
+    user_cache.clear()
+    return async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+
+@pytest.fixture
+def uow(sessions):
+    return UnitOfWork(sessions)
+
 @pytest.mark.asyncio
-async def test_create_user(db_session):
-    user = await get_or_create_user(db_session, telegram_id=12345, username="testuser", full_name="Test User")
+async def test_create_user(uow):
+    user = await get_or_create_user(uow, telegram_id=12345, username="testuser", full_name="Test User")
     assert user.id == 12345
     assert user.username == "testuser"
     assert user.usage_count == 0
+    # Created right away, not with the rest of the update
+    async with uow.read() as session:
+        assert await session.get(User, 12345) is not None
 
 @pytest.mark.asyncio
-async def test_update_model(db_session):
-    await get_or_create_user(db_session, telegram_id=12345, username="testuser", full_name="Test User")
-    await update_user_model(db_session, 12345, "gpt-4")
+async def test_update_model(uow):
+    await get_or_create_user(uow, telegram_id=12345, username="testuser", full_name="Test User")
+    await update_user_model(uow, 12345, "gpt-4")
+    await uow.commit()
     
     # Re-fetch
-    user = await db_session.get(User, 12345)
+    async with uow.read() as session:
+        user = await session.get(User, 12345)
     assert user.current_model == "gpt-4"
+
+@pytest.mark.asyncio
+async def test_profile_cache_write_through(engine, uow):
+    await get_or_create_user(uow, telegram_id=12345, username="testuser", full_name="Test User")
+    await uow.commit()
+    await update_user_model(uow, 12345, "gpt-4")
+    await set_user_state(uow, 12345, "SEARCH_MODE")
+    await set_user_banned(uow, 12345, True)
+    increment_usage(12345)
+    # Queued writes reach the cache only once committed
+    assert (await get_user(uow, 12345)).current_model != "gpt-4"
+    await uow.commit()
+
+    # Served from the cache: no query reaches the database
+    queries = []
+    event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: queries.append(args[2]))
+    hits = metrics.get("user_cache.hits")
+    user = await get_user(uow, 12345)
+    same = await get_or_create_user(uow, telegram_id=12345, username="testuser", full_name="Test User")
+    assert queries == []
+    assert metrics.get("user_cache.hits") == hits + 2
+    assert (user.current_model, user.state, user.is_banned, user.usage_count) == ("gpt-4", "SEARCH_MODE", True, 1)
+    assert same == user
+
+    # Local changes to a returned profile don't leak into the cache
+    user.state = None
+    assert (await get_user(uow, 12345)).state == "SEARCH_MODE"
+
+    # A renamed user is re-read and updated
+    renamed = await get_or_create_user(uow, telegram_id=12345, username="renamed", full_name="Test User")
+    assert renamed.username == "renamed" and renamed.current_model == "gpt-4"
+    assert len(queries) > 0
+
+@pytest.mark.asyncio
+async def test_single_commit_per_update(engine, uow):
+    commits = []
+    event.listen(engine.sync_engine, "commit", lambda conn: commits.append(conn))
+
+    # Reads only: nothing to commit
+    await get_user(uow, 12345)
+    assert not await uow.commit()
+    assert commits == []
+
+    # A new user is committed on its own; a second message racing the first finds the row
+    first, second = await asyncio.gather(*(
+        get_or_create_user(uow, telegram_id=12345, username="testuser", full_name="Test User") for _ in range(2)
+    ))
+    assert first == second and len(commits) == 1
+    commits.clear()
+
+    # Two updates and a hook: one commit, the hook runs after it
+    seen = []
+    await update_user_model(uow, 12345, "gpt-4")
+    await set_user_state(uow, 12345, "SEARCH_MODE")
+    uow.after_commit(lambda: seen.append(len(commits)))
+    assert commits == [] and seen == []
+    assert await uow.commit()
+    assert len(commits) == 1 and seen == [1]
+
+    async with uow.read() as session:
+        user = await session.get(User, 12345)
+    assert (user.current_model, user.state) == ("gpt-4", "SEARCH_MODE")
+
+@pytest.mark.asyncio
+async def test_no_connection_held_between_reads(engine, uow):
+    checked_out = []
+    event.listen(engine.sync_engine, "checkout", lambda *args: checked_out.append(1))
+    event.listen(engine.sync_engine, "checkin", lambda *args: checked_out.pop())
+
+    # What the chat handler does before it awaits the model
+    await get_or_create_user(uow, telegram_id=1, username="u", full_name="U")
+    history = await load_recent_messages(uow, 1, 10)
+    assert checked_out == []
+
+    append_messages(uow, 1, [{"role": "user", "content": "hi"}])
+    await uow.commit()
+    assert checked_out == []
+    assert [m["content"] for m in await load_recent_messages(uow, 1, 10)] == ["hi"]
+
+
+def test_profile_cache_bounds(monkeypatch):
+    cache = UserCache(max_entries=2, ttl=60)
+    make = lambda i: UserProfile(i, None, "U", None, False, "m", "assistant", 0, False, True, None, None, None)
+    for i in range(3):
+        cache.put(make(i))
+    assert len(cache) == 2 and cache.get(0) is None and cache.get(2) is not None
+
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 61)
+    assert cache.get(2) is None
+
+@pytest.mark.asyncio
+async def test_writes_survive_non_database_errors(sessions, uow):
+    await get_or_create_user(uow, telegram_id=12345, username="testuser", full_name="Test User")
+
+    # A Telegram call failing after the change (e.g. a second answer to a button press)
+    with pytest.raises(RuntimeError):
+        async with UnitOfWork(sessions) as update:
+            await update_user_model(update, 12345, "gpt-4")
+            raise RuntimeError("Query is too old")
+    # A database error discards the update's writes
+    with pytest.raises(IntegrityError):
+        async with UnitOfWork(sessions) as update:
+            await set_user_state(update, 12345, "SEARCH_MODE")
+            raise IntegrityError("INSERT", {}, Exception())
+
+    async with uow.read() as session:
+        user = await session.get(User, 12345)
+    assert (user.current_model, user.state) == ("gpt-4", None)
@@ -0,0 +1,42 @@
+import asyncio
+import pytest
+from src.services.generations import Generations
+
+@pytest.mark.asyncio
+async def test_stop_cancels_and_reports_stopped():
+    generations = Generations()
+    closed = asyncio.Event()
+    started = asyncio.Event()
+
+    async def generate():
+        try:
+            started.set()
+            await asyncio.sleep(10)
+        finally:
+            closed.set()
+
+    run = asyncio.create_task(generations.run(1, 100, generate()))
+    await started.wait()
+    assert len(generations) == 1
+    assert not generations.stop(2, 100)  # other users can't stop it
+    assert generations.stop(1, 100)
+
+    assert await run is False
+    assert closed.is_set()
+    assert len(generations) == 0
+    assert not generations.stop(1, 100)
+
+@pytest.mark.asyncio
+async def test_completed_and_failed_generations():
+    generations = Generations()
+
+    async def ok():
+        return "done"
+
+    async def fail():
+        raise ValueError("boom")
+
+    assert await generations.run(1, 1, ok()) is True
+    with pytest.raises(ValueError):
+        await generations.run(1, 2, fail())
+    assert len(generations) == 0
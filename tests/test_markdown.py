@@ -0,0 +1,63 @@
+import random
+from src.utils.markdown import MarkdownCleaner, StreamingMarkdownBuffer, open_fence, paginate_markdown, split_markdown
+
+SAMPLES = [
+    "Plain text. With (special) chars! #1 + 2 = 3",
+    "Use `pip install x` then run it.",
+    "```python\nprint('a.b')\n```\nDone.",
+    "Unclosed `inline and more.text",
+    "Unclosed fence ```code here...",
+    "Double `` then text",
+    "Four ```` ticks ```` here.",
+    "`a`b`c` ``` x ` y ``` z`",
+]
+
+def stream(text: str, sizes) -> StreamingMarkdownBuffer:
+    buffer = StreamingMarkdownBuffer()
+    i = 0
+    while i < len(text):
+        size = next(sizes)
+        buffer.append(text[i:i + size])
+        i += size
+        assert buffer.render() == MarkdownCleaner.escape(text[:i])
+        assert buffer.render("...") == MarkdownCleaner.escape(text[:i] + "...")
+    return buffer
+
+def test_matches_escape_for_samples_at_every_chunking():
+    for text in SAMPLES:
+        for size in (1, 2, 3, 5, len(text)):
+            buffer = stream(text, iter(lambda: size, None))
+            assert buffer.text == text
+            assert len(buffer) == len(text)
+
+def test_matches_escape_on_random_streams():
+    rng = random.Random(7)
+    alphabet = "ab `\n._*()"
+    for _ in range(300):
+        text = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 60)))
+        stream(text, iter(lambda: rng.randint(1, 6), None))
+
+def test_empty_buffer():
+    buffer = StreamingMarkdownBuffer()
+    buffer.append("")
+    assert buffer.render() == ""
+    assert buffer.render("...") == MarkdownCleaner.escape("...")
+    assert buffer.text == ""
+
+def test_split_prefers_paragraphs_and_reopens_fences():
+    text = "Intro paragraph. " * 5 + "\n\n" + "Second paragraph with more words. " * 5
+    head, rest = split_markdown(text, 150)
+    assert head == "Intro paragraph. " * 5
+    assert head + "\n\n" + rest == text
+
+    code = "Look:\n\n```python\n" + "\n".join(f"print({i})" for i in range(50)) + "\n```\nDone."
+    pages = paginate_markdown(code, 200)
+    assert len(pages) > 2
+    assert all(len(MarkdownCleaner.escape(page)) <= 200 for page in pages)
+    assert all(page.count("```") % 2 == 0 for page in pages)
+    assert all(page.startswith("```python\n") for page in pages[1:])
+
+def test_open_fence():
+    assert open_fence("text ```js\ncode") == "```js"
+    assert open_fence("```js\ncode``` and `inline`") is None
+    assert open_fence("lone ` tick") is None
@@ -0,0 +1,48 @@
+from src.services.model_info import ModelInfo
+from src.services.model_search import ModelSearchIndex
+
+RAW_MODELS = [
+    {"id": "google/gemini-2.0-flash:free", "name": "Google: Gemini 2.0 Flash", "context_length": 1048576,
+     "pricing": {"prompt": "0", "completion": "0"}, "description": "Fast multimodal model"},
+    {"id": "google/gemma-3-27b-it", "name": "Google: Gemma 3 27B", "context_length": 8192,
+     "pricing": {"prompt": "0.0000001", "completion": "0.0000002"}},
+    {"id": "openai/gpt-4o", "name": "OpenAI: GPT-4o", "context_length": 128000,
+     "pricing": {"prompt": "0.000005", "completion": "0.000015"}},
+    {"id": "meta-llama/llama-3.3-70b-instruct:free", "name": "Meta: Llama 3.3 70B Instruct", "context_length": 131072,
+     "pricing": {"prompt": "0", "completion": "0"}, "description": "Multilingual instruct model by Meta"},
+]
+MODELS = [ModelInfo.from_api(m) for m in RAW_MODELS]
+
+def ids(results):
+    return [m.id for m in results]
+
+def test_prefix_and_exact_matches():
+    index = ModelSearchIndex(MODELS)
+    results, total = index.search("gem")
+    assert total == 2
+    assert ids(results)[0] == "google/gemini-2.0-flash:free"
+    assert ids(index.search("gpt-4")[0]) == ["openai/gpt-4o"]
+
+def test_typo_tolerance():
+    index = ModelSearchIndex(MODELS)
+    assert ids(index.search("gemnii")[0])[0] == "google/gemini-2.0-flash:free"
+    assert "meta-llama/llama-3.3-70b-instruct:free" in ids(index.search("lamma")[0])
+
+def test_description_and_provider_fields_are_searchable():
+    index = ModelSearchIndex(MODELS)
+    assert ids(index.search("multilingual")[0]) == ["meta-llama/llama-3.3-70b-instruct:free"]
+    assert set(ids(index.search("google")[0])) == {"google/gemini-2.0-flash:free", "google/gemma-3-27b-it"}
+
+def test_paging_and_query_cache():
+    index = ModelSearchIndex(MODELS, cache_size=1)
+    first, total = index.search("google", 0, 1)
+    second, _ = index.search("google", 1, 1)
+    assert total == 2 and len(first) == len(second) == 1
+    assert first != second
+    index.search("meta")
+    assert list(index._cache) == ["meta"]
+
+def test_no_match():
+    index = ModelSearchIndex(MODELS)
+    assert index.search("zzzz") == ([], 0)
+    assert index.search("   ") == ([], 0)
@@ -0,0 +1,189 @@
+import asyncio
+import httpx
+import pytest
+from openai import RateLimitError
+from src.config import Config
+from src.services.catalog import ModelCatalog
+from src.services.metrics import Metrics
+from src.services.model_info import ModelInfo
+from src.services.openrouter import OpenRouterClientPool, OpenRouterService, CircuitBreaker, CircuitBreakers
+
+@pytest.mark.asyncio
+async def test_pool_reuses_client_per_key():
+    pool = OpenRouterClientPool(max_keys=4, idle_timeout=60)
+    assert pool.get("sk-a") is pool.get("sk-a")
+    assert pool.get("sk-a") is not pool.get("sk-b")
+    await pool.close()
+
+@pytest.mark.asyncio
+async def test_pool_evicts_lru_but_keeps_shared_key(monkeypatch):
+    monkeypatch.setattr(Config, "OPENROUTER_API_KEY", "sk-shared")
+    pool = OpenRouterClientPool(max_keys=2, idle_timeout=60)
+    shared = pool.get("sk-shared")
+    pool.get("sk-a")
+    pool.get("sk-b")
+
+    assert "sk-a" not in pool._clients
+    assert pool.get("sk-shared") is shared
+    await pool.close()
+
+@pytest.mark.asyncio
+async def test_pool_closes_idle_custom_keys(monkeypatch):
+    monkeypatch.setattr(Config, "OPENROUTER_API_KEY", "sk-shared")
+    pool = OpenRouterClientPool(max_keys=4, idle_timeout=60)
+    pool.get("sk-shared")
+    pool.get("sk-a")
+    for key in pool._last_used:
+        pool._last_used[key] -= 120
+
+    assert pool.close_idle() == 1
+    assert list(pool._clients) == ["sk-shared"]
+    await pool.close()
+
+@pytest.mark.asyncio
+async def test_pool_keeps_evicted_client_open_until_its_streams_finish():
+    pool = OpenRouterClientPool(max_keys=1, idle_timeout=60)
+    busy = pool.get("sk-a")
+    pool.acquire(busy)
+    pool.get("sk-b")
+    await asyncio.sleep(0)
+    assert "sk-a" not in pool._clients and not busy.is_closed()
+
+    pool.release(busy)
+    await asyncio.sleep(0)
+    assert busy.is_closed()
+    await pool.close()
+
+def rate_limit_error():
+    request = httpx.Request("POST", "https://openrouter.ai/api/v1/chat/completions")
+    return RateLimitError("Rate limit exceeded", response=httpx.Response(429, request=request), body=None)
+
+class FakeService(OpenRouterService):
+    def __init__(self, replies):
+        super().__init__(api_key="sk-test")
+        self.replies = replies
+        self.calls = []
+
+    async def _stream_content(self, model, messages):
+        self.calls.append(model)
+        reply = self.replies[model]
+        if isinstance(reply, Exception):
+            raise reply
+        for chunk in reply:
+            yield chunk
+
+def test_breaker_opens_and_half_opens():
+    breaker = CircuitBreaker(threshold=2, cooldown=30)
+    breaker.record_failure()
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and not breaker.allow()
+
+    breaker.opened_at -= 31
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert breaker.allow()
+    assert not breaker.allow()  # only one probe at a time
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+@pytest.mark.asyncio
+async def test_stream_chat_fails_over_and_skips_open_circuits(monkeypatch):
+    monkeypatch.setattr("src.services.openrouter.circuit_breakers", CircuitBreakers())
+    service = FakeService({"a:free": rate_limit_error(), "b:free": ["Hel", "lo"]})
+
+    chunks = [c async for c in service.stream_chat("a:free", [], ["b:free"])]
+    assert "".join(chunks) == "Hello"
+    assert service.last_model == "b:free"
+
+    for _ in range(Config.BREAKER_FAILURE_THRESHOLD):
+        [c async for c in service.stream_chat("a:free", [], ["b:free"])]
+    service.calls.clear()
+    [c async for c in service.stream_chat("a:free", [], ["b:free"])]
+    assert service.calls == ["b:free"]
+
+@pytest.mark.asyncio
+async def test_stream_chat_raises_non_retryable_errors(monkeypatch):
+    monkeypatch.setattr("src.services.openrouter.circuit_breakers", CircuitBreakers())
+    service = FakeService({"a:free": ValueError("bad request"), "b:free": ["ok"]})
+    with pytest.raises(ValueError):
+        [c async for c in service.stream_chat("a:free", [], ["b:free"])]
+    assert service.calls == ["a:free"]
+
+@pytest.mark.asyncio
+async def test_breakers_are_per_key_and_ignore_non_retryable_errors(monkeypatch):
+    breakers = CircuitBreakers()
+    monkeypatch.setattr("src.services.openrouter.circuit_breakers", breakers)
+    service = FakeService({"a:free": rate_limit_error(), "b:free": ["ok"]})
+    for _ in range(Config.BREAKER_FAILURE_THRESHOLD):
+        [c async for c in service.stream_chat("a:free", [], ["b:free"])]
+    assert breakers.get("sk-test", "a:free").state == CircuitBreaker.OPEN
+    # Another key's quota is not this key's problem
+    assert breakers.get("sk-other", "a:free").state == CircuitBreaker.CLOSED
+
+    # A half-open probe that hits a client error neither closes the breaker nor keeps the slot
+    breaker = breakers.get("sk-test", "a:free")
+    breaker.opened_at -= Config.BREAKER_COOLDOWN
+    service.replies["a:free"] = ValueError("bad request")
+    with pytest.raises(ValueError):
+        [c async for c in service.stream_chat("a:free", [], ["b:free"])]
+    assert breaker.state == CircuitBreaker.HALF_OPEN and breaker.allow()
+
+def test_failover_chain_uses_loaded_catalog_only(monkeypatch):
+    catalog = ModelCatalog()
+    monkeypatch.setattr("src.services.openrouter.model_catalog", catalog)
+    monkeypatch.setattr("src.services.openrouter.circuit_breakers", CircuitBreakers())
+    service = FakeService({})
+    # Nothing loaded yet: no fallbacks, and no fetch to wait for
+    assert service.failover_chain("google/gemma:free") == []
+
+    free = {"prompt": "0", "completion": "0"}
+    catalog._models = [
+        ModelInfo.from_api({"id": "google/gemma:free", "pricing": free}),
+        ModelInfo.from_api({"id": "qwen/qwen3:free", "pricing": free}),
+        ModelInfo.from_api({"id": "openai/gpt-4o", "pricing": {"prompt": "0.000005", "completion": "0.000015"}}),
+    ]
+    catalog.version = 1
+    assert service.failover_chain("google/gemma:free") == ["qwen/qwen3:free"]
+    assert service.failover_chain("openai/gpt-4o") == []
+
+class SlowService(FakeService):
+    def __init__(self, replies, delays):
+        super().__init__(replies)
+        self.delays = delays
+        self.closed = []
+
+    async def _stream_content(self, model, messages):
+        self.calls.append(model)
+        try:
+            await asyncio.sleep(self.delays[model])
+            for chunk in self.replies[model]:
+                yield chunk
+        finally:
+            self.closed.append(model)
+
+@pytest.mark.asyncio
+async def test_hedge_races_alternate_and_cancels_loser(monkeypatch):
+    monkeypatch.setattr("src.services.openrouter.circuit_breakers", CircuitBreakers())
+    monkeypatch.setattr("src.services.openrouter.metrics", Metrics())
+    monkeypatch.setattr(Config, "HEDGE_MODE", "delay")
+    monkeypatch.setattr(Config, "HEDGE_DELAY", 0.05)
+    service = SlowService({"slow:free": ["late"], "fast:free": ["quick"]}, {"slow:free": 5, "fast:free": 0.01})
+
+    chunks = [c async for c in service.stream_chat("slow:free", [], ["fast:free"])]
+    assert chunks == ["quick"]
+    assert service.last_model == "fast:free"
+    assert "slow:free" in service.closed
+
+    from src.services import openrouter
+    assert openrouter.metrics.get("hedge.started") == 1
+    assert openrouter.metrics.get("hedge.won_alternate") == 1
+
+@pytest.mark.asyncio
+async def test_hedge_off_waits_for_primary(monkeypatch):
+    monkeypatch.setattr("src.services.openrouter.circuit_breakers", CircuitBreakers())
+    monkeypatch.setattr(Config, "HEDGE_MODE", "off")
+    service = SlowService({"slow:free": ["late"], "fast:free": ["quick"]}, {"slow:free": 0.1, "fast:free": 0})
+
+    chunks = [c async for c in service.stream_chat("slow:free", [], ["fast:free"])]
+    assert chunks == ["late"]
+    assert service.calls == ["slow:free"]
@@ -0,0 +1,73 @@
+import asyncio
+import pytest
+from telegram.error import RetryAfter
+from src.services.metrics import Metrics
+from src.utils.rate_limiter import STREAM_ARGS, TelegramRateLimiter
+
+@pytest.fixture
+def limiter_metrics(monkeypatch):
+    counters = Metrics()
+    monkeypatch.setattr("src.utils.rate_limiter.metrics", counters)
+    return counters
+
+def make_limiter(**kwargs):
+    options = {"global_rate": 100, "chat_rate": 20, "group_rate": 5, "chat_burst": 2, "stream_max_wait": 0.05, "max_retries": 1}
+    options.update(kwargs)
+    return TelegramRateLimiter(**options)
+
+async def send(limiter, calls, name, chat_id=1, rate_limit_args=None, endpoint="sendMessage"):
+    async def callback():
+        calls.append(name)
+        return True
+    return await limiter.process_request(callback, (), {}, endpoint, {"chat_id": chat_id}, rate_limit_args)
+
+@pytest.mark.asyncio
+async def test_per_chat_burst_then_throttle():
+    limiter = make_limiter()
+    calls = []
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    await asyncio.gather(*(send(limiter, calls, i) for i in range(4)))
+    # Two go out in the burst, the other two wait 1/20s each
+    assert calls == [0, 1, 2, 3]
+    assert loop.time() - started >= 0.09
+    # Other chats have their own budget
+    started = loop.time()
+    await send(limiter, calls, "other", chat_id=2)
+    assert loop.time() - started < 0.02
+
+@pytest.mark.asyncio
+async def test_stream_edits_yield_and_drop(limiter_metrics):
+    limiter = make_limiter(chat_rate=5)
+    calls = []
+    await send(limiter, calls, "answer")
+    # Only one token left: stream edits keep it for regular requests
+    with pytest.raises(RetryAfter):
+        await send(limiter, calls, "edit", rate_limit_args=STREAM_ARGS)
+    await send(limiter, calls, "menu")
+    assert calls == ["answer", "menu"]
+    assert limiter_metrics.get("telegram.stream_dropped") == 1
+
+@pytest.mark.asyncio
+async def test_retry_after_pauses_chat_and_retries(limiter_metrics):
+    limiter = make_limiter()
+    attempts = []
+
+    async def flaky():
+        attempts.append(asyncio.get_running_loop().time())
+        if len(attempts) == 1:
+            raise RetryAfter(1)
+        return "ok"
+
+    result = await limiter.process_request(flaky, (), {}, "sendMessage", {"chat_id": 5}, None)
+    assert result == "ok"
+    assert attempts[1] - attempts[0] >= 0.95
+    assert limiter_metrics.get("telegram.retry_after") == 1
+    assert limiter_metrics.get("telegram.flood_wait_ms") == 1000
+
+    async def always_limited():
+        raise RetryAfter(1)
+
+    # Stream edits are not retried: the renderer sends newer text later instead
+    with pytest.raises(RetryAfter):
+        await limiter.process_request(always_limited, (), {}, "editMessageText", {"chat_id": 6}, STREAM_ARGS)
@@ -0,0 +1,66 @@
+import pytest
+from src.services import openrouter
+from src.services.metrics import Metrics
+from src.services.response_cache import ResponseCache
+
+MESSAGES = [{"role": "system", "content": "You are a assistant."}, {"role": "user", "content": "hi"}]
+
+@pytest.fixture
+def cache_metrics(monkeypatch):
+    counters = Metrics()
+    monkeypatch.setattr("src.services.response_cache.metrics", counters)
+    return counters
+
+def test_key_depends_on_model_and_messages():
+    key = ResponseCache.key("a", MESSAGES)
+    assert key == ResponseCache.key("a", [dict(m) for m in MESSAGES])
+    assert key != ResponseCache.key("b", MESSAGES)
+    assert key != ResponseCache.key("a", MESSAGES[1:])
+
+def test_hits_misses_and_ttl(cache_metrics):
+    cache = ResponseCache(max_entries=10, max_bytes=1024, ttl=60)
+    assert cache.get("k") is None
+    cache.put("k", "hello", "model-a")
+    assert cache.get("k") == ("hello", "model-a")
+
+    cache._entries["k"] = (cache._entries["k"][0] - 61,) + cache._entries["k"][1:]
+    assert cache.get("k") is None
+    assert cache.size_bytes == 0
+    assert cache_metrics.get("response_cache.hits") == 1
+    assert cache_metrics.get("response_cache.misses") == 2
+
+def test_lru_eviction_by_count_and_bytes(cache_metrics):
+    cache = ResponseCache(max_entries=2, max_bytes=10, ttl=60)
+    cache.put("a", "1234", "m")
+    cache.put("b", "1234", "m")
+    cache.get("a")
+    cache.put("c", "1234", "m")
+    assert set(cache._entries) == {"a", "c"}
+
+    cache.put("d", "123456789", "m")
+    assert list(cache._entries) == ["d"]
+    assert cache.size_bytes == 9
+    cache.put("huge", "x" * 11, "m")
+    assert "huge" not in cache._entries
+
+@pytest.mark.asyncio
+async def test_stream_chat_replays_cached_answer(monkeypatch, cache_metrics):
+    monkeypatch.setattr(openrouter, "response_cache", ResponseCache(max_entries=10, max_bytes=1024, ttl=60))
+    calls = []
+
+    class Service(openrouter.OpenRouterService):
+        async def _stream_upstream(self, model, messages, fallbacks=None):
+            calls.append(model)
+            self.last_model = model
+            for chunk in ["Hel", "lo"]:
+                yield chunk
+
+    service = Service(api_key="sk-test")
+    first = [c async for c in service.stream_chat("m", MESSAGES, use_cache=True)]
+    second = "".join([c async for c in service.stream_chat("m", MESSAGES, use_cache=True)])
+    assert "".join(first) == second == "Hello"
+    assert calls == ["m"]
+    assert service.cache_hit and service.last_model == "m"
+
+    [c async for c in service.stream_chat("m", MESSAGES)]
+    assert calls == ["m", "m"]
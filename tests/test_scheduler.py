@@ -0,0 +1,54 @@
+import asyncio
+import pytest
+from src.services.scheduler import KeyScheduler, QueueTimeoutError
+
+async def run_jobs(scheduler, jobs, order):
+    async def job(user_id, weight, tag):
+        await scheduler.acquire(user_id, weight)
+        order.append(tag)
+        await asyncio.sleep(0.01)
+        scheduler.release()
+
+    tasks = []
+    for user_id, weight, tag in jobs:
+        tasks.append(asyncio.create_task(job(user_id, weight, tag)))
+        await asyncio.sleep(0)  # enqueue in submission order
+    await asyncio.gather(*tasks)
+
+@pytest.mark.asyncio
+async def test_heavy_user_does_not_starve_others():
+    scheduler = KeyScheduler(limit=1, max_wait=10)
+    order = []
+    jobs = [(1, 1.0, f"spam{i}") for i in range(5)] + [(2, 1.0, "other")]
+    await run_jobs(scheduler, jobs, order)
+
+    # The second user jumps ahead of the spammer's backlog
+    assert order.index("other") <= 2
+    assert scheduler.active == 0
+
+@pytest.mark.asyncio
+async def test_weighted_user_gets_more_turns():
+    scheduler = KeyScheduler(limit=1, max_wait=10)
+    order = []
+    jobs = [(0, 1.0, "first")]
+    jobs += [(1, 1.0, "normal")] * 4 + [(2, 3.0, "unlimited")] * 4
+    await run_jobs(scheduler, jobs, order)
+
+    assert order[1:5].count("unlimited") >= 3
+
+@pytest.mark.asyncio
+async def test_queue_positions_and_shedding():
+    scheduler = KeyScheduler(limit=1, max_wait=0.05)
+    await scheduler.acquire(1)
+    positions = []
+
+    async def report(position):
+        positions.append(position)
+
+    with pytest.raises(QueueTimeoutError):
+        await scheduler.acquire(2, on_position=report)
+    assert positions == [1]
+    assert scheduler.waiting == 0
+
+    scheduler.release()
+    assert scheduler.active == 0
@@ -0,0 +1,150 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+from telegram.error import BadRequest, RetryAfter
+from src.utils.stream_renderer import StreamRenderer
+
+class FakeBot:
+    def __init__(self, delay=0.0, fail_first=None):
+        self.delay = delay
+        self.fail_first = fail_first
+        self.edits = []
+        self.actions = []
+        self.messages = {}
+
+    async def edit_message_text(self, chat_id, message_id, text, parse_mode=None, reply_markup=None):
+        await asyncio.sleep(self.delay)
+        if self.fail_first:
+            error, self.fail_first = self.fail_first, None
+            raise error
+        self.edits.append(text)
+        self.messages[message_id] = (text, reply_markup)
+
+    async def send_chat_action(self, chat_id, action):
+        self.actions.append(action)
+
+class FakeMessage:
+    chat_id = 1
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.replies = []
+
+    def get_bot(self):
+        return self.bot
+
+    async def reply_text(self, text, parse_mode=None, reply_markup=None):
+        self.replies.append(text)
+        message_id = 41 + len(self.replies)
+        self.bot.messages[message_id] = (text, reply_markup)
+        return SimpleNamespace(message_id=message_id)
+
+def make_renderer(bot, **kwargs):
+    options = {"typing": False, "min_interval": 0.05, "max_interval": 0.5, "reply_markup": "stop"}
+    options.update(kwargs)
+    return StreamRenderer(FakeMessage(bot), **options)
+
+@pytest.mark.asyncio
+async def test_renders_newest_snapshot_and_skips_no_ops():
+    bot = FakeBot()
+    renderer = make_renderer(bot)
+    await renderer.start()
+    assert renderer._message.replies == ["⏳ Thinking..."]
+
+    renderer.append("a")
+    await asyncio.sleep(0.01)
+    for chunk in "bcd":
+        renderer.append(chunk)
+    await asyncio.sleep(0.1)
+    renderer.append("")
+    await asyncio.sleep(0.1)
+    await renderer.close()
+
+    # The first tokens show immediately; intermediate snapshots are coalesced
+    assert bot.edits == ["a\\.\\.\\.", "abcd\\.\\.\\."]
+
+@pytest.mark.asyncio
+async def test_consumer_never_waits_for_slow_edits():
+    bot = FakeBot(delay=0.2)
+    renderer = make_renderer(bot)
+    await renderer.start()
+    started = asyncio.get_running_loop().time()
+    for i in range(100):
+        renderer.append(str(i))
+        await asyncio.sleep(0)
+    assert asyncio.get_running_loop().time() - started < 0.1
+    await asyncio.sleep(0.25)
+    # Slow round trips stretch the interval
+    assert renderer.interval >= 0.4
+    await renderer.close()
+
+@pytest.mark.asyncio
+async def test_retry_after_backs_off_and_retries_latest():
+    bot = FakeBot(fail_first=RetryAfter(1))
+    renderer = make_renderer(bot)
+    await renderer.start()
+    renderer.append("a")
+    await asyncio.sleep(0.05)
+    assert bot.edits == []
+    assert renderer.interval == renderer.max_interval
+    assert renderer._next_edit - asyncio.get_running_loop().time() > 0.8
+    await renderer.close()
+
+@pytest.mark.asyncio
+async def test_typing_mode_sends_message_with_first_content():
+    bot = FakeBot()
+    renderer = make_renderer(bot, typing=True)
+    await renderer.start()
+    await asyncio.sleep(0)
+    assert bot.actions == ["typing"]
+    assert renderer.message_id is None
+
+    renderer.append("hello")
+    await asyncio.sleep(0.01)
+    await renderer.close()
+    assert renderer._message.replies == ["hello\\.\\.\\."]
+    assert renderer.message_id == 42
+
+@pytest.mark.asyncio
+async def test_long_replies_roll_over_into_new_messages():
+    bot = FakeBot()
+    renderer = make_renderer(bot, min_interval=0.0, page_limit=120)
+    await renderer.start()
+    text = "First paragraph here.\n\n```python\n" + "\n".join(f"x = {i}" for i in range(40)) + "\n```\nBye."
+    for i in range(0, len(text), 7):
+        renderer.append(text[i:i + 7])
+        await asyncio.sleep(0)
+    await renderer.finish(" Done.")
+
+    messages = [bot.messages[message_id] for message_id in sorted(bot.messages)]
+    assert len(messages) >= 3
+    assert all(len(body) <= 120 for body, _ in messages)
+    # Only the live message carries the Stop button, and it is gone once finished
+    assert all(markup is None for _, markup in messages)
+    # Fences cut between messages are closed and reopened
+    assert all(body.count("```") % 2 == 0 for body, _ in messages)
+    assert messages[-1][0].endswith("Bye\\. Done\\.")
+    # Every finished page was written exactly once
+    assert len(renderer._message.replies) == len(messages)
+
+@pytest.mark.asyncio
+async def test_rejected_finished_page_falls_back_to_plain_text():
+    bot = FakeBot()
+    renderer = make_renderer(bot, min_interval=0.0, page_limit=60)
+    await renderer.start()
+
+    async def reject_markdown(text, parse_mode=None, reply_markup=None):
+        if parse_mode and len(renderer._message.replies) == 1:
+            raise BadRequest("Can't parse entities")
+        return await FakeMessage.reply_text(renderer._message, text, parse_mode, reply_markup)
+    renderer._message.reply_text = reject_markdown
+
+    # The placeholder is edited into page one; page two is sent as a reply that Telegram rejects once
+    for chunk in ["word " * 10, "\n\n", "more " * 10, "\n\n", "tail " * 5]:
+        renderer.append(chunk)
+        await asyncio.sleep(0.01)
+    assert len(renderer._done_pages) == 0
+    assert renderer._message.replies[1].startswith("more more")
+    # Live rendering carried on into the third message
+    assert len(renderer._message.replies) == 3
+    await renderer.close()
@@ -0,0 +1,49 @@
+import asyncio
+import pytest
+from src.config import Config
+from src.services.context_builder import HEURISTIC, build_context
+from src.services.summarizer import Summarizer, split_for_summary
+
+def make_history(turns: int) -> list[dict]:
+    # 100 tokens each
+    return [{"role": "user" if i % 2 == 0 else "assistant", "content": "x" * 396, "seq": i} for i in range(turns)]
+
+def test_split_keeps_recent_turns_from_a_user_message():
+    history = make_history(10)
+    count = split_for_summary(history, 350, HEURISTIC)
+    assert count == 8
+    assert history[count]["role"] == "user"
+    # Always leaves the last exchange verbatim
+    assert split_for_summary(history, 0, HEURISTIC) == 8
+
+def test_summary_is_part_of_the_system_prompt():
+    messages = build_context("You are a assistant.", make_history(2), "some/model", 8192, "they like tea")
+    assert messages[0]["role"] == "system"
+    assert "they like tea" in messages[0]["content"]
+    assert len(messages) == 3
+
+@pytest.mark.asyncio
+async def test_schedules_one_compaction_per_user(monkeypatch):
+    monkeypatch.setattr(Config, "SUMMARY_ENABLED", True)
+    monkeypatch.setattr(Config, "SUMMARY_TRIGGER_TOKENS", 500)
+    monkeypatch.setattr(Config, "SUMMARY_KEEP_TOKENS", 200)
+    calls = []
+    release = asyncio.Event()
+
+    async def fake_compact(user_id, prefix, summary):
+        calls.append((user_id, len(prefix), summary))
+        await release.wait()
+
+    summarizer = Summarizer()
+    monkeypatch.setattr(summarizer, "_compact", fake_compact)
+
+    summarizer.maybe_schedule(1, make_history(4), None, "some/model")  # below the trigger
+    summarizer.maybe_schedule(1, make_history(10), "old", "some/model")
+    summarizer.maybe_schedule(1, make_history(12), "old", "some/model")  # already running
+    await asyncio.sleep(0)
+    assert calls == [(1, 8, "old")]
+
+    release.set()
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    assert not summarizer._tasks
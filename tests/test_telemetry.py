@@ -0,0 +1,50 @@
+from src.services.catalog import FreeModelIndex
+from src.services.model_info import ModelInfo
+from src.services.telemetry import ModelTelemetry
+
+FREE = {"prompt": "0", "completion": "0"}
+MODELS = [
+    ModelInfo.from_api({"id": "google/gemma:free", "context_length": 8192, "pricing": FREE}),
+    ModelInfo.from_api({"id": "meta-llama/llama:free", "context_length": 8192, "pricing": FREE}),
+    ModelInfo.from_api({"id": "qwen/qwen3:free", "context_length": 32768, "pricing": FREE}),
+]
+
+def ids(models):
+    return [m.id for m in models]
+
+def test_rate_limited_model_sinks_below_healthy_tiers(tmp_path):
+    telemetry = ModelTelemetry(window=600, path=str(tmp_path / "stats.json"))
+    index = FreeModelIndex(MODELS)
+    assert ids(index.live_ranked(telemetry)) == ["google/gemma:free", "meta-llama/llama:free", "qwen/qwen3:free"]
+
+    for _ in range(5):
+        telemetry.record_error("google/gemma:free", rate_limited=True)
+        telemetry.record_success("meta-llama/llama:free", ttft=0.5, tokens_per_second=80)
+    telemetry.publish()
+
+    assert telemetry.aggregates["google/gemma:free"]["rate_limit_rate"] == 1.0
+    assert ids(index.live_ranked(telemetry)) == ["meta-llama/llama:free", "qwen/qwen3:free", "google/gemma:free"]
+
+def test_speed_reorders_within_tier_only(tmp_path):
+    telemetry = ModelTelemetry(window=600, path=str(tmp_path / "stats.json"))
+    for _ in range(5):
+        telemetry.record_success("google/gemma:free", ttft=9.0, tokens_per_second=5)
+        telemetry.record_success("meta-llama/llama:free", ttft=0.4, tokens_per_second=90)
+        telemetry.record_success("qwen/qwen3:free", ttft=0.1, tokens_per_second=200)
+    telemetry.publish()
+
+    ranked = FreeModelIndex(MODELS).live_ranked(telemetry)
+    assert ids(ranked) == ["meta-llama/llama:free", "google/gemma:free", "qwen/qwen3:free"]
+
+def test_aggregates_survive_restart(tmp_path):
+    path = str(tmp_path / "stats.json")
+    telemetry = ModelTelemetry(window=600, path=path)
+    for _ in range(3):
+        telemetry.record_error("google/gemma:free", rate_limited=False)
+    telemetry.publish()
+    telemetry.save()
+
+    restored = ModelTelemetry(window=600, path=path)
+    restored.load()
+    assert restored.adjustments["google/gemma:free"] < 0
+    assert restored.epoch == 1
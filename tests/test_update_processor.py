@@ -0,0 +1,52 @@
+import asyncio
+import pytest
+from telegram import CallbackQuery, Chat, Message, Update, User
+from src.utils.update_processor import PerUserUpdateProcessor
+
+CHAT = Chat(1, "private")
+
+def message(update_id: int, user_id: int) -> Update:
+    user = User(user_id, "U", False)
+    return Update(update_id, message=Message(update_id, None, CHAT, from_user=user, text="hi"))
+
+def stop(update_id: int, user_id: int) -> Update:
+    user = User(user_id, "U", False)
+    return Update(update_id, callback_query=CallbackQuery(str(update_id), user, "chat", data="stop_gen_1"))
+
+@pytest.mark.asyncio
+async def test_one_user_in_order_others_in_parallel():
+    processor = PerUserUpdateProcessor(8)
+    log = []
+
+    async def handle(name: str, delay: float):
+        log.append(f"start {name}")
+        await asyncio.sleep(delay)
+        log.append(f"end {name}")
+
+    await asyncio.gather(
+        processor.process_update(message(1, 10), handle("a1", 0.05)),
+        processor.process_update(message(2, 10), handle("a2", 0)),
+        processor.process_update(message(3, 20), handle("b1", 0)),
+    )
+    # User 10's second message waits for the first; user 20 doesn't
+    assert log.index("end a1") < log.index("start a2")
+    assert log.index("end b1") < log.index("end a1")
+    assert processor._locks == {}
+
+@pytest.mark.asyncio
+async def test_stop_bypasses_the_users_queue():
+    processor = PerUserUpdateProcessor(1)
+    stopped = asyncio.Event()
+
+    async def generation():
+        await asyncio.wait_for(stopped.wait(), 1)
+
+    async def press_stop():
+        stopped.set()
+
+    # The generation holds the user's turn and the only slot until Stop runs
+    await asyncio.gather(
+        processor.process_update(message(1, 10), generation()),
+        processor.process_update(stop(2, 10), press_stop()),
+    )
+    assert stopped.is_set()
@@ -0,0 +1,84 @@
+import pytest
+import pytest_asyncio
+from types import SimpleNamespace
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from src.config import Config
+from src.database.core import Base
+from src.database.models import UsageRecord, User
+from src.services.openrouter import parse_usage
+from src.services.usage import UsageLedger, top_users_by_requests, usage_by_day, usage_by_model
+
+@pytest_asyncio.fixture
+async def db_session():
+    engine = create_async_engine("sqlite+aiosqlite:///:memory:", echo=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    SessionLocal = async_sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+    async with SessionLocal() as session:
+        yield session
+    await engine.dispose()
+
+def test_parse_usage_with_and_without_cost():
+    usage = SimpleNamespace(prompt_tokens=12, completion_tokens=30, cost=0.0021)
+    assert parse_usage(usage) == {"prompt_tokens": 12, "completion_tokens": 30, "cost": 0.0021}
+    assert parse_usage(SimpleNamespace(prompt_tokens=1, completion_tokens=None))["cost"] is None
+
+@pytest.mark.asyncio
+async def test_batched_flush_and_aggregates(db_session, monkeypatch):
+    monkeypatch.setattr(Config, "OPENROUTER_API_KEY", "sk-shared")
+    ledger = UsageLedger()
+    ledger.record(1, "a/free", "sk-shared", {"prompt_tokens": 10, "completion_tokens": 5, "cost": None}, 900)
+    ledger.record(2, "a/free", "sk-user", {"prompt_tokens": 20, "completion_tokens": 5, "cost": None}, 1100)
+    ledger.record(2, "b/paid", "sk-user", {"prompt_tokens": 1, "completion_tokens": 1, "cost": 0.5}, 300)
+    assert len(ledger) == 3
+
+    assert await ledger.flush(db_session) == 3
+    assert len(ledger) == 0
+    assert await ledger.flush(db_session) == 0
+
+    records = (await db_session.execute(select(UsageRecord).order_by(UsageRecord.id))).scalars().all()
+    assert [r.key_type for r in records] == ["shared", "custom", "custom"]
+
+    assert await usage_by_model(db_session) == [("a/free", 2, 30, 10, None), ("b/paid", 1, 1, 1, 0.5)]
+    [(day, requests, prompt, completion)] = await usage_by_day(db_session)
+    assert (requests, prompt, completion) == (3, 31, 11)
+
+def test_pending_records_are_bounded():
+    ledger = UsageLedger(max_pending=2)
+    for i in range(3):
+        ledger.record(i, "m", "k", {"prompt_tokens": i, "completion_tokens": 0, "cost": None}, 0)
+    assert [r["user_id"] for r in ledger._pending] == [1, 2]
+
+@pytest.mark.asyncio
+async def test_request_counts_are_written_behind(db_session):
+    db_session.add_all([User(id=i, full_name=f"U{i}", usage_count=10 * i) for i in range(1, 4)])
+    await db_session.commit()
+    ledger = UsageLedger()
+    for user_id in [1] * 21 + [2]:
+        ledger.count_request(user_id)
+    assert ledger.pending_requests(1) == 21
+
+    # /stats merges what hasn't been flushed yet
+    total, top = await top_users_by_requests(db_session, 2, ledger.pending_counts())
+    assert total == 60 + 22
+    assert top == [(1, "U1", 31), (3, "U3", 30)]
+
+    await ledger.flush(db_session)
+    assert ledger.pending_requests(1) == 0
+    counts = (await db_session.execute(select(User.usage_count).order_by(User.id))).scalars().all()
+    assert counts == [31, 21, 30]
+    assert (await top_users_by_requests(db_session, 2))[0] == total
+
+@pytest.mark.asyncio
+async def test_stats_merge_pending_records(db_session):
+    ledger = UsageLedger()
+    ledger.record(1, "a/free", "k", {"prompt_tokens": 10, "completion_tokens": 5, "cost": None}, 0)
+    await ledger.flush(db_session)
+    ledger.record(1, "a/free", "k", {"prompt_tokens": 1, "completion_tokens": 1, "cost": None}, 0)
+    ledger.record(1, "b/paid", "k", {"prompt_tokens": 100, "completion_tokens": 0, "cost": 0.25}, 0)
+
+    pending = ledger.pending_records()
+    assert await usage_by_model(db_session, 7, pending) == [("b/paid", 1, 100, 0, 0.25), ("a/free", 2, 11, 6, None)]
+    [(day, requests, prompt, completion)] = await usage_by_day(db_session, 7, pending)
+    assert (requests, prompt, completion) == (3, 111, 6)